@@ -0,0 +1,102 @@
+from bisect import bisect_left, bisect_right
+
+RULE_KINDS = ('below', 'above', 'pct_move', 'new_low', 'new_high')
+
+
+class SortedThresholds:
+    def __init__(self, rules):
+        rules = sorted(rules)
+        self.thresholds = [threshold for threshold, _ in rules]
+        self.rule_ids = [rule_id for _, rule_id in rules]
+
+    def falling(self, prev, value):
+        # Thresholds t with value <= t < prev
+        return self.rule_ids[bisect_left(self.thresholds, value):bisect_left(self.thresholds, prev)]
+
+    def rising(self, prev, value):
+        # Thresholds t with prev < t <= value
+        return self.rule_ids[bisect_right(self.thresholds, prev):bisect_right(self.thresholds, value)]
+
+
+class RuleIndex:
+    # Rules are bucketed by kind. Threshold rules sit in sorted arrays, so a tick moving from prev
+    # to price only visits the rules whose threshold lies between the two (O(log n + k));
+    # N-day low/high rules are grouped by N, so all of them share one extreme per window.
+    def __init__(self, rules):
+        below, above, pct_down, pct_up = [], [], [], []
+        self.new_lows = {}
+        self.new_highs = {}
+        for rule_id, kind, threshold, window_days in rules:
+            if kind == 'below':
+                below.append((threshold, rule_id))
+            elif kind == 'above':
+                above.append((threshold, rule_id))
+            elif kind == 'pct_move':
+                (pct_down if threshold < 0 else pct_up).append((threshold, rule_id))
+            elif kind == 'new_low':
+                self.new_lows.setdefault(window_days or 1, []).append(rule_id)
+            elif kind == 'new_high':
+                self.new_highs.setdefault(window_days or 1, []).append(rule_id)
+        self.below = SortedThresholds(below)
+        self.above = SortedThresholds(above)
+        self.pct_down = SortedThresholds(pct_down)
+        self.pct_up = SortedThresholds(pct_up)
+
+    @property
+    def empty(self):
+        return not (self.below.thresholds or self.above.thresholds or self.pct_down.thresholds or self.pct_up.thresholds or self.new_lows or self.new_highs)
+
+    def max_window(self):
+        return max(list(self.new_lows) + list(self.new_highs), default=0)
+
+    def crossed(self, prev, price, prev_close=None, lows=None, highs=None):
+        # lows/highs map a window N to the N-day extreme before this tick
+        fired = []
+        if prev is not None:
+            if price < prev:
+                fired.extend(self.below.falling(prev, price))
+            elif price > prev:
+                fired.extend(self.above.rising(prev, price))
+            if prev_close:
+                prev_pct = (prev - prev_close) / prev_close * 100
+                pct = (price - prev_close) / prev_close * 100
+                if pct < prev_pct:
+                    fired.extend(self.pct_down.falling(prev_pct, pct))
+                elif pct > prev_pct:
+                    fired.extend(self.pct_up.rising(prev_pct, pct))
+        for window_days, rule_ids in self.new_lows.items():
+            low = (lows or {}).get(window_days)
+            if low is None or price < low:
+                fired.extend(rule_ids)
+        for window_days, rule_ids in self.new_highs.items():
+            high = (highs or {}).get(window_days)
+            if high is None or price > high:
+                fired.extend(rule_ids)
+        return fired
+
+
+def window_extremes(rollups, windows):
+    # rollups are (low, high) pairs for consecutive days, newest first, None for days without ticks
+    lows, highs = {}, {}
+    low = high = None
+    for days, rollup in enumerate(rollups, start=1):
+        if rollup is not None:
+            low = rollup[0] if low is None else min(low, rollup[0])
+            high = rollup[1] if high is None else max(high, rollup[1])
+        if days in windows:
+            lows[days] = low
+            highs[days] = high
+    return lows, highs
+
+
+def describe_rule(kind, threshold, window_days, currency='EUR'):
+    # Completes "..., which is <description>." in a single alert and follows the metal's name in a digest
+    if kind == 'below':
+        return f'below {threshold:.2f} {currency}'
+    if kind == 'above':
+        return f'above {threshold:.2f} {currency}'
+    if kind == 'pct_move':
+        return f'a move of {threshold:+.2f}% versus the previous close'
+    if kind == 'new_low':
+        return 'a new low' if (window_days or 1) == 1 else f'a new {window_days}-day low'
+    return 'a new high' if (window_days or 1) == 1 else f'a new {window_days}-day high'
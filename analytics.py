@@ -0,0 +1,170 @@
+import math
+import threading
+from datetime import date
+
+import numpy as np
+
+
+def ema(values, span, initial=None):
+    # Vectorized recursive EMA: within a block, ema_k = d^(k+1) * (prev + alpha * cumsum(x_i / d^(i+1))),
+    # with blocks short enough that d^-k stays finite
+    alpha = 2.0 / (span + 1)
+    decay = 1.0 - alpha
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    prev = values[0] if initial is None else initial
+    block = max(1, int(600 / -math.log(decay)))
+    for start in range(0, len(values), block):
+        chunk = np.asarray(values[start:start + block], dtype=float)
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (prev + alpha * np.cumsum(chunk / powers))
+        prev = out[start + len(chunk) - 1]
+    return out
+
+
+def rolling_mean(prefix, window):
+    # prefix[i + 1] holds the sum of the first i + 1 values
+    out = np.full(len(prefix) - 1, np.nan)
+    if len(prefix) > window:
+        out[window - 1:] = (prefix[window:] - prefix[:-window]) / window
+    return out
+
+
+def rolling_std(prefix, prefix_sq, window):
+    out = np.full(len(prefix) - 1, np.nan)
+    if len(prefix) > window and window > 1:
+        total = prefix[window:] - prefix[:-window]
+        total_sq = prefix_sq[window:] - prefix_sq[:-window]
+        out[window - 1:] = np.sqrt(np.maximum(total_sq - total * total / window, 0) / (window - 1))
+    return out
+
+
+def to_json_list(values):
+    return [None if math.isnan(value) else value for value in values.tolist()]
+
+
+class PriceAnalytics:
+    # Daily close series kept in contiguous, capacity-doubling NumPy buffers together with the running
+    # state (prefix sums, EMAs, peak, max drawdown) needed to extend it. A tick only rewrites the row of
+    # its own day from the previous row's state, so processed history is never recomputed.
+    def __init__(self, sma_windows=(20, 50, 200), ema_spans=(12, 26), volatility_window=30, periods_per_year=252):
+        self.sma_windows = tuple(sma_windows)
+        self.ema_spans = tuple(ema_spans)
+        self.volatility_window = volatility_window
+        self.periods_per_year = periods_per_year
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.allocate(0)
+
+    def allocate(self, capacity):
+        self.size = 0
+        self.days = np.zeros(capacity, dtype=np.int64)
+        self.close = np.zeros(capacity)
+        self.returns = np.zeros(capacity)
+        self.log_returns = np.zeros(capacity)
+        self.prefix_close = np.zeros(capacity + 1)
+        self.prefix_log = np.zeros(capacity + 1)
+        self.prefix_log_sq = np.zeros(capacity + 1)
+        self.emas = {span: np.zeros(capacity) for span in self.ema_spans}
+        self.peak = np.zeros(capacity)
+        self.drawdown = np.zeros(capacity)
+        self.max_drawdown = np.zeros(capacity)
+
+    def grow(self):
+        capacity = max(16, 2 * len(self.close))
+        for name in ('days', 'close', 'returns', 'log_returns', 'peak', 'drawdown', 'max_drawdown'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        for name in ('prefix_close', 'prefix_log', 'prefix_log_sq'):
+            old = getattr(self, name)
+            new = np.zeros(capacity + 1)
+            new[:self.size + 1] = old[:self.size + 1]
+            setattr(self, name, new)
+        for span, old in self.emas.items():
+            new = np.zeros(capacity)
+            new[:self.size] = old[:self.size]
+            self.emas[span] = new
+
+    def load(self, days, closes):
+        # Full vectorized pass over the stored history, done once per process
+        with self.lock:
+            n = len(closes)
+            closes = np.asarray(closes, dtype=float)
+            self.allocate(max(16, 2 * n))
+            self.size = n
+            self.days[:n] = [day.toordinal() for day in days]
+            self.close[:n] = closes
+            if n:
+                self.returns[0] = np.nan
+                self.log_returns[0] = 0.0
+                self.returns[1:n] = closes[1:] / closes[:-1] - 1
+                self.log_returns[1:n] = np.log(closes[1:] / closes[:-1])
+                self.prefix_close[1:n + 1] = np.cumsum(closes)
+                self.prefix_log[1:n + 1] = np.cumsum(self.log_returns[:n])
+                self.prefix_log_sq[1:n + 1] = np.cumsum(self.log_returns[:n] ** 2)
+                for span in self.ema_spans:
+                    self.emas[span][:n] = ema(closes, span)
+                self.peak[:n] = np.maximum.accumulate(closes)
+                self.drawdown[:n] = closes / self.peak[:n] - 1
+                self.max_drawdown[:n] = np.minimum.accumulate(self.drawdown[:n])
+            self.loaded = True
+
+    def update(self, day, close):
+        with self.lock:
+            ordinal = day.toordinal()
+            if self.size and self.days[self.size - 1] == ordinal:
+                i = self.size - 1
+            elif self.size and self.days[self.size - 1] > ordinal:
+                return
+            else:
+                if self.size == len(self.close):
+                    self.grow()
+                i = self.size
+                self.size += 1
+            self.days[i] = ordinal
+            self.close[i] = close
+            if i == 0:
+                self.returns[i] = np.nan
+                self.log_returns[i] = 0.0
+                for span in self.ema_spans:
+                    self.emas[span][i] = close
+                self.peak[i] = close
+            else:
+                previous = self.close[i - 1]
+                self.returns[i] = close / previous - 1
+                self.log_returns[i] = math.log(close / previous)
+                for span in self.ema_spans:
+                    alpha = 2.0 / (span + 1)
+                    self.emas[span][i] = (1 - alpha) * self.emas[span][i - 1] + alpha * close
+                self.peak[i] = max(self.peak[i - 1], close)
+            self.prefix_close[i + 1] = self.prefix_close[i] + close
+            self.prefix_log[i + 1] = self.prefix_log[i] + self.log_returns[i]
+            self.prefix_log_sq[i + 1] = self.prefix_log_sq[i] + self.log_returns[i] ** 2
+            self.drawdown[i] = close / self.peak[i] - 1
+            self.max_drawdown[i] = self.drawdown[i] if i == 0 else min(self.max_drawdown[i - 1], self.drawdown[i])
+
+    def report(self, days):
+        with self.lock:
+            n = self.size
+            start = max(0, n - days)
+            # Rolling windows reach back before the requested slice, so they are computed on a padded range
+            lookback = max((0,) + self.sma_windows + (self.volatility_window,))
+            base = max(0, start - lookback)
+            offset = start - base
+            volatility = rolling_std(self.prefix_log[base:n + 1] - self.prefix_log[base], self.prefix_log_sq[base:n + 1] - self.prefix_log_sq[base], self.volatility_window)
+            if base == 0:
+                # The first log return is a placeholder, keep it out of the first window
+                volatility[:self.volatility_window] = np.nan
+            return {
+                'days': [date.fromordinal(ordinal).isoformat() for ordinal in self.days[start:n].tolist()],
+                'close': to_json_list(self.close[start:n]),
+                'daily_returns': to_json_list(self.returns[start:n]),
+                'sma': {str(window): to_json_list(rolling_mean(self.prefix_close[base:n + 1] - self.prefix_close[base], window)[offset:]) for window in self.sma_windows},
+                'ema': {str(span): to_json_list(self.emas[span][start:n]) for span in self.ema_spans},
+                'volatility': to_json_list(volatility[offset:] * math.sqrt(self.periods_per_year)),
+                'drawdown': to_json_list(self.drawdown[start:n]),
+                'max_drawdown': float(self.max_drawdown[n - 1]) if n else None
+            }
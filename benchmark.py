@@ -0,0 +1,1009 @@
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import parse_qs, quote, urlsplit
+
+import click
+import msal
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from analytics import PriceAnalytics
+from bulk_io import PRICE_COLUMNS, read_rows
+from ingest import IngestWriter
+
+# Offline benchmarks. `replay` runs the whole tick pipeline: prices come from a seeded random walk or an exported
+# tape and are served by a local stand-in for the spot, FX and Graph APIs; MSAL is replaced in-process. Its report
+# covers ticks/sec and per-stage latency, bulk import, DB growth, memory, /get_data under concurrent clients and
+# retention compaction, and can be checked against a previous report in CI. The other commands each measure one
+# subsystem in isolation.
+#
+#   python benchmark.py replay --ticks 2000 --output bench.json
+#   python benchmark.py replay --baseline bench.json --tolerance 0.25
+#   python benchmark.py rules --rules 100000
+#   python benchmark.py ingest --samples 50000 --producers 4 --readers 2
+#   python benchmark.py analytics --years 5
+#   python benchmark.py queries --years 3
+#   python benchmark.py today-cache --clients 8
+
+OUNCE_GRAMS = 31.1034768
+STARTING_SPOT = {'XAU': 2650.0, 'XAG': 31.0, 'XPT': 960.0}
+STARTING_FX = {'EUR': 0.92, 'GBP': 0.79, 'CHF': 0.88}
+HTTP_MIX = ('today', 'history', 'revalidate')
+# (report path, True when higher is better)
+CHECKS = [
+    (('replay', 'ticks_per_sec'), True),
+    (('replay', 'stages', 'tick', 'p99_ms'), False),
+    (('import', 'rows_per_sec'), True),
+    (('http', 'requests_per_sec'), True),
+    (('compact', 'seconds'), False),
+]
+
+
+def synthetic_tape(ticks, start, interval, seed, instruments, currencies):
+    # Geometric random walk in USD per ounce plus USD-based FX rates, the shape the real APIs quote
+    rng = random.Random(seed)
+    spot = {instrument: STARTING_SPOT.get(instrument, 100.0) for instrument in instruments}
+    fx = {currency: STARTING_FX.get(currency, 1.0) for currency in currencies if currency != 'USD'}
+    for i in range(ticks):
+        for instrument in spot:
+            spot[instrument] *= math.exp(rng.gauss(0, 0.0006))
+        for currency in fx:
+            fx[currency] *= math.exp(rng.gauss(0, 0.0001))
+        yield start + timedelta(seconds=i * interval), dict(spot), dict(fx)
+
+
+def recorded_tape(path, requested_format=None):
+    # An export file (see the export command) turned back into upstream quotes. Spot prices come from the
+    # USD series and FX rates from each currency's ratio to USD; ticks without a USD price are skipped and a
+    # currency missing from a tick keeps its previous rate (STARTING_FX until it first appears).
+    ticks = defaultdict(dict)
+    fx = dict(STARTING_FX)
+    for chunk in read_rows(path, PRICE_COLUMNS, requested_format):
+        for timestamp, instrument, currency, price in chunk:
+            ticks[timestamp][instrument, currency] = float(price)
+    for timestamp in sorted(ticks):
+        prices = ticks[timestamp]
+        spot = {instrument: price * OUNCE_GRAMS for (instrument, currency), price in prices.items() if currency == 'USD'}
+        if not spot:
+            continue
+        fx = dict(fx)
+        for (instrument, currency), price in prices.items():
+            if currency != 'USD' and instrument in spot:
+                fx[currency] = price * OUNCE_GRAMS / spot[instrument]
+        yield datetime.fromisoformat(timestamp), spot, fx
+
+
+class UpstreamStandIn:
+    # Local HTTP server answering the price, FX and Graph endpoints from the current tape tick. Paths are
+    # prefixed with the provider name, so each provider's base_url points at its own prefix.
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tick = ({}, {})
+        self.requests = Counter()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real APIs, so the fetcher's connection pool is exercised
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.reply(*stand_in.respond('GET', self.path))
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.reply(*stand_in.respond('POST', self.path))
+
+            def reply(self, status, payload):
+                body = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='upstream-stand-in', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def respond(self, method, path):
+        if self.latency:
+            threading.Event().wait(self.latency)
+        parts = urlsplit(path)
+        segments = parts.path.strip('/').split('/')
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        provider = segments[0]
+        self.requests[provider] += 1
+        spot, fx = self.tick
+        rates = dict(fx, USD=1.0)
+        if provider == 'gold-api':
+            if segments[-1] not in spot:
+                return 503, {'error': 'no quote'}
+            return 200, {'symbol': segments[-1], 'price': spot[segments[-1]]}
+        if provider == 'goldprice.org':
+            return 200, {'items': [{f'{instrument.lower()}Price': price for instrument, price in spot.items()}]}
+        if provider == 'frankfurter':
+            return 200, {'base': query.get('from'), 'rates': {query.get('to'): rates.get(query.get('to'))}}
+        if provider == 'open.er-api':
+            return 200, {'base_code': segments[-1], 'rates': rates}
+        if provider == 'graph' and method == 'POST' and segments[-1] == 'sendMail':
+            return 202, None
+        return 404, {'error': 'unknown endpoint'}
+
+
+class LocalMsalApp:
+    # Stand-in for msal.ConfidentialClientApplication; every token request succeeds without a network call
+    def __init__(self, *args, **kwargs):
+        self.token_requests = 0
+
+    def get_accounts(self):
+        return []
+
+    def acquire_token_silent(self, scopes, account=None, force_refresh=False):
+        return None
+
+    def acquire_token_by_refresh_token(self, refresh_token, scopes):
+        self.token_requests += 1
+        return {'access_token': 'replay-token', 'expires_in': 3600}
+
+    def get_authorization_request_url(self, scopes, redirect_uri=None, **kwargs):
+        return redirect_uri
+
+    def acquire_token_by_authorization_code(self, code, scopes, redirect_uri=None, **kwargs):
+        return self.acquire_token_by_refresh_token(code, scopes)
+
+
+def load_app(database_path, upstream):
+    # gold_tracker builds its MSAL client and engine at import time, so both are redirected first
+    os.environ['GOLD_TRACKER_DATABASE_URI'] = f'sqlite:///{database_path}'
+    msal.ConfidentialClientApplication = LocalMsalApp
+    import gold_tracker
+    gold_tracker.app.config['GRAPH_URL'] = f'{upstream.url}/graph/v1.0'
+    # Deliver on every worker pass instead of holding alerts for the coalescing window
+    gold_tracker.app.config['ALERT_COALESCE_WINDOW'] = 0
+    for chain in (gold_tracker.spot_providers, gold_tracker.fx_providers):
+        for provider in chain.providers:
+            provider.base_url = f'{upstream.url}/{provider.name}'
+    with gold_tracker.app.app_context():
+        gold_tracker.migrate_db()
+        gold_tracker.db.session.add(gold_tracker.RefreshToken(token='replay-refresh-token'))
+        gold_tracker.db.session.commit()
+    return gold_tracker
+
+
+def add_subscribers(gt, count, spot, fx, seed):
+    # A spread of rule kinds over every series, with thresholds around the tape's opening prices
+    rng = random.Random(seed)
+    rates = dict(fx, USD=1.0)
+    series = [(instrument, currency) for instrument in spot for currency in rates if currency in gt.app.config['CURRENCIES']]
+    with gt.app.app_context():
+        for i in range(count):
+            subscriber = gt.Subscriber(email=f'subscriber{i}@example.com', enabled=True)
+            for kind in gt.RULE_KINDS:
+                instrument, currency = rng.choice(series)
+                price = spot[instrument] / OUNCE_GRAMS * rates[currency]
+                threshold = {'below': price * rng.uniform(0.99, 1.0), 'above': price * rng.uniform(1.0, 1.01), 'pct_move': rng.choice((-1, 1)) * rng.uniform(0.2, 1.0)}.get(kind)
+                window_days = rng.choice((1, 7, 30)) if kind in ('new_low', 'new_high') else None
+                subscriber.rules.append(gt.AlertRule(instrument=instrument, currency=currency, kind=kind, threshold=threshold, window_days=window_days, cooldown_seconds=3600))
+            gt.db.session.add(subscriber)
+        gt.db.session.commit()
+        gt.subscribers_changed()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(seconds):
+    if not seconds:
+        return {'count': 0}
+    return {
+        'count': len(seconds),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 3),
+        'max_ms': round(max(seconds) * 1000, 3)
+    }
+
+
+def database_bytes(gt, path):
+    # Checkpointed first, so the number is the database's size rather than how much WAL has piled up
+    with gt.app.app_context():
+        gt.db.session.execute(gt.db.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        gt.db.session.commit()
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def bulk_import(gt, database_path, rows, end, interval, seed):
+    # Synthetic history for every series ending where the replay starts, fed through import_prices in chunks
+    instruments, currencies = list(gt.app.config['INSTRUMENTS']), gt.app.config['CURRENCIES']
+    timestamps = math.ceil(rows / (len(instruments) * len(currencies)))
+    tape = synthetic_tape(timestamps, end - timedelta(seconds=timestamps * interval), interval, seed, instruments, currencies)
+
+    def chunks():
+        chunk, produced = [], 0
+        for timestamp, spot, fx in tape:
+            rates = dict(fx, USD=1.0)
+            for instrument in instruments:
+                for currency in currencies:
+                    if produced < rows:
+                        chunk.append((timestamp, instrument, currency, spot[instrument] / OUNCE_GRAMS * rates[currency]))
+                        produced += 1
+            if len(chunk) >= gt.app.config['BULK_CHUNK_SIZE']:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    size_before = database_bytes(gt, database_path)
+    started = perf_counter()
+    with gt.app.app_context():
+        inserted, total = gt.import_prices(chunks())
+    seconds = perf_counter() - started
+    return {
+        'rows': total,
+        'inserted': inserted,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(total / seconds, 1),
+        'db_bytes_added': database_bytes(gt, database_path) - size_before,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def replay(gt, database_path, tape, upstream, deliver_every):
+    samples = defaultdict(list)
+    observer = gt.tick_stats.observer
+
+    def record(stage, seconds):
+        observer(stage, seconds)
+        samples[stage].append(seconds)
+
+    gt.tick_stats.observer = record
+    size_before = database_bytes(gt, database_path)
+    ticks = failed = 0
+    started = perf_counter()
+    try:
+        for timestamp, spot, fx in tape:
+            upstream.tick = (spot, fx)
+            tick_started = perf_counter()
+            if not gt.sample_tick(timestamp.replace(tzinfo=timezone.utc).timestamp(), now=timestamp):
+                failed += 1
+            samples['tick'].append(perf_counter() - tick_started)
+            ticks += 1
+            if deliver_every and ticks % deliver_every == 0:
+                deliver_started = perf_counter()
+                gt.deliver_alerts()
+                samples['deliver'].append(perf_counter() - deliver_started)
+    finally:
+        gt.tick_stats.observer = observer
+    seconds = perf_counter() - started
+    size_added = database_bytes(gt, database_path) - size_before
+    return {
+        'ticks': ticks,
+        'failed': failed,
+        'seconds': round(seconds, 3),
+        'ticks_per_sec': round(ticks / seconds, 2),
+        'stages': {stage: summarize(values) for stage, values in sorted(samples.items())},
+        'db_bytes_added': size_added,
+        'db_bytes_per_tick': round(size_added / ticks, 1) if ticks else None,
+        'alerts_sent': upstream.requests['graph'],
+        'upstream_requests': dict(upstream.requests),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log(self, type, message, *args):
+        pass
+
+
+def http_load(gt, clients, requests_per_client, history_from):
+    # Concurrent clients against the real WSGI app on a threaded local server, cycling through today's series,
+    # a downsampled history range and a conditional revalidation of today's series
+    server = make_server('127.0.0.1', 0, gt.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name='http-benchmark', daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    series = f"instrument={next(iter(gt.app.config['INSTRUMENTS']))}&currency={gt.app.config['DEFAULT_SERIES'][1]}"
+    paths = {
+        'today': f'/get_data?{series}',
+        'history': f'/get_data?{series}&from={quote(history_from.isoformat())}&max_points=1000',
+    }
+    paths['revalidate'] = paths['today']
+    etag = requests.get(base + paths['today']).headers.get('ETag')
+    results = defaultdict(list)
+    statuses = Counter()
+    sizes = defaultdict(list)
+    lock = threading.Lock()
+
+    def client(number):
+        session = requests.Session()
+        for i in range(requests_per_client):
+            kind = HTTP_MIX[(number + i) % len(HTTP_MIX)]
+            headers = {'If-None-Match': etag} if kind == 'revalidate' and etag else {}
+            started = perf_counter()
+            response = session.get(base + paths[kind], headers=headers)
+            body = response.raw.tell() if response.raw is not None else len(response.content)
+            with lock:
+                results[kind].append(perf_counter() - started)
+                statuses[response.status_code] += 1
+                sizes[kind].append(body)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = perf_counter() - started
+    server.shutdown()
+    total = sum(statuses.values())
+    return {
+        'clients': clients,
+        'requests': total,
+        'seconds': round(seconds, 3),
+        'requests_per_sec': round(total / seconds, 1),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'endpoints': {kind: dict(summarize(results[kind]), mean_bytes=round(sum(sizes[kind]) / len(sizes[kind]))) for kind in HTTP_MIX if results[kind]},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def compact(gt, database_path, now):
+    size_before = database_bytes(gt, database_path)
+    started = perf_counter()
+    with gt.app.app_context():
+        days = gt.apply_retention(now)
+    seconds = perf_counter() - started
+    return {
+        'days': days,
+        'seconds': round(seconds, 3),
+        'db_bytes_before': size_before,
+        'db_bytes_after': database_bytes(gt, database_path),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def linear_crossed(rules, prev, price, prev_close, lows, highs):
+    # The per-rule scan RuleIndex replaces, for comparison
+    fired = []
+    for rule_id, kind, threshold, window_days in rules:
+        if kind == 'below':
+            hit = price <= threshold < prev
+        elif kind == 'above':
+            hit = prev < threshold <= price
+        elif kind == 'pct_move':
+            prev_pct, pct = (prev - prev_close) / prev_close * 100, (price - prev_close) / prev_close * 100
+            hit = pct <= threshold < prev_pct if threshold < 0 else prev_pct < threshold <= pct
+        elif kind == 'new_low':
+            hit = price < lows[window_days]
+        else:
+            hit = price > highs[window_days]
+        if hit:
+            fired.append(rule_id)
+    return fired
+
+
+def rule_evaluation(gt, count, ticks, seed):
+    # count rules on one series, so every tick is evaluated against all of them, then a random walk stored
+    # through store_prices; the index and a linear scan are also timed on their own over the same ticks
+    rng = random.Random(seed)
+    series = gt.app.config['DEFAULT_SERIES']
+    price = STARTING_SPOT[series[0]] / OUNCE_GRAMS * STARTING_FX.get(series[1], 1.0)
+    per_subscriber = 100
+    interval = gt.app.config['SAMPLE_INTERVAL']
+    first = datetime.utcfromtimestamp(math.floor(datetime.now(timezone.utc).timestamp() / interval) * interval) - timedelta(seconds=ticks * interval)
+    with gt.app.app_context():
+        # Yesterday's close, for the percent-move rules
+        gt.import_prices([[(first - timedelta(days=1), series[0], series[1], price)]])
+        gt.db.session.execute(gt.db.insert(gt.Subscriber), [{'email': f'subscriber{i}@example.com', 'enabled': True} for i in range(math.ceil(count / per_subscriber))])
+        subscriber_ids = [subscriber_id for subscriber_id, in gt.db.session.query(gt.Subscriber.id).order_by(gt.Subscriber.id)]
+        rules = []
+        for i in range(count):
+            kind = gt.RULE_KINDS[i % len(gt.RULE_KINDS)]
+            threshold = {'below': price * rng.uniform(0.97, 1.0), 'above': price * rng.uniform(1.0, 1.03), 'pct_move': rng.choice((-1, 1)) * rng.uniform(0.1, 3.0)}.get(kind)
+            window_days = rng.choice((1, 7, 30)) if kind in ('new_low', 'new_high') else None
+            rules.append({'subscriber_id': subscriber_ids[i // per_subscriber], 'instrument': series[0], 'currency': series[1], 'kind': kind, 'threshold': threshold, 'window_days': window_days, 'cooldown_seconds': 3600, 'enabled': True})
+        gt.db.session.execute(gt.db.insert(gt.AlertRule), rules)
+        gt.db.session.commit()
+        gt.subscribers_changed()
+        started = perf_counter()
+        index = gt.rule_indexes.get(series)
+        build_seconds = perf_counter() - started
+        rules = [(rule_id, kind, threshold, window_days) for rule_id, kind, threshold, window_days in gt.db.session.query(gt.AlertRule.id, gt.AlertRule.kind, gt.AlertRule.threshold, gt.AlertRule.window_days)]
+
+    samples = defaultdict(list)
+    observer = gt.tick_stats.observer
+
+    def record(stage, seconds):
+        observer(stage, seconds)
+        samples[stage].append(seconds)
+
+    prev_close = prev = price
+    low = high = price
+    fired = 0
+    gt.tick_stats.observer = record
+    try:
+        for i in range(ticks):
+            price *= 1 + rng.gauss(0, 0.0005)
+            lows, highs = {window: low for window in (1, 7, 30)}, {window: high for window in (1, 7, 30)}
+            started = perf_counter()
+            indexed = index.crossed(prev, price, prev_close, lows, highs)
+            samples['index'].append(perf_counter() - started)
+            started = perf_counter()
+            scanned = linear_crossed(rules, prev, price, prev_close, lows, highs)
+            samples['linear'].append(perf_counter() - started)
+            if sorted(indexed) != sorted(scanned):
+                raise click.ClickException(f"index and linear scan disagree at tick {i}")
+            fired += len(indexed)
+            gt.store_prices([(first + timedelta(seconds=i * interval), series, price)])
+            prev, low, high = price, min(low, price), max(high, price)
+    finally:
+        gt.tick_stats.observer = observer
+    with gt.app.app_context():
+        enqueued = gt.OutboxMessage.query.count()
+    return {
+        'rules': count,
+        'ticks': ticks,
+        'index_build_seconds': round(build_seconds, 3),
+        'rules_crossed_per_tick': round(fired / ticks, 1) if ticks else None,
+        'alerts_enqueued': enqueued,
+        'stages': {stage: summarize(samples[stage]) for stage in ('index', 'linear', 'alert', 'db')},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def ingest_load(gt, samples, producers, rate, readers, seed):
+    # producers threads submit samples to a fresh IngestWriter without waiting for each, paced to rate samples/s
+    # in total (0 for as fast as they can), while readers poll today's series and a raw-tier history range
+    rng = random.Random(seed)
+    instruments, currencies = list(gt.app.config['INSTRUMENTS']), gt.app.config['CURRENCIES']
+    series = [(instrument, currency) for instrument in instruments for currency in currencies]
+    base = {(instrument, currency): STARTING_SPOT.get(instrument, 100.0) / OUNCE_GRAMS * STARTING_FX.get(currency, 1.0) for instrument, currency in series}
+    # One sample per series per second, ending now, so today's series and the raw tier both see them
+    seconds = math.ceil(samples / len(series))
+    first = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=seconds)
+    tape = [(first + timedelta(seconds=i // len(series)), series[i % len(series)], base[series[i % len(series)]] * (1 + rng.gauss(0, 0.001))) for i in range(samples)]
+    batch_sizes = []
+
+    def write_batch(batch):
+        batch_sizes.append(len(batch))
+        return gt.store_prices(batch)
+
+    writer = IngestWriter(write_batch, batch_size=gt.app.config['INGEST_BATCH_SIZE'], linger=gt.app.config['INGEST_LINGER'])
+    db_seconds = []
+    observer = gt.tick_stats.observer
+
+    def record(stage, seconds):
+        observer(stage, seconds)
+        if stage == 'db':
+            db_seconds.append(seconds)
+
+    query = f'instrument={series[0][0]}&currency={series[0][1]}'
+    paths = [f'/get_data?{query}', f"/get_data?{query}&from={quote(first.isoformat())}&max_points=500"]
+    read_seconds = []
+    read_errors = Counter()
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def reader(number):
+        client = gt.app.test_client()
+        i = number
+        while not done.is_set():
+            started = perf_counter()
+            response = client.get(paths[i % len(paths)])
+            with lock:
+                read_seconds.append(perf_counter() - started)
+                if response.status_code != 200:
+                    read_errors[response.status_code] += 1
+            i += 1
+
+    futures = [[] for _ in range(producers)]
+
+    def producer(number):
+        own = tape[number::producers]
+        pace = producers / rate if rate else 0
+        started = perf_counter()
+        for i, sample in enumerate(own):
+            if pace:
+                delay = started + i * pace - perf_counter()
+                if delay > 0:
+                    done.wait(delay)
+            futures[number].append(writer.submit(*sample))
+
+    gt.tick_stats.observer = record
+    reader_threads = [threading.Thread(target=reader, args=(number,), daemon=True) for number in range(readers)]
+    producer_threads = [threading.Thread(target=producer, args=(number,)) for number in range(producers)]
+    try:
+        for thread in reader_threads:
+            thread.start()
+        started = perf_counter()
+        for thread in producer_threads:
+            thread.start()
+        for thread in producer_threads:
+            thread.join()
+        failed = 0
+        for future in [future for own in futures for future in own]:
+            try:
+                future.result()
+            except Exception:
+                failed += 1
+        seconds = perf_counter() - started
+    finally:
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        gt.tick_stats.observer = observer
+    return {
+        'samples': samples,
+        'failed': failed,
+        'producers': producers,
+        'target_rate': rate or None,
+        'seconds': round(seconds, 3),
+        'samples_per_sec': round(samples / seconds, 1),
+        'batches': len(batch_sizes),
+        'batch_size': {'mean': round(sum(batch_sizes) / len(batch_sizes), 1), 'p50': percentile(batch_sizes, 0.5), 'max': max(batch_sizes)} if batch_sizes else None,
+        'batch_db': summarize(db_seconds),
+        'reads': dict(summarize(read_seconds), errors=dict(read_errors)),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def flatten(values):
+    if isinstance(values, dict):
+        return [value for key in sorted(values) for value in flatten(values[key])]
+    if isinstance(values, list):
+        return [value for item in values for value in flatten(item)]
+    return [values] if isinstance(values, float) else []
+
+
+def analytics_load(gt, years, ticks, seed):
+    # years of hourly ticks imported for the default series, so DailyRollup holds one close per day, then
+    # /analytics cold and warm, a full recompute against per-tick incremental updates, and a check that both agree
+    rng = random.Random(seed)
+    series = gt.app.config['DEFAULT_SERIES']
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    first = today - timedelta(days=round(years * 365))
+    price = STARTING_SPOT[series[0]] / OUNCE_GRAMS * STARTING_FX.get(series[1], 1.0)
+
+    def chunks():
+        nonlocal price
+        chunk = []
+        timestamp = first
+        while timestamp < today:
+            price *= math.exp(rng.gauss(0, 0.002))
+            chunk.append((timestamp, series[0], series[1], price))
+            timestamp += timedelta(hours=1)
+            if len(chunk) >= gt.app.config['BULK_CHUNK_SIZE']:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with gt.app.app_context():
+        gt.import_prices(chunks())
+        rows = gt.db.session.query(gt.DailyRollup.day, gt.DailyRollup.close).filter(*gt.series_filter(gt.DailyRollup, series)).order_by(gt.DailyRollup.day).all()
+    days, closes = [day for day, _ in rows], [close for _, close in rows]
+    settings = {
+        'sma_windows': gt.app.config['ANALYTICS_SMA_WINDOWS'],
+        'ema_spans': gt.app.config['ANALYTICS_EMA_SPANS'],
+        'volatility_window': gt.app.config['ANALYTICS_VOLATILITY_WINDOW'],
+        'periods_per_year': gt.app.config['ANALYTICS_PERIODS_PER_YEAR']
+    }
+    client = gt.app.test_client()
+    path = f'/analytics?instrument={series[0]}&currency={series[1]}&days=365'
+    started = perf_counter()
+    client.get(path)
+    cold = perf_counter() - started
+    warm = []
+    for _ in range(20):
+        started = perf_counter()
+        client.get(path)
+        warm.append(perf_counter() - started)
+
+    full = []
+    for _ in range(5):
+        analytics = PriceAnalytics(**settings)
+        started = perf_counter()
+        analytics.load(days, closes)
+        full.append(perf_counter() - started)
+    updates = []
+    for i in range(ticks):
+        started = perf_counter()
+        analytics.update(days[-1] + timedelta(days=1 + i // 100), closes[-1] * math.exp(rng.gauss(0, 0.002)))
+        updates.append(perf_counter() - started)
+    reports = {}
+    for window in (365, len(days)):
+        started = perf_counter()
+        analytics.report(window)
+        reports[str(window)] = perf_counter() - started
+
+    # The last 30 days replayed one update at a time must give what a full load over the same closes gives
+    incremental = PriceAnalytics(**settings)
+    incremental.load(days[:-30], closes[:-30])
+    for day, close in zip(days[-30:], closes[-30:]):
+        incremental.update(day, close)
+    reference = PriceAnalytics(**settings)
+    reference.load(days, closes)
+    pairs = list(zip(flatten(incremental.report(len(days))), flatten(reference.report(len(days)))))
+    difference = max((abs(a - b) / max(abs(b), 1e-12) for a, b in pairs if not (math.isnan(a) or math.isnan(b))), default=0.0)
+    return {
+        'days': len(days),
+        'endpoint_cold_ms': round(cold * 1000, 3),
+        'endpoint_warm': summarize(warm),
+        'full_load': summarize(full),
+        'update': summarize(updates),
+        'report_ms': {window: round(seconds * 1000, 3) for window, seconds in reports.items()},
+        'incremental_max_relative_difference': difference,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def query_scaling(gt, years, steps, repeats, seed):
+    # The table grows backwards from now in steps, so today's rows stay the same while the history behind them
+    # grows. At each size the range queries should cost the same; date(timestamp) = day, which cannot use the
+    # timestamp index, is timed alongside for contrast.
+    rng = random.Random(seed)
+    series = gt.app.config['DEFAULT_SERIES']
+    interval = gt.app.config['SAMPLE_INTERVAL']
+    now = datetime.utcfromtimestamp(math.floor(datetime.now(timezone.utc).timestamp() / interval) * interval)
+    today_start, today_end = gt.day_range(now.date())
+    span = timedelta(days=years * 365 / steps)
+    price = STARTING_SPOT[series[0]] / OUNCE_GRAMS * STARTING_FX.get(series[1], 1.0)
+    day_text = now.date().isoformat()
+    queries = {
+        'today_points': lambda: gt.price_points_between(series, today_start, today_end).all(),
+        'today_min': lambda: gt.db.session.query(gt.db.func.min(gt.GoldPrice.price)).filter(*gt.series_filter(gt.GoldPrice, series), gt.GoldPrice.timestamp >= today_start, gt.GoldPrice.timestamp < today_end).scalar(),
+        'hour_points': lambda: gt.price_points_between(series, now - timedelta(hours=1), now).all(),
+        'date_scan': lambda: gt.db.session.query(gt.db.func.min(gt.GoldPrice.price)).filter(*gt.series_filter(gt.GoldPrice, series), gt.db.func.date(gt.GoldPrice.timestamp) == day_text).scalar(),
+    }
+    sizes = []
+    for step in range(steps):
+        end = now - span * step + (timedelta(seconds=interval) if step == 0 else timedelta(0))
+        start = now - span * (step + 1)
+
+        def chunks():
+            nonlocal price
+            chunk = []
+            timestamp = end - timedelta(seconds=interval)
+            while timestamp >= start:
+                price *= 1 + rng.gauss(0, 0.0005)
+                chunk.append((timestamp, series[0], series[1], price))
+                timestamp -= timedelta(seconds=interval)
+                if len(chunk) >= gt.app.config['BULK_CHUNK_SIZE']:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        with gt.app.app_context():
+            gt.import_prices(chunks())
+            rows = gt.db.session.query(gt.db.func.count(gt.GoldPrice.id)).scalar()
+            timings = {}
+            for name, query in queries.items():
+                seconds = []
+                for _ in range(repeats):
+                    started = perf_counter()
+                    query()
+                    seconds.append(perf_counter() - started)
+                timings[name] = summarize(seconds)
+            plan = ' '.join(row[-1] for row in gt.db.session.execute(gt.db.text(
+                "EXPLAIN QUERY PLAN SELECT min(price) FROM gold_price WHERE instrument = :instrument AND currency = :currency AND timestamp >= :start AND timestamp < :end"
+            ), {'instrument': series[0], 'currency': series[1], 'start': gt.timestamp_text(today_start), 'end': gt.timestamp_text(today_end)}))
+        sizes.append({'rows': rows, 'years': round(years * (step + 1) / steps, 2), 'queries': timings, 'plan': plan})
+    first, last = sizes[0]['queries'], sizes[-1]['queries']
+    return {
+        'sizes': sizes,
+        'growth': {name: round(last[name]['p50_ms'] / first[name]['p50_ms'], 2) for name in queries},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def load_path(base, path, clients, requests_per_client):
+    seconds = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        for _ in range(requests_per_client):
+            started = perf_counter()
+            response = session.get(base + path)
+            with lock:
+                seconds.append(perf_counter() - started)
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+    return dict(summarize(seconds), requests_per_sec=round(len(seconds) / elapsed, 1), statuses={str(status): count for status, count in sorted(statuses.items())})
+
+
+def today_cache_load(gt, ticks, clients, requests_per_client, seed):
+    # Today's /get_data served from TodaySeries against the path it replaced: today's GoldPrice rows loaded as
+    # ORM objects and serialized with jsonify on every request. Both run on the same threaded server and data.
+    rng = random.Random(seed)
+    series = gt.app.config['DEFAULT_SERIES']
+    now = datetime.utcnow().replace(microsecond=0)
+    midnight = now.replace(hour=0, minute=0, second=0)
+    spacing = max(1.0, (now - midnight).total_seconds() / ticks)
+    price = STARTING_SPOT[series[0]] / OUNCE_GRAMS * STARTING_FX.get(series[1], 1.0)
+    rows = []
+    for i in range(ticks):
+        timestamp = midnight + timedelta(seconds=i * spacing)
+        if timestamp >= now:
+            break
+        price *= 1 + rng.gauss(0, 0.0005)
+        rows.append((timestamp, series[0], series[1], price))
+    with gt.app.app_context():
+        gt.import_prices([rows])
+
+    def uncached_get_data():
+        start, end = gt.day_range(datetime.utcnow().date())
+        today_prices = gt.GoldPrice.query.filter(*gt.series_filter(gt.GoldPrice, series), gt.GoldPrice.timestamp >= start, gt.GoldPrice.timestamp < end).order_by(gt.GoldPrice.timestamp).all()
+        return gt.jsonify({'timestamps': [p.timestamp.isoformat() for p in today_prices], 'prices': [p.price for p in today_prices], 'instrument': series[0], 'currency': series[1], 'unit': 'g'})
+
+    gt.app.add_url_rule('/benchmark/uncached-get-data', 'benchmark_uncached_get_data', uncached_get_data)
+    server = make_server('127.0.0.1', 0, gt.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name='http-benchmark', daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    try:
+        before = load_path(base, '/benchmark/uncached-get-data', clients, requests_per_client)
+        after = load_path(base, f'/get_data?instrument={series[0]}&currency={series[1]}', clients, requests_per_client)
+    finally:
+        server.shutdown()
+    return {
+        'ticks_today': len(rows),
+        'clients': clients,
+        'before': before,
+        'after': after,
+        'speedup': round(after['requests_per_sec'] / before['requests_per_sec'], 2),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    for path, higher_is_better in CHECKS:
+        current, previous = report, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        if not current or not previous:
+            continue
+        change = current / previous - 1
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            found.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.0%})")
+    return found
+
+
+def print_stages(stages):
+    for stage, stats in stages.items():
+        if stats['count']:
+            print(f"  {stage:<12} p50 {stats['p50_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms  max {stats['max_ms']:>9.3f} ms  n={stats['count']}")
+
+
+def print_report(report):
+    replayed = report['replay']
+    print(f"replay: {replayed['ticks']} ticks in {replayed['seconds']}s, {replayed['ticks_per_sec']} ticks/s, {replayed['failed']} failed, "
+          f"{replayed['db_bytes_per_tick']} DB bytes/tick, {replayed['alerts_sent']} alert emails")
+    print_stages(replayed['stages'])
+    if 'import' in report:
+        imported = report['import']
+        print(f"import: {imported['rows']} rows in {imported['seconds']}s, {imported['rows_per_sec']} rows/s, {imported['db_bytes_added']} DB bytes")
+    if 'http' in report:
+        served = report['http']
+        print(f"http:   {served['requests']} requests from {served['clients']} clients in {served['seconds']}s, {served['requests_per_sec']} req/s, statuses {served['statuses']}")
+        for kind, stats in served['endpoints'].items():
+            print(f"  {kind:<10} p50 {stats['p50_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms  {stats['mean_bytes']} bytes")
+    if 'compact' in report:
+        compacted = report['compact']
+        print(f"compact: {compacted['days']} days in {compacted['seconds']}s, DB {compacted['db_bytes_before']} -> {compacted['db_bytes_after']} bytes")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+
+
+@contextmanager
+def benchmark_app(workdir, upstream_latency=0.0):
+    # Yields (gold_tracker, database path, upstream stand-in); the database is removed afterwards unless workdir was given
+    directory = workdir or tempfile.mkdtemp(prefix='gold-tracker-benchmark-')
+    database_path = os.path.join(os.path.abspath(directory), 'benchmark.db')
+    if os.path.exists(database_path):
+        raise click.UsageError(f"{database_path} already exists, pass an empty --workdir")
+    upstream = UpstreamStandIn(upstream_latency)
+    upstream.start()
+    try:
+        yield load_app(database_path, upstream), database_path, upstream
+    finally:
+        upstream.stop()
+        if not workdir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_report(report, output):
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('replay')
+@click.option('--ticks', default=2000, show_default=True, help="Synthetic ticks to replay")
+@click.option('--tape', 'tape_path', help="Replay an exported CSV/Parquet file instead of a synthetic tape")
+@click.option('--start', help="ISO 8601 time of the first synthetic tick; defaults to ending at the current sample boundary")
+@click.option('--seed', default=1, show_default=True)
+@click.option('--subscribers', default=20, show_default=True, help="Subscribers, each with one rule of every kind")
+@click.option('--deliver-every', default=50, show_default=True, help="Ticks between alert worker passes, 0 to skip delivery")
+@click.option('--upstream-latency', default=0.0, show_default=True, help="Seconds the stand-in APIs wait before answering")
+@click.option('--import-rows', default=200000, show_default=True, help="Rows bulk-imported before the replay, 0 to skip")
+@click.option('--clients', default=8, show_default=True, help="Concurrent /get_data clients, 0 to skip")
+@click.option('--requests', 'requests_per_client', default=200, show_default=True, help="Requests per client")
+@click.option('--no-compact', is_flag=True, help="Skip the retention compaction pass")
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+@click.option('--baseline', help="Previous JSON report; exit 1 when a headline number regressed by more than --tolerance")
+@click.option('--tolerance', default=0.25, show_default=True)
+def replay_command(ticks, tape_path, start, seed, subscribers, deliver_every, upstream_latency, import_rows, clients, requests_per_client, no_compact, workdir, output, baseline, tolerance):
+    with benchmark_app(workdir, upstream_latency) as (gt, database_path, upstream):
+        report = replay_report(gt, database_path, upstream, ticks, tape_path, start, seed, subscribers, deliver_every, import_rows, clients, requests_per_client, no_compact)
+    print_report(report)
+    write_report(report, output)
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(report, json.load(f), tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            raise SystemExit(1)
+
+
+def replay_report(gt, database_path, upstream, ticks, tape_path, start, seed, subscribers, deliver_every, import_rows, clients, requests_per_client, no_compact):
+    interval = gt.app.config['SAMPLE_INTERVAL']
+    if tape_path:
+        tape = list(recorded_tape(tape_path))
+        # Only the instruments the tape quotes are sampled, instead of failing the others on every tick
+        quoted = {instrument for _, spot, _ in tape for instrument in spot}
+        gt.app.config['INSTRUMENTS'] = {instrument: name for instrument, name in gt.app.config['INSTRUMENTS'].items() if instrument in quoted}
+    else:
+        if start:
+            first = gt.parse_timestamp(start)
+        else:
+            now = datetime.now(timezone.utc).timestamp()
+            first = datetime.utcfromtimestamp(math.floor(now / interval) * interval) - timedelta(seconds=(ticks - 1) * interval)
+        tape = list(synthetic_tape(ticks, first, interval, seed, gt.app.config['INSTRUMENTS'], gt.app.config['CURRENCIES']))
+    if not tape:
+        raise click.UsageError("the tape is empty; a recorded tape needs USD prices")
+    report = {'seed': seed, 'tape': tape_path or 'synthetic', 'interval': interval, 'first_tick': tape[0][0].isoformat(), 'last_tick': tape[-1][0].isoformat()}
+    if import_rows:
+        report['import'] = bulk_import(gt, database_path, import_rows, tape[0][0], interval, seed + 1)
+    add_subscribers(gt, subscribers, tape[0][1], tape[0][2], seed)
+    report['replay'] = replay(gt, database_path, tape, upstream, deliver_every)
+    report['token_requests'] = gt.msal_app.token_requests
+    if clients:
+        report['http'] = http_load(gt, clients, requests_per_client, tape[0][0])
+    if not no_compact:
+        # As if the raw retention period had passed since the last replayed tick
+        report['compact'] = compact(gt, database_path, tape[-1][0] + timedelta(days=gt.app.config['RETENTION_DAYS']['raw']))
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+@cli.command('rules')
+@click.option('--rules', 'count', default=100000, show_default=True, help="Synthetic alert rules, all on the default series")
+@click.option('--ticks', default=500, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+def rules_command(count, ticks, seed, workdir, output):
+    with benchmark_app(workdir) as (gt, _, _):
+        report = rule_evaluation(gt, count, ticks, seed)
+    print(f"rules: {report['rules']} rules, index built in {report['index_build_seconds']}s, {report['rules_crossed_per_tick']} crossed per tick, {report['alerts_enqueued']} alerts enqueued")
+    print_stages(report['stages'])
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    write_report(report, output)
+
+
+@cli.command('ingest')
+@click.option('--samples', default=50000, show_default=True)
+@click.option('--producers', default=4, show_default=True, help="Threads submitting samples concurrently")
+@click.option('--rate', default=0, show_default=True, help="Samples/s over all producers, 0 for as fast as possible")
+@click.option('--readers', default=2, show_default=True, help="Threads polling /get_data while samples are written")
+@click.option('--seed', default=1, show_default=True)
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+def ingest_command(samples, producers, rate, readers, seed, workdir, output):
+    with benchmark_app(workdir) as (gt, _, _):
+        report = ingest_load(gt, samples, producers, rate, readers, seed)
+    batch_size = report['batch_size'] or {}
+    print(f"ingest: {report['samples']} samples from {report['producers']} producers in {report['seconds']}s, {report['samples_per_sec']} samples/s, {report['failed']} failed")
+    print(f"  {report['batches']} batches, size mean {batch_size.get('mean')} p50 {batch_size.get('p50')} max {batch_size.get('max')}")
+    print_stages({'batch db': report['batch_db'], 'read': report['reads']})
+    print(f"  read errors {report['reads']['errors']}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    write_report(report, output)
+
+
+@cli.command('analytics')
+@click.option('--years', default=5.0, show_default=True, help="Years of synthetic history")
+@click.option('--ticks', default=10000, show_default=True, help="Incremental updates timed after the full load")
+@click.option('--seed', default=1, show_default=True)
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+def analytics_command(years, ticks, seed, workdir, output):
+    with benchmark_app(workdir) as (gt, _, _):
+        report = analytics_load(gt, years, ticks, seed)
+    print(f"analytics: {report['days']} days, /analytics cold {report['endpoint_cold_ms']} ms, reports {report['report_ms']} ms, "
+          f"incremental vs full max relative difference {report['incremental_max_relative_difference']:.2e}")
+    print_stages({'warm': report['endpoint_warm'], 'load': report['full_load'], 'update': report['update']})
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    write_report(report, output)
+
+
+@cli.command('queries')
+@click.option('--years', default=3.0, show_default=True, help="History in the largest table, one row per sample interval")
+@click.option('--steps', default=3, show_default=True, help="Table sizes measured on the way there")
+@click.option('--repeats', default=50, show_default=True, help="Runs of each query per size")
+@click.option('--seed', default=1, show_default=True)
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+def queries_command(years, steps, repeats, seed, workdir, output):
+    with benchmark_app(workdir) as (gt, _, _):
+        report = query_scaling(gt, years, steps, repeats, seed)
+    for size in report['sizes']:
+        print(f"queries: {size['rows']} rows ({size['years']} years), plan: {size['plan']}")
+        print_stages(size['queries'])
+    print(f"p50 growth from the smallest to the largest table: {report['growth']}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    write_report(report, output)
+
+
+@cli.command('today-cache')
+@click.option('--ticks', default=960, show_default=True, help="Ticks stored for today, spread from midnight to now")
+@click.option('--clients', default=8, show_default=True)
+@click.option('--requests', 'requests_per_client', default=200, show_default=True, help="Requests per client and path")
+@click.option('--seed', default=1, show_default=True)
+@click.option('--workdir', help="Directory for the benchmark database, a temporary one by default")
+@click.option('--output', help="Write the JSON report here")
+def today_cache_command(ticks, clients, requests_per_client, seed, workdir, output):
+    with benchmark_app(workdir) as (gt, _, _):
+        report = today_cache_load(gt, ticks, clients, requests_per_client, seed)
+    print(f"today cache: {report['ticks_today']} ticks today, {report['clients']} clients, "
+          f"{report['before']['requests_per_sec']} req/s before, {report['after']['requests_per_sec']} req/s after ({report['speedup']}x)")
+    print_stages({'before': report['before'], 'after': report['after']})
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    write_report(report, output)
+
+
+if __name__ == '__main__':
+    cli()
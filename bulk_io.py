@@ -0,0 +1,92 @@
+import csv
+
+PRICE_COLUMNS = ('timestamp', 'instrument', 'currency', 'price')
+
+
+def file_format(path, requested=None):
+    if requested:
+        return requested
+    return 'parquet' if path.lower().endswith(('.parquet', '.pq')) else 'csv'
+
+
+def import_pyarrow():
+    # pyarrow is only needed for Parquet files, CSV works without it
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet support needs pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def read_csv(path, columns, chunk_size=50000):
+    # Yields lists of tuples holding the named columns as text, chunk_size rows at a time
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+        indexes = [header.index(column) for column in columns]
+        chunk = []
+        for record in reader:
+            chunk.append(tuple(record[i] for i in indexes))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def read_parquet(path, columns, chunk_size=50000):
+    # Reads one record batch at a time; timestamp columns come back as text in the same form as CSV
+    pa = import_pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    missing = [column for column in columns if column not in parquet_file.schema_arrow.names]
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(columns)):
+        values = []
+        for column in columns:
+            array = batch.column(column)
+            if pa.types.is_timestamp(array.type):
+                array = array.cast(pa.timestamp('us')).cast(pa.string())
+            values.append(array.to_pylist())
+        yield list(zip(*values))
+
+
+def read_rows(path, columns, requested_format=None, chunk_size=50000):
+    reader = read_parquet if file_format(path, requested_format) == 'parquet' else read_csv
+    return reader(path, columns, chunk_size)
+
+
+def write_csv(path, columns, chunks):
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(path, columns, chunks):
+    # One row group per chunk, so memory stays bounded by the chunk size. Only PRICE_COLUMNS rows are written.
+    pa = import_pyarrow()
+    types = {'timestamp': pa.timestamp('us'), 'instrument': pa.string(), 'currency': pa.string(), 'price': pa.float64()}
+    schema = pa.schema([(column, types[column]) for column in columns])
+    rows = 0
+    with pa.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            timestamps, *values = zip(*chunk)
+            arrays = [pa.array(timestamps, type=pa.string()).cast(pa.timestamp('us'))]
+            arrays += [pa.array(column, type=field.type) for column, field in zip(values, list(schema)[1:])]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+def write_rows(path, columns, chunks, requested_format=None):
+    writer = write_parquet if file_format(path, requested_format) == 'parquet' else write_csv
+    return writer(path, columns, chunks)
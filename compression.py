@@ -0,0 +1,24 @@
+import gzip
+
+try:
+    # Brotli is optional; without it responses are gzipped
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+
+def available_encodings():
+    # Preferred first, for Accept.best_match
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(body, encoding):
+    if isinstance(body, str):
+        body = body.encode()
+    if encoding == 'br':
+        # Quality 5 compresses JSON better than gzip -6 at a similar cost; 11 is meant for static files
+        return brotli.compress(body, quality=5)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=6, mtime=0)
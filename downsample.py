@@ -0,0 +1,58 @@
+def lttb(xs, ys, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, per bucket, the point
+    # forming the largest triangle with the previously kept point and the next bucket's average
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+    out_x, out_y = [xs[0]], [ys[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = xs[n - 1], ys[n - 1]
+        else:
+            count = next_end - next_start
+            avg_x = sum(xs[next_start:next_end]) / count
+            avg_y = sum(ys[next_start:next_end]) / count
+        ax, ay = xs[a], ys[a]
+        best_area = -1
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        out_x.append(xs[best])
+        out_y.append(ys[best])
+        a = best
+    out_x.append(xs[n - 1])
+    out_y.append(ys[n - 1])
+    return out_x, out_y
+
+
+def min_max(xs, lows, highs, max_points):
+    # Emits the minimum and maximum of each bucket in time order, so spikes survive decimation.
+    # For raw ticks pass the same list as lows and highs.
+    n = len(xs)
+    if n <= max_points:
+        out_x, out_y = [], []
+        for x, low, high in zip(xs, lows, highs):
+            out_x.append(x)
+            out_y.append(low if low == high else (low + high) / 2)
+        return out_x, out_y
+    buckets = max(1, max_points // 2)
+    bucket_size = n / buckets
+    out_x, out_y = [], []
+    for i in range(buckets):
+        start = int(i * bucket_size)
+        end = max(start + 1, int((i + 1) * bucket_size))
+        low_index = min(range(start, end), key=lows.__getitem__)
+        high_index = max(range(start, end), key=highs.__getitem__)
+        for index, value in sorted(((low_index, lows[low_index]), (high_index, highs[high_index]))):
+            out_x.append(xs[index])
+            out_y.append(value)
+    return out_x, out_y
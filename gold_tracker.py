@@ -1,33 +1,246 @@
 import os
-from datetime import datetime, timedelta
 
+if os.getenv('GOLD_TRACKER_SERVER') == 'gevent':
+    # Must run before anything imports socket/threading so /stream connections become greenlets
+    from gevent import monkey
+    monkey.patch_all()
+
+import hashlib
+import mimetypes
+import re
+import socket
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, time, timedelta, timezone
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import click
 import msal
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, jsonify, redirect, render_template, request, session, url_for
+from flask import Flask, Response, g, jsonify, redirect, render_template, request, send_from_directory, session, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from alert_rules import RULE_KINDS, RuleIndex, describe_rule, window_extremes
+from analytics import PriceAnalytics
+from bulk_io import PRICE_COLUMNS, read_rows, write_rows
+from compression import COMPRESSIBLE_MIMETYPES, available_encodings, compress
+from downsample import lttb, min_max
+from ingest import IngestWriter
+from metrics import SIZE_BUCKETS, Registry
+from price_fetcher import FetchError, PriceFetcher
+from price_providers import build_chain
+from price_stream import PriceHub, format_event
+from profiler import SamplingProfiler
+from rate_cache import RateCache
+from sampler import Sampler, StageStats
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///gold_prices.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('GOLD_TRACKER_DATABASE_URI', 'sqlite:///gold_prices.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['APP_VERSION'] = os.getenv('GOLD_TRACKER_VERSION', 'dev')
 app.config['CLIENT_ID'] = os.getenv('APP_GOLD_PRICE_TRACKER_CLIENT_ID')
 app.config['CLIENT_SECRET'] = os.getenv("APP_GOLD_PRICE_TRACKER_CLIENT_SECRET")
 app.config['AUTHORITY'] = f"https://login.microsoftonline.com/{os.getenv('SYNVERT_TENANT_ID')}"
 app.config['REDIRECT_URI'] = "http://localhost:5000/get_token"
 app.config['SCOPES'] = ["https://graph.microsoft.com/Mail.Send", "https://graph.microsoft.com/User.Read"]
+app.config['FETCH_TIMEOUT'] = 5.0
+app.config['FETCH_DEADLINE'] = 20.0
+app.config['FETCH_RETRIES'] = 2
+app.config['INSTRUMENTS'] = {'XAU': 'gold', 'XAG': 'silver', 'XPT': 'platinum'}
+app.config['CURRENCIES'] = ['EUR', 'USD', 'GBP', 'CHF']
+app.config['UNITS'] = {'g': 1.0, 'oz': 31.1034768, 'kg': 1000.0}
+app.config['DEFAULT_SERIES'] = ('XAU', 'EUR')
+app.config['SPOT_PROVIDERS'] = ['gold-api', 'goldprice.org']
+app.config['FX_PROVIDERS'] = ['frankfurter', 'open.er-api']
+app.config['HEDGE_AFTER'] = 1.5
+app.config['FX_TTL'] = 3600
+app.config['FX_STALE_WHILE_REVALIDATE'] = True
+app.config['FX_MAX_STALE'] = 3 * 24 * 3600
+app.config['GRAPH_URL'] = "https://graph.microsoft.com/v1.0"
+app.config['TOKEN_REFRESH_MARGIN'] = 300
+app.config['ALERT_WORKER_INTERVAL'] = 15
+app.config['ALERT_COALESCE_WINDOW'] = 60
+app.config['ALERT_MAX_ATTEMPTS'] = 6
+app.config['ALERT_RETRY_BACKOFF'] = 30
+# Seconds a worker may spend sending claimed outbox rows before another worker may claim them again
+app.config['ALERT_CLAIM_TIMEOUT'] = 300
+app.config['DEFAULT_MAX_POINTS'] = 1000
+app.config['MAX_POINTS_LIMIT'] = 10000
+app.config['ANALYTICS_SMA_WINDOWS'] = (20, 50, 200)
+app.config['ANALYTICS_EMA_SPANS'] = (12, 26)
+app.config['ANALYTICS_VOLATILITY_WINDOW'] = 30
+app.config['ANALYTICS_PERIODS_PER_YEAR'] = 252
+app.config['SQLITE_PRAGMAS'] = {
+    # Only takes effect for new files; migrate_db converts existing ones
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+    'cache_size': -16000
+}
+app.config['INGEST_BATCH_SIZE'] = 500
+app.config['INGEST_LINGER'] = 0.05
+app.config['STREAM_HEARTBEAT'] = 15
+app.config['STREAM_RESUME_LIMIT'] = 1000
+app.config['ALERT_DEFAULT_COOLDOWN'] = 900
+app.config['ALERT_MAX_WINDOW_DAYS'] = 3650
+# Seconds between samples, aligned to wall-clock boundaries; anything down to 5 works
+app.config['SAMPLE_INTERVAL'] = 90
+app.config['BULK_CHUNK_SIZE'] = 50000
+# Days each tier is kept, None for forever; daily rollups are always kept. Each tier must outlive the one below it.
+app.config['RETENTION_DAYS'] = {'raw': 30, '15m': 730, '4h': None}
+app.config['RETENTION_INTERVAL'] = 3600
+app.config['RETENTION_BATCH_SIZE'] = 5000
+app.config['BULK_ROLLUP_SLICE_DAYS'] = 31
+# Renewed every third of the TTL while the sampler runs; long enough to cover a tick that hits FETCH_DEADLINE and then
+# waits SAMPLE_INTERVAL for its store, even if one renewal is missed
+app.config['SAMPLE_LEASE_TTL'] = max(3 * app.config['SAMPLE_INTERVAL'], app.config['FETCH_DEADLINE'] + app.config['SAMPLE_INTERVAL'] + 30)
+# How often workers without the sampler lease pick up the leader's ticks and other workers' subscriber edits
+app.config['FOLLOW_INTERVAL'] = 5
+# Collapsed stacks of ticks slower than PROFILE_TICK_THRESHOLD seconds go to instance/profiles
+app.config['PROFILE_SLOW_TICKS'] = os.getenv('GOLD_TRACKER_PROFILE') == '1'
+app.config['PROFILE_TICK_THRESHOLD'] = 5.0
+app.config['PROFILE_INTERVAL'] = 0.005
+# Smaller responses are sent uncompressed
+app.config['COMPRESS_MIN_SIZE'] = 1024
+# Data responses stay fresh until this many seconds after the next sample boundary, by when the tick is usually stored
+app.config['CACHE_TICK_SLACK'] = 10
+# Downloaded into static/vendor by the vendor-assets command; the CDN URLs are used until then
+app.config['VENDOR_ASSETS'] = {
+    'bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'plotly.min.js': 'https://cdn.plot.ly/plotly-3.0.1.min.js'
+}
+app.config['VENDOR_MAX_AGE'] = 365 * 24 * 3600
 db = SQLAlchemy(app)
 
+metrics = Registry(prefix='gold_tracker_')
+upstream_seconds = metrics.histogram('upstream_request_seconds', "Upstream HTTP request latency", ('host', 'outcome'))
+db_query_seconds = metrics.histogram('db_query_seconds', "SQLite statement latency", ('query',))
+tick_stage_seconds = metrics.histogram('tick_stage_seconds', "Duration of each sample tick stage", ('stage',), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+http_request_seconds = metrics.histogram('http_request_seconds', "Request handling latency", ('endpoint',))
+http_response_bytes = metrics.histogram('http_response_bytes', "Response body size", ('endpoint',), buckets=SIZE_BUCKETS)
+alert_send_seconds = metrics.histogram('alert_send_seconds', "Graph sendMail latency including token acquisition")
+fetch_failures = metrics.counter('fetch_failures_total', "Instruments that could not be fetched in a tick", ('instrument',))
+missed_ticks = metrics.counter('missed_ticks_total', "Sample boundaries without a stored price", ('reason',))
+ingest_failures = metrics.counter('ingest_failures_total', "Ingest batches that failed to commit")
+compacted_days = metrics.counter('retention_compacted_days_total', "Days of raw ticks compacted into the aggregate tiers")
+alerts_enqueued = metrics.counter('alerts_enqueued_total', "Alerts written to the outbox", ('kind',))
+alerts_sent = metrics.counter('alerts_sent_total', "Outbox messages delivered")
+alert_failures = metrics.counter('alert_failures_total', "Failed alert deliveries")
+
+query_labels = {}
+
+def query_label(statement):
+    # "select gold_price", "insert daily_rollup", ... SQLAlchemy reuses statement strings, so the cache stays small
+    label = query_labels.get(statement)
+    if label is None:
+        table = re.search(r'\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+"?(\w+)', statement, re.IGNORECASE)
+        label = f"{statement.split(None, 1)[0].lower()} {table.group(1) if table else ''}".strip()
+        if len(query_labels) < 1000:
+            query_labels[statement] = label
+    return label
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, so one that raises leaves nothing behind on the connection
+    if context is not None:
+        context.query_started = perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None:
+        db_query_seconds.observe(perf_counter() - started, query=query_label(statement))
+
+def observe_upstream(url, seconds, ok):
+    upstream_seconds.observe(seconds, host=urlsplit(url).hostname, outcome='ok' if ok else 'error')
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the Flask request threads read while the ingest writer commits
+    if type(dbapi_connection).__module__.startswith('sqlite3'):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
 # MSAL configuration
+msal_token_cache = msal.SerializableTokenCache()
 msal_app = msal.ConfidentialClientApplication(
     app.config['CLIENT_ID'],
     authority=app.config['AUTHORITY'],
-    client_credential=app.config['CLIENT_SECRET']
+    client_credential=app.config['CLIENT_SECRET'],
+    token_cache=msal_token_cache
 )
 
 class GoldPrice(db.Model):
+    # One row per (instrument, quote currency) and tick, price per gram; the unique index lets bulk loads skip duplicates
+    __table_args__ = (db.Index('ux_gold_price_series_timestamp', 'instrument', 'currency', 'timestamp', unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     price = db.Column(db.Float)
+    instrument = db.Column(db.String(8), nullable=False, default='XAU', server_default='XAU')
+    currency = db.Column(db.String(3), nullable=False, default='EUR', server_default='EUR')
+
+class DailyRollup(db.Model):
+    instrument = db.Column(db.String(8), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float)
+    count = db.Column(db.Integer, default=0)
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+    # Set once apply_retention has deleted the day's raw ticks; the tiers are then the only record of the day
+    compacted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+class PriceAggregate(db.Model):
+    instrument = db.Column(db.String(8), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float)
+    count = db.Column(db.Integer, default=0)
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+
+class ExchangeRate(db.Model):
+    pair = db.Column(db.String(16), primary_key=True)
+    rate = db.Column(db.Float)
+    fetched_at = db.Column(db.Float)
+
+class SchedulerLease(db.Model):
+    # Held by the one process (of possibly several workers) that runs the sampler
+    name = db.Column(db.String(32), primary_key=True)
+    owner = db.Column(db.String(128))
+    expires_at = db.Column(db.DateTime)
+
+class CacheGeneration(db.Model):
+    # Bumped after every subscriber, rule or refresh token change, so each worker notices edits made through another
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class MissedTick(db.Model):
+    # A run of sample boundaries with no stored price: downtime, a failed fetch or a tick overrunning the next boundary
+    id = db.Column(db.Integer, primary_key=True)
+    start = db.Column(db.DateTime, index=True)
+    end = db.Column(db.DateTime)
+    count = db.Column(db.Integer)
+    reason = db.Column(db.String(16))
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,48 +248,745 @@ class Setting(db.Model):
     recipient_email = db.Column(db.String(120))
     last_email_time = db.Column(db.DateTime)
 
+class Subscriber(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    enabled = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    rules = db.relationship('AlertRule', backref='subscriber', cascade='all, delete-orphan', order_by='AlertRule.id')
+
+class AlertRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id'), nullable=False, index=True)
+    instrument = db.Column(db.String(8), nullable=False, default='XAU', server_default='XAU')
+    currency = db.Column(db.String(3), nullable=False, default='EUR', server_default='EUR')
+    kind = db.Column(db.String(16), nullable=False)
+    threshold = db.Column(db.Float)
+    window_days = db.Column(db.Integer)
+    cooldown_seconds = db.Column(db.Integer, default=0)
+    enabled = db.Column(db.Boolean, default=True)
+    last_triggered_at = db.Column(db.DateTime)
+
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120))
+    instrument = db.Column(db.String(8), default='XAU', server_default='XAU')
+    currency = db.Column(db.String(3), default='EUR', server_default='EUR')
+    price = db.Column(db.Float)
+    description = db.Column(db.String(255))
+    rule_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(16), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(1024))
+    sent_at = db.Column(db.DateTime)
+
 class RefreshToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(1024))
 
-def get_gold_price():
-    ounce_gram_factor = 31.1034768
-    url_usd_eur = 'https://api.frankfurter.app/latest?from=USD&to=EUR'
-    response_usd_eur = requests.get(url_usd_eur).json()
-    usd_eur = float(response_usd_eur['rates']['EUR'])
-    url_xau_usd = 'https://api.gold-api.com/price/XAU'
-    response_xau_usd = requests.get(url_xau_usd).json()
-    xau_usd = float(response_xau_usd['price'])
-    return (usd_eur * xau_usd) / ounce_gram_factor
+class TokenCacheState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.Text)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Pre-aggregated tiers between the raw ticks and DailyRollup, used for long chart ranges
+AGGREGATE_RESOLUTIONS = {'15m': 900, '4h': 4 * 3600}
+TIER_OVERSAMPLING = 10
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+def day_range(day):
+    # Half-open [start, end) bounds so the timestamp index can be used, unlike date(timestamp) == day
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+OUNCE_GRAMS = 31.1034768
+
+def series_filter(model, series):
+    return (model.instrument == series[0], model.currency == series[1])
+
+def price_points_between(series, start, end):
+    return db.session.query(GoldPrice.timestamp, GoldPrice.price).filter(*series_filter(GoldPrice, series), GoldPrice.timestamp >= start, GoldPrice.timestamp < end).order_by(GoldPrice.timestamp)
+
+def bucket_start(timestamp, resolution):
+    return EPOCH + timedelta(seconds=(timestamp - EPOCH) // timedelta(seconds=resolution) * resolution)
+
+def new_ohlc(model, timestamp, price, **key):
+    row = model(open=price, high=price, low=price, close=price, count=0, first_timestamp=timestamp, last_timestamp=timestamp, **key)
+    db.session.add(row)
+    return row
+
+def fold_price(row, timestamp, price):
+    if timestamp < row.first_timestamp:
+        row.open = price
+        row.first_timestamp = timestamp
+    if timestamp >= row.last_timestamp:
+        row.close = price
+        row.last_timestamp = timestamp
+    row.high = max(row.high, price)
+    row.low = min(row.low, price)
+    row.count += 1
+
+def update_rollup(series, timestamp, price, rows=None):
+    # Caller commits, so the rollup and aggregate tiers land in the same transaction as the GoldPrice insert.
+    # rows holds strong references for a batch; the session only keeps clean objects weakly and would reload them.
+    rows = {} if rows is None else rows
+    instrument, currency = series
+    key = (instrument, currency, timestamp.date())
+    rollup = rows.get(key) or db.session.get(DailyRollup, key) or new_ohlc(DailyRollup, timestamp, price, instrument=instrument, currency=currency, day=key[2])
+    rows[key] = rollup
+    fold_price(rollup, timestamp, price)
+    for resolution in AGGREGATE_RESOLUTIONS.values():
+        key = (instrument, currency, resolution, bucket_start(timestamp, resolution))
+        aggregate = rows.get(key) or db.session.get(PriceAggregate, key) or new_ohlc(PriceAggregate, timestamp, price, instrument=instrument, currency=currency, resolution=resolution, bucket=key[3])
+        rows[key] = aggregate
+        fold_price(aggregate, timestamp, price)
+    return rollup
+
+def rollups_between(series, start_day, end_day):
+    return DailyRollup.query.filter(*series_filter(DailyRollup, series), DailyRollup.day >= start_day, DailyRollup.day < end_day).order_by(DailyRollup.day)
+
+def aggregates_between(series, resolution, start, end):
+    return PriceAggregate.query.filter(*series_filter(PriceAggregate, series), PriceAggregate.resolution == resolution, PriceAggregate.bucket >= start, PriceAggregate.bucket < end).order_by(PriceAggregate.bucket)
+
+def timestamp_text(timestamp):
+    # The text form SQLAlchemy stores DateTime columns in on SQLite, so raw SQL compares and sorts like the ORM
+    return timestamp.isoformat(sep=' ', timespec='microseconds')
+
+def bucket_key_sql(column, resolution):
+    # Cheap per-row grouping key equivalent to bucket_start(); the resolutions are whole minutes that divide
+    # an hour, or whole hours that divide a day
+    if resolution < 3600:
+        return f"substr({column}, 1, 13) || (CAST(substr({column}, 15, 2) AS INTEGER) / {resolution // 60})"
+    return f"substr({column}, 1, 10) || (CAST(substr({column}, 12, 2) AS INTEGER) / {resolution // 3600})"
+
+def bucket_sql(column, resolution):
+    # bucket_start() of a stored timestamp, as the text SQLAlchemy would store it
+    seconds = f"(CAST(substr({column}, 12, 2) AS INTEGER) * 3600 + CAST(substr({column}, 15, 2) AS INTEGER) * 60) / {resolution} * {resolution}"
+    return f"printf('%s %02d:%02d:00.000000', substr({column}, 1, 10), {seconds} / 3600, {seconds} % 3600 / 60)"
+
+def tier_sql(table, key_columns, key_value, group_key, source, where):
+    # Folds a finer tier into table inside SQLite: high/low/count/first/last from one grouped scan, open and
+    # close looked up once per bucket through the source's (instrument, currency, ...) index. source is
+    # None for the raw ticks or the resolution of the PriceAggregate tier to roll up from.
+    columns = 'open, high, low, close, count, first_timestamp, last_timestamp'
+    if source is None:
+        folded = f"""
+            SELECT instrument, currency, MIN(timestamp) AS first, MAX(timestamp) AS last, MAX(price) AS high, MIN(price) AS low,
+                COUNT(*) AS count, MIN(timestamp) AS first_timestamp, MAX(timestamp) AS last_timestamp
+            FROM gold_price WHERE {where} GROUP BY instrument, currency, {group_key('timestamp')}"""
+        lookup = "SELECT {column} FROM gold_price s WHERE s.instrument = g.instrument AND s.currency = g.currency AND s.timestamp = g.{edge}"
+        opening, closing = lookup.format(column='price', edge='first'), lookup.format(column='price', edge='last')
+    else:
+        folded = f"""
+            SELECT instrument, currency, MIN(bucket) AS first, MAX(bucket) AS last, MAX(high) AS high, MIN(low) AS low,
+                SUM(count) AS count, MIN(first_timestamp) AS first_timestamp, MAX(last_timestamp) AS last_timestamp
+            FROM price_aggregate WHERE resolution = {source} AND {where} GROUP BY instrument, currency, {group_key('bucket')}"""
+        lookup = f"SELECT {{column}} FROM price_aggregate s WHERE s.instrument = g.instrument AND s.currency = g.currency AND s.resolution = {source} AND s.bucket = g.{{edge}}"
+        opening, closing = lookup.format(column='open', edge='first'), lookup.format(column='close', edge='last')
+    return f"""
+        INSERT INTO {table} ({key_columns}, {columns})
+        SELECT g.instrument, g.currency, {key_value('g.first')}, ({opening}), g.high, g.low, ({closing}), g.count, g.first_timestamp, g.last_timestamp
+        FROM ({folded}) g"""
+
+def rebuild_rollups(series=None, start_day=None, end_day=None, commit=True):
+    # Recomputes whole days of the rollup and aggregate tiers, optionally for one series and a [start_day, end_day)
+    # range. Only the finest tier reads the raw ticks, each coarser one folds the tier below it, and all of it runs
+    # inside SQLite so millions of ticks never pass through Python. The resolutions nest (900 | 14400 | 86400).
+    # Compacted days are left alone: their raw ticks are gone, so a rebuild would replace their tiers with
+    # whatever was imported since.
+    if start_day is None:
+        oldest = db.session.query(db.func.min(GoldPrice.timestamp)).scalar()
+        if oldest is None:
+            return 0
+        start_day = oldest.date()
+    params = {'start': timestamp_text(day_range(start_day)[0]), 'start_day': start_day.isoformat()}
+    if series is not None:
+        params.update(instrument=series[0], currency=series[1])
+    if end_day is not None:
+        params.update(end=timestamp_text(day_range(end_day)[0]), end_day=end_day.isoformat())
+
+    def where(table, column, bound=''):
+        # bound is '_day' for the date column of daily_rollup, which compares against the bare dates
+        conditions = [f'{column} IS NOT NULL', f'{column} >= :start{bound}']
+        if series is not None:
+            conditions.append(f'{table}.instrument = :instrument AND {table}.currency = :currency')
+        if end_day is not None:
+            conditions.append(f'{column} < :end{bound}')
+        conditions.append(f"NOT EXISTS (SELECT 1 FROM daily_rollup c WHERE c.instrument = {table}.instrument AND c.currency = {table}.currency AND c.day = substr({table}.{column}, 1, 10) AND c.compacted)")
+        return ' AND '.join(conditions)
+
+    db.session.execute(db.text(f"DELETE FROM daily_rollup WHERE {where('daily_rollup', 'day', '_day')}"), params)
+    db.session.execute(db.text(f"DELETE FROM price_aggregate WHERE {where('price_aggregate', 'bucket')}"), params)
+    source = None
+    for resolution in sorted(AGGREGATE_RESOLUTIONS.values()):
+        sql = tier_sql('price_aggregate', 'instrument, currency, resolution, bucket', lambda column: f"{resolution}, {bucket_sql(column, resolution)}",
+                       lambda column: bucket_key_sql(column, resolution), source, where('gold_price', 'timestamp') if source is None else where('price_aggregate', 'bucket'))
+        db.session.execute(db.text(sql), params)
+        source = resolution
+    sql = tier_sql('daily_rollup', 'instrument, currency, day', lambda column: f"substr({column}, 1, 10)",
+                   lambda column: f"substr({column}, 1, 10)", source, where('price_aggregate', 'bucket'))
+    days = db.session.execute(db.text(sql), params).rowcount
+    if commit:
+        db.session.commit()
+    rule_indexes.invalidate()
+    return days
+
+def export_prices(series=None, start=None, end=None, chunk_size=50000):
+    # Generator of PRICE_COLUMNS chunks read straight off the cursor, so exporting never holds the table in memory
+    conditions, params = ['timestamp IS NOT NULL'], {}
+    if series is not None:
+        conditions.append('instrument = :instrument AND currency = :currency')
+        params.update(instrument=series[0], currency=series[1])
+    if start is not None:
+        conditions.append('timestamp >= :start')
+        params['start'] = timestamp_text(start)
+    if end is not None:
+        conditions.append('timestamp < :end')
+        params['end'] = timestamp_text(end)
+    result = db.session.execute(db.text(f"SELECT timestamp, instrument, currency, price FROM gold_price WHERE {' AND '.join(conditions)} ORDER BY instrument, currency, timestamp"), params)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [tuple(row) for row in rows]
+
+def compacted_spans(rows):
+    # {(instrument, currency, day text): (first, last timestamp text)} of the compacted days the rows fall on
+    days = {row[0][:10] for row in rows}
+    spans = db.session.query(DailyRollup.instrument, DailyRollup.currency, DailyRollup.day, DailyRollup.first_timestamp, DailyRollup.last_timestamp).filter(
+        DailyRollup.compacted, DailyRollup.day >= datetime.fromisoformat(min(days)).date(), DailyRollup.day <= datetime.fromisoformat(max(days)).date())
+    return {(instrument, currency, day.isoformat()): (timestamp_text(first), timestamp_text(last)) for instrument, currency, day, first, last in spans}
+
+def fold_into_compacted(connection, rows, compacted):
+    tiers = {}
+    inserted = 0
+    for timestamp, instrument, currency, price in rows:
+        first, last = compacted[instrument, currency, timestamp[:10]]
+        if first <= timestamp <= last:
+            continue
+        if connection.exec_driver_sql("INSERT OR IGNORE INTO gold_price (timestamp, instrument, currency, price) VALUES (?, ?, ?, ?)", (timestamp, instrument, currency, price)).rowcount:
+            update_rollup((instrument, currency), datetime.fromisoformat(timestamp), price, tiers)
+            inserted += 1
+    db.session.flush()
+    return inserted
+
+def import_prices(chunks):
+    # Bulk-loads (timestamp, instrument, currency, price) chunks with one executemany and commit per chunk.
+    # INSERT OR IGNORE against the unique series/timestamp index skips ticks that are already stored.
+    # The rollup tiers are rebuilt afterwards for the series and days that were touched, except compacted days:
+    # those no longer have their raw ticks, so new ticks are folded into their tiers directly, and ticks inside
+    # the span the compacted day already covers are taken to be in it and skipped.
+    connection = db.session.connection()
+    spans = {}
+    inserted = total = 0
+    for chunk in chunks:
+        rows = []
+        for timestamp, instrument, currency, price in chunk:
+            if not isinstance(timestamp, str):
+                timestamp = timestamp_text(timestamp)
+            elif len(timestamp) != 26 or timestamp[10] != ' ':
+                timestamp = timestamp_text(parse_timestamp(timestamp))
+            rows.append((timestamp, instrument, currency, float(price)))
+        for series in {(instrument, currency) for _, instrument, currency, _ in rows}:
+            if series[0] not in app.config['INSTRUMENTS'] or series[1] not in app.config['CURRENCIES']:
+                raise ValueError(f"unknown series {series[0]}/{series[1]}")
+            first, last = min(row[0] for row in rows), max(row[0] for row in rows)
+            span = spans.get(series)
+            spans[series] = (min(first, span[0]), max(last, span[1])) if span else (first, last)
+        compacted = compacted_spans(rows)
+        if compacted:
+            inserted += fold_into_compacted(connection, [row for row in rows if (row[1], row[2], row[0][:10]) in compacted], compacted)
+            rows = [row for row in rows if (row[1], row[2], row[0][:10]) not in compacted]
+        if rows:
+            inserted += connection.exec_driver_sql("INSERT OR IGNORE INTO gold_price (timestamp, instrument, currency, price) VALUES (?, ?, ?, ?)", rows).rowcount
+        total += len(chunk)
+        db.session.commit()
+        connection = db.session.connection()
+    for series, (first, last) in spans.items():
+        day, end_day = datetime.fromisoformat(first).date(), datetime.fromisoformat(last).date() + timedelta(days=1)
+        while day < end_day:
+            # Slices keep SQLite's GROUP BY sorter, and so memory, bounded however long the imported range is
+            rebuild_rollups(series, day, min(day + timedelta(days=app.config['BULK_ROLLUP_SLICE_DAYS']), end_day))
+            day += timedelta(days=app.config['BULK_ROLLUP_SLICE_DAYS'])
+    return inserted, total
+
+@app.cli.command('export')
+@click.argument('path')
+@click.option('--format', 'requested_format', type=click.Choice(['csv', 'parquet']), help="Defaults to the file extension")
+@click.option('--instrument', help="Export one series, together with --currency")
+@click.option('--currency')
+@click.option('--from', 'start', help="ISO 8601 start timestamp")
+@click.option('--to', 'end', help="ISO 8601 end timestamp")
+def export_command(path, requested_format, instrument, currency, start, end):
+    series = (instrument.upper(), currency.upper()) if instrument and currency else None
+    chunks = export_prices(series, parse_timestamp(start) if start else None, parse_timestamp(end) if end else None, app.config['BULK_CHUNK_SIZE'])
+    rows = write_rows(path, PRICE_COLUMNS, chunks, requested_format)
+    print(f"Exported {rows} prices to {path}")
+
+@app.cli.command('import')
+@click.argument('path')
+@click.option('--format', 'requested_format', type=click.Choice(['csv', 'parquet']), help="Defaults to the file extension")
+def import_command(path, requested_format):
+    inserted, total = import_prices(read_rows(path, PRICE_COLUMNS, requested_format, app.config['BULK_CHUNK_SIZE']))
+    print(f"Imported {inserted} of {total} prices from {path}, {total - inserted} already stored")
+
+@app.cli.command('backfill')
+@click.argument('path')
+@click.option('--instrument', required=True, help="Series the file's prices belong to, e.g. XAU")
+@click.option('--currency', required=True, help="Quote currency of the file's prices, e.g. EUR")
+@click.option('--unit', default='g', show_default=True, help="Weight unit the file's prices are quoted per")
+@click.option('--timestamp-column', default='timestamp', show_default=True)
+@click.option('--price-column', default='price', show_default=True)
+@click.option('--format', 'requested_format', type=click.Choice(['csv', 'parquet']), help="Defaults to the file extension")
+def backfill_command(path, instrument, currency, unit, timestamp_column, price_column, requested_format):
+    # Seeds one series from a third-party history file, prices are converted to per gram on the way in
+    instrument, currency = instrument.upper(), currency.upper()
+    grams = app.config['UNITS'][unit]
+    chunks = (
+        [(timestamp, instrument, currency, float(price) / grams) for timestamp, price in chunk]
+        for chunk in read_rows(path, (timestamp_column, price_column), requested_format, app.config['BULK_CHUNK_SIZE'])
+    )
+    inserted, total = import_prices(chunks)
+    print(f"Backfilled {inserted} of {total} {instrument}/{currency} prices from {path}, {total - inserted} already stored")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    days = rebuild_rollups()
+    print(f"Rebuilt {days} daily rollups")
+
+def add_column_if_missing(table, column, ddl):
+    if column not in table_columns(table):
+        db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def table_columns(table):
+    return [row[1] for row in db.session.execute(db.text(f"PRAGMA table_info({table})"))]
+
+def migrate_db():
+    # create_all() never alters existing tables, so columns and indexes missing from older gold_prices.db files are added here
+    db.create_all()
+    add_column_if_missing('gold_price', 'instrument', "VARCHAR(8) NOT NULL DEFAULT 'XAU'")
+    add_column_if_missing('gold_price', 'currency', "VARCHAR(3) NOT NULL DEFAULT 'EUR'")
+    db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_gold_price_timestamp ON gold_price (timestamp)"))
+    indexes = [row[1] for row in db.session.execute(db.text("PRAGMA index_list(gold_price)"))]
+    if 'ux_gold_price_series_timestamp' not in indexes:
+        # Earlier databases had a non-unique series index; drop duplicate ticks before making it unique
+        db.session.execute(db.text("DELETE FROM gold_price WHERE id NOT IN (SELECT MIN(id) FROM gold_price GROUP BY instrument, currency, timestamp)"))
+        db.session.execute(db.text("DROP INDEX IF EXISTS ix_gold_price_series_timestamp"))
+        db.session.execute(db.text("CREATE UNIQUE INDEX ux_gold_price_series_timestamp ON gold_price (instrument, currency, timestamp)"))
+    add_column_if_missing('outbox_message', 'description', 'VARCHAR(255)')
+    add_column_if_missing('outbox_message', 'rule_id', 'INTEGER')
+    add_column_if_missing('outbox_message', 'instrument', "VARCHAR(8) DEFAULT 'XAU'")
+    add_column_if_missing('outbox_message', 'currency', "VARCHAR(3) DEFAULT 'EUR'")
+    add_column_if_missing('alert_rule', 'instrument', "VARCHAR(8) NOT NULL DEFAULT 'XAU'")
+    add_column_if_missing('alert_rule', 'currency', "VARCHAR(3) NOT NULL DEFAULT 'EUR'")
+    for table in ('daily_rollup', 'price_aggregate'):
+        # Derived tables whose primary key gained the series columns are dropped and rebuilt from gold_price
+        if 'instrument' not in table_columns(table):
+            db.session.execute(db.text(f"DROP TABLE {table}"))
+    db.session.commit()
+    db.create_all()
+    if 'compacted' not in table_columns('daily_rollup'):
+        add_column_if_missing('daily_rollup', 'compacted', 'BOOLEAN NOT NULL DEFAULT 0')
+        # Days that were compacted before the flag existed are the ones whose raw ticks are all gone
+        db.session.execute(db.text(
+            "UPDATE daily_rollup SET compacted = 1 WHERE NOT EXISTS (SELECT 1 FROM gold_price g WHERE g.instrument = daily_rollup.instrument "
+            "AND g.currency = daily_rollup.currency AND g.timestamp >= daily_rollup.day AND g.timestamp < date(daily_rollup.day, '+1 day'))"
+        ))
+        db.session.commit()
+    if (DailyRollup.query.first() is None or PriceAggregate.query.first() is None) and GoldPrice.query.first() is not None:
+        rebuild_rollups()
+    setting = Setting.query.first()
+    if Subscriber.query.first() is None and setting is not None and setting.recipient_email:
+        # The single-recipient Setting becomes a subscriber with the original new-daily-low rule
+        subscriber = Subscriber(email=setting.recipient_email, enabled=setting.email_notifications)
+        subscriber.rules.append(AlertRule(kind='new_low', window_days=1, cooldown_seconds=0, last_triggered_at=setting.last_email_time))
+        db.session.add(subscriber)
+        db.session.commit()
+    if db.session.execute(db.text("PRAGMA auto_vacuum")).scalar() != 2:
+        # auto_vacuum only changes on an existing file with a full VACUUM, which cannot run inside a transaction
+        db.session.commit()
+        print("Converting database to incremental auto-vacuum")
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+
+@app.cli.command('migrate')
+def migrate_command():
+    migrate_db()
+    print("Database migrated")
+
+def incremental_vacuum():
+    # Hands the pages freed by the last transaction back to the file system. The pragma frees one page
+    # per step, so it goes through executescript, which steps it to completion.
+    db.session.commit()
+    db.session.connection().connection.driver_connection.executescript("PRAGMA incremental_vacuum")
+    db.session.commit()
+
+def apply_retention(now=None):
+    # Compacts raw ticks past their retention into the aggregate tiers, one day per transaction: the day's tiers
+    # are rebuilt from its ticks and the ticks deleted together, so a crash leaves either both or neither.
+    # Expired aggregate tiers are then pruned in small batches. Returns the number of raw days compacted.
+    now = now or datetime.utcnow()
+    retention = app.config['RETENTION_DAYS']
+    days = 0
+    if retention.get('raw') is not None:
+        cutoff = (now - timedelta(days=retention['raw'])).date()
+        oldest = db.session.query(db.func.min(GoldPrice.timestamp)).scalar()
+        while oldest is not None and oldest.date() < cutoff:
+            start, end = day_range(oldest.date())
+            rebuild_rollups(None, start.date(), end.date(), commit=False)
+            DailyRollup.query.filter(DailyRollup.day == start.date()).update({'compacted': True}, synchronize_session=False)
+            GoldPrice.query.filter(GoldPrice.timestamp >= start, GoldPrice.timestamp < end).delete(synchronize_session=False)
+            db.session.commit()
+            incremental_vacuum()
+            compacted_days.inc()
+            days += 1
+            oldest = db.session.query(db.func.min(GoldPrice.timestamp)).scalar()
+    for name, resolution in AGGREGATE_RESOLUTIONS.items():
+        if retention.get(name) is None:
+            continue
+        params = {'resolution': resolution, 'cutoff': timestamp_text(now - timedelta(days=retention[name])), 'limit': app.config['RETENTION_BATCH_SIZE']}
+        while True:
+            deleted = db.session.execute(db.text(
+                "DELETE FROM price_aggregate WHERE rowid IN (SELECT rowid FROM price_aggregate WHERE resolution = :resolution AND bucket < :cutoff LIMIT :limit)"
+            ), params).rowcount
+            db.session.commit()
+            if deleted:
+                incremental_vacuum()
+            if deleted < params['limit']:
+                break
+    return days
+
+@app.cli.command('compact')
+def compact_command():
+    days = apply_retention()
+    print(f"Compacted {days} days of raw ticks")
+
+class TodaySeries:
+    # Append-only copy of one series' ticks for the current UTC day; the serialized /get_data body is
+    # memoized per unit and encoding until the next append
+    def __init__(self, series):
+        self.series = series
+        self.lock = threading.Lock()
+        self.day = None
+        self.timestamps = array('q')
+        self.prices = array('d')
+        self.bodies = {}
+
+    def reset(self, day):
+        self.day = day
+        self.timestamps = array('q')
+        self.prices = array('d')
+        self.bodies = {}
+
+    def load(self, day):
+        with self.lock:
+            if self.day == day:
+                return
+            self.reset(day)
+            for timestamp, price in price_points_between(self.series, *day_range(day)):
+                self.timestamps.append(to_micros(timestamp))
+                self.prices.append(price)
+
+    def append(self, timestamp, price):
+        with self.lock:
+            if self.day != timestamp.date():
+                # Midnight UTC rollover, the next /get_data call reloads the new day from the DB
+                self.day = None
+                return
+            self.timestamps.append(to_micros(timestamp))
+            self.prices.append(price)
+            self.bodies = {}
+
+    def points_body(self, start, unit):
+        timestamps = self.timestamps[start:]
+        cursor = from_micros(self.timestamps[-1]).isoformat() if self.timestamps else None
+        grams = app.config['UNITS'][unit]
+        return {
+            'timestamps': [from_micros(t).isoformat() for t in timestamps],
+            'prices': self.prices[start:].tolist() if grams == 1 else [price * grams for price in self.prices[start:]],
+            'instrument': self.series[0],
+            'currency': self.series[1],
+            'unit': unit,
+            'cursor': cursor
+        }
+
+    def response_body(self, unit, encoding=None):
+        # Returns (body, encoding); bodies below COMPRESS_MIN_SIZE are left uncompressed
+        with self.lock:
+            if unit not in self.bodies:
+                self.bodies[unit] = app.json.dumps(self.points_body(0, unit))
+            body = self.bodies[unit]
+            if encoding is None or len(body) < app.config['COMPRESS_MIN_SIZE']:
+                return body, None
+            if (unit, encoding) not in self.bodies:
+                self.bodies[unit, encoding] = compress(body, encoding)
+            return self.bodies[unit, encoding], encoding
+
+    def delta_response_body(self, since, unit):
+        # Points strictly after the client's cursor; a cursor from an earlier day gets the whole day and a reset flag
+        with self.lock:
+            if since < day_range(self.day)[0]:
+                return app.json.dumps(dict(self.points_body(0, unit), reset=True))
+            return app.json.dumps(self.points_body(bisect_right(self.timestamps, to_micros(since)), unit))
+
+class SeriesRegistry(dict):
+    # Lazily creates one cache object per (instrument, currency) series
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self.lock = threading.Lock()
+
+    def __missing__(self, series):
+        with self.lock:
+            if series not in self.keys():
+                dict.__setitem__(self, series, self.factory(series))
+            return dict.__getitem__(self, series)
+
+today_series = SeriesRegistry(TodaySeries)
+price_hubs = SeriesRegistry(lambda series: PriceHub())
+
+price_analytics = SeriesRegistry(lambda series: PriceAnalytics(
+    sma_windows=app.config['ANALYTICS_SMA_WINDOWS'],
+    ema_spans=app.config['ANALYTICS_EMA_SPANS'],
+    volatility_window=app.config['ANALYTICS_VOLATILITY_WINDOW'],
+    periods_per_year=app.config['ANALYTICS_PERIODS_PER_YEAR']
+))
+
+class DataVersion:
+    # Id of the newest tick included in this process' TodaySeries, PriceHub and PriceAnalytics views, the validator
+    # behind the data endpoints' ETags. store_prices advances it as ticks commit. Only the worker holding the sampler
+    # lease stores ticks, so the DB is re-read once per ttl (and on poll()) and ticks committed by another process
+    # are passed to catch_up(after, latest) before the new value is served.
+    def __init__(self, ttl, catch_up):
+        self.ttl = ttl
+        self.catch_up = catch_up
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires = 0
+
+    def refresh(self):
+        latest = db.session.query(db.func.max(GoldPrice.id)).scalar() or 0
+        if self.value is not None and latest > self.value:
+            self.catch_up(self.value, latest)
+        if self.value is None or latest > self.value:
+            self.value = latest
+        self.expires = perf_counter() + self.ttl
+
+    def current(self):
+        with self.lock:
+            if self.value is None or perf_counter() >= self.expires:
+                self.refresh()
+            return self.value
+
+    def poll(self):
+        with self.lock:
+            self.refresh()
+
+    def stored(self, ticks, apply):
+        # ticks are (id, ...) tuples this process committed; a refresh may already have applied them from the DB
+        with self.lock:
+            if self.value is not None:
+                ticks = [tick for tick in ticks if tick[0] > self.value]
+                if ticks:
+                    self.value = max(tick[0] for tick in ticks)
+            apply(ticks)
+
+def apply_ticks(ticks):
+    # ticks are (id, timestamp, series, price, day, close) with close the day's rollup close after the tick
+    for price_id, timestamp, series, price, day, close in ticks:
+        if series in today_series:
+            today_series[series].append(timestamp, price)
+        price_hubs[series].publish(price_id, price_event(timestamp, series, price))
+        if close is not None and series in price_analytics and price_analytics[series].loaded:
+            price_analytics[series].update(day, close)
+
+def catch_up(after, latest):
+    # Ticks another process committed: live ticks from the sampler leader are replayed into this worker's views,
+    # a large or historical batch (the import command) drops the views so they reload from the DB
+    limit = app.config['STREAM_RESUME_LIMIT']
+    rows = db.session.query(GoldPrice.id, GoldPrice.timestamp, GoldPrice.instrument, GoldPrice.currency, GoldPrice.price).filter(GoldPrice.id > after, GoldPrice.id <= latest).order_by(GoldPrice.id).limit(limit + 1).all()
+    today = datetime.utcnow().date()
+    if len(rows) > limit or any(timestamp.date() < today for _, timestamp, _, _, _ in rows):
+        today_series.clear()
+        price_analytics.clear()
+        return
+    closes = {}
+    for _, timestamp, instrument, currency, _ in rows:
+        key = (instrument, currency, timestamp.date())
+        if key not in closes and (instrument, currency) in price_analytics:
+            rollup = db.session.get(DailyRollup, key)
+            closes[key] = rollup.close if rollup else None
+    apply_ticks([(row_id, timestamp, (instrument, currency), price, timestamp.date(), closes.get((instrument, currency, timestamp.date()))) for row_id, timestamp, instrument, currency, price in rows])
+
+data_version = DataVersion(app.config['SAMPLE_INTERVAL'], catch_up)
+
+def load_analytics(series):
+    analytics = price_analytics[series]
+    if not analytics.loaded:
+        rows = db.session.query(DailyRollup.day, DailyRollup.close).filter(*series_filter(DailyRollup, series)).order_by(DailyRollup.day).all()
+        analytics.load([day for day, _ in rows], [close for _, close in rows])
+    return analytics
+
+price_fetcher = PriceFetcher(
+    timeout=app.config['FETCH_TIMEOUT'],
+    deadline=app.config['FETCH_DEADLINE'],
+    retries=app.config['FETCH_RETRIES'],
+    # Every instrument's chain may have all its providers in flight at once (a stalled primary plus its hedges),
+    # as may the FX chain for each currency; a smaller pool queues a hedge behind another instrument's stalled primary
+    pool_size=len(app.config['INSTRUMENTS']) * len(app.config['SPOT_PROVIDERS']) + len(app.config['CURRENCIES']) * len(app.config['FX_PROVIDERS']),
+    on_request=observe_upstream
+)
+
+class DatabaseRateStore:
+    # Persists cached FX rates so a restart does not force a cold fetch
+    def load(self, key):
+        with app.app_context():
+            row = db.session.get(ExchangeRate, key)
+            return (row.rate, row.fetched_at) if row else None
+
+    def save(self, key, value, fetched_at):
+        with app.app_context():
+            row = db.session.get(ExchangeRate, key)
+            if row is None:
+                row = ExchangeRate(pair=key)
+                db.session.add(row)
+            row.rate = value
+            row.fetched_at = fetched_at
+            db.session.commit()
+
+spot_providers = build_chain(app.config['SPOT_PROVIDERS'], price_fetcher, hedge_after=app.config['HEDGE_AFTER'], deadline=app.config['FETCH_DEADLINE'])
+fx_providers = build_chain(app.config['FX_PROVIDERS'], price_fetcher, hedge_after=app.config['HEDGE_AFTER'], deadline=app.config['FETCH_DEADLINE'])
+
+fx_rates = RateCache(
+    fx_providers.get,
+    ttl=app.config['FX_TTL'],
+    store=DatabaseRateStore(),
+    stale_while_revalidate=app.config['FX_STALE_WHILE_REVALIDATE'],
+    max_stale=app.config['FX_MAX_STALE'],
+    # Not price_fetcher.executor: the refresh waits on fx_providers, which submits its requests to that pool
+    executor=ThreadPoolExecutor(max_workers=2, thread_name_prefix='fx-refresh')
+)
+
+# Instruments are fetched side by side on their own pool; the provider chains already wait on price_fetcher.executor
+instrument_executor = ThreadPoolExecutor(max_workers=len(app.config['INSTRUMENTS']), thread_name_prefix='instrument')
+
+def get_fx_rates():
+    # One USD-based rate per quote currency, shared by every instrument in the tick
+    return {currency: 1.0 if currency == 'USD' else fx_rates.get(f'USD/{currency}') for currency in app.config['CURRENCIES']}
+
+def get_spot_prices():
+    # Per-gram price for every (instrument, currency) series; a failed instrument only drops its own series
+    futures = {instrument: instrument_executor.submit(spot_providers.get, instrument) for instrument in app.config['INSTRUMENTS']}
+    rates = get_fx_rates()
+    prices = {}
+    for instrument, future in futures.items():
+        try:
+            usd_per_gram = future.result() / OUNCE_GRAMS
+        except Exception as e:
+            print(f"Error fetching {instrument} price: {e}")
+            fetch_failures.inc(instrument=instrument)
+            continue
+        for currency, rate in rates.items():
+            prices[(instrument, currency)] = usd_per_gram * rate
+    if not prices:
+        raise FetchError("no instrument could be fetched")
+    return prices
+
+class TokenManager:
+    # Keeps the access token in memory until shortly before expiry and persists MSAL's token cache,
+    # so an alert normally costs no round-trip to login.microsoftonline.com
+    def __init__(self, refresh_margin):
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.cache_loaded = False
+        self.access_token = None
+        self.expires_at = 0
+
+    def load_cache(self):
+        if not self.cache_loaded:
+            state = TokenCacheState.query.first()
+            if state is not None and state.data:
+                msal_token_cache.deserialize(state.data)
+            self.cache_loaded = True
+
+    def save_cache(self):
+        if msal_token_cache.has_state_changed:
+            state = TokenCacheState.query.first()
+            if state is None:
+                state = TokenCacheState()
+                db.session.add(state)
+            state.data = msal_token_cache.serialize()
+            db.session.commit()
+            msal_token_cache.has_state_changed = False
+
+    def store(self, result):
+        self.access_token = result["access_token"]
+        self.expires_at = datetime.utcnow().timestamp() + int(result.get("expires_in", 3600))
+        if "refresh_token" in result:
+            # Entra ID rotates refresh tokens, keep the stored row on the latest one
+            refresh_token = RefreshToken.query.first()
+            if refresh_token is None:
+                refresh_token = RefreshToken(token=result["refresh_token"])
+                db.session.add(refresh_token)
+                db.session.commit()
+                subscribers_changed()
+            else:
+                refresh_token.token = result["refresh_token"]
+                db.session.commit()
+        self.save_cache()
+
+    def invalidate(self):
+        with self.lock:
+            self.access_token = None
+            self.expires_at = 0
+
+    def get(self):
+        with self.lock:
+            now = datetime.utcnow().timestamp()
+            if self.access_token and now < self.expires_at - self.refresh_margin:
+                return self.access_token
+            self.load_cache()
+            result = None
+            accounts = msal_app.get_accounts()
+            if accounts:
+                result = msal_app.acquire_token_silent(app.config['SCOPES'], account=accounts[0], force_refresh=self.access_token is not None)
+            if not result or "access_token" not in result:
+                refresh_token = RefreshToken.query.first()
+                if refresh_token is None:
+                    return None
+                result = msal_app.acquire_token_by_refresh_token(refresh_token.token, scopes=app.config['SCOPES'])
+            if "access_token" not in result:
+                return None
+            self.store(result)
+            return self.access_token
+
+token_manager = TokenManager(app.config['TOKEN_REFRESH_MARGIN'])
 
 def get_access_token():
-    refresh_token = RefreshToken.query.first()
-    if refresh_token is None:
-        return None
-    result = msal_app.acquire_token_silent(app.config['SCOPES'], account=None)
-    if not result:
-        result = msal_app.acquire_token_by_refresh_token(refresh_token.token, scopes=app.config['SCOPES'])
-    if "access_token" in result:
-        return result["access_token"]
-    return None
+    return token_manager.get()
 
-def send_email(recipient, price):
+class EmailError(Exception):
+    pass
+
+def send_email(recipient, content):
     access_token = get_access_token()
     if access_token is None:
-        print("Error: No access token available. Please authenticate at /login")
-        return
-    user_endpoint = "https://graph.microsoft.com/v1.0/me"
-    user_response = requests.get(user_endpoint, headers={"Authorization": f"Bearer {access_token}"})
-    if not user_response.ok:
-        print(f"Error retrieving user ID: {user_response.json()}")
-        return
-    user_id = user_response.json().get("userPrincipalName")
+        raise EmailError("No access token available. Please authenticate at /login")
     email_msg = {
         "Message": {
             "Subject": "Gold Price Alert",
             "Body": {
                 "ContentType": "Text",
-                "Content": f'The gold price is now {price:.2f} € per gram, which is a new low.'
+                "Content": content
             },
             "ToRecipients": [
                 {
@@ -88,53 +998,568 @@ def send_email(recipient, price):
         },
         "SaveToSentItems": "true"
     }
-    endpoint = f"https://graph.microsoft.com/v1.0/users/{user_id}/sendMail"
-    response = requests.post(endpoint, headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}, json=email_msg)
-    if response.ok:
-        print("Email sent successfully")
-    else:
-        print(f"Error sending email: {response.text}")
+    # /me/sendMail sends as the signed-in account, so no /me lookup for the userPrincipalName is needed
+    endpoint = f"{app.config['GRAPH_URL']}/me/sendMail"
+    started = perf_counter()
+    try:
+        response = requests.post(endpoint, headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}, json=email_msg, timeout=app.config['FETCH_TIMEOUT'])
+    except requests.RequestException:
+        observe_upstream(endpoint, perf_counter() - started, False)
+        raise
+    observe_upstream(endpoint, perf_counter() - started, response.ok)
+    if response.status_code == 401:
+        token_manager.invalidate()
+    if not response.ok:
+        raise EmailError(f"Error sending email: {response.text}")
+    print("Email sent successfully")
+
+def enqueue_alert(recipient, series, price, now, description, rule_id=None):
+    db.session.add(OutboxMessage(recipient=recipient, instrument=series[0], currency=series[1], price=price, description=description, rule_id=rule_id, created_at=now, next_attempt_at=now))
+
+def alert_content(batch):
+    # batch holds (instrument, currency, price, description, created_at) in creation order
+    instrument, currency, price, description, _ = batch[-1]
+    name = app.config['INSTRUMENTS'].get(instrument, instrument)
+    if len(batch) == 1:
+        return f'The {name} price is now {price:.2f} {currency} per gram, which is {description}.'
+    lines = [f'- {app.config["INSTRUMENTS"].get(instrument, instrument)} {description}: {price:.2f} {currency} at {created_at:%H:%M} UTC' for instrument, currency, price, description, created_at in batch]
+    return 'Triggered alerts:\n' + '\n'.join(lines)
+
+class RuleIndexCache:
+    # One index per series, rebuilt from the DB only after a rule or subscriber changed. Closed days do not
+    # change either, so the previous close and the rollups before today are loaded once per day and series.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.past = {}
+
+    def invalidate(self):
+        with self.lock:
+            self.indexes = {}
+            self.past = {}
+
+    def get(self, series):
+        with self.lock:
+            if series not in self.indexes:
+                rules = db.session.query(AlertRule.id, AlertRule.kind, AlertRule.threshold, AlertRule.window_days).join(Subscriber).filter(*series_filter(AlertRule, series), AlertRule.enabled, Subscriber.enabled)
+                self.indexes[series] = RuleIndex(rules)
+            return self.indexes[series]
+
+    def past_days(self, series, today, max_window):
+        with self.lock:
+            key, past = self.past.get(series, (None, None))
+            if key != (today, max_window):
+                previous_day = DailyRollup.query.filter(*series_filter(DailyRollup, series), DailyRollup.day < today).order_by(DailyRollup.day.desc()).first()
+                rollups = {}
+                if max_window > 1:
+                    rollups = {rollup.day: (rollup.low, rollup.high) for rollup in rollups_between(series, today - timedelta(days=max_window - 1), today)}
+                past = (previous_day.close if previous_day else None, [rollups.get(today - timedelta(days=offset)) for offset in range(1, max_window)])
+                self.past[series] = ((today, max_window), past)
+            return past
+
+rule_indexes = RuleIndexCache()
+
+class DashboardState:
+    # What the dashboard form shows, kept until a subscriber, rule or refresh token change in any worker. The
+    # page version and the shared generation make up the page's ETag, so a reload is answered with a 304 from memory.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+
+    def invalidate(self):
+        with self.lock:
+            self.state = None
+
+    def etag(self, logged_in):
+        # No query here: this worker's own edits sync at once, another worker's on the next tick or follower run
+        return f'{page_version}-{subscriber_generation.seen}-{int(logged_in)}'
+
+    def get(self):
+        with self.lock:
+            if self.state is None:
+                subscriber = Subscriber.query.order_by(Subscriber.id).first()
+                self.state = {
+                    'subscriber': {'email': subscriber.email, 'enabled': subscriber.enabled} if subscriber else None,
+                    'is_authenticated': RefreshToken.query.first() is not None
+                }
+            return self.state
+
+dashboard_state = DashboardState()
+
+class SharedGeneration:
+    # A CacheGeneration row; changed() is true once per bump made by any process since the last call
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.seen = None
+
+    def bump(self):
+        db.session.execute(db.text("INSERT INTO cache_generation (name, value) VALUES (:name, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1"), {'name': self.name})
+        db.session.commit()
+
+    def changed(self):
+        value = db.session.query(CacheGeneration.value).filter_by(name=self.name).scalar() or 0
+        with self.lock:
+            changed = value != self.seen
+            self.seen = value
+        return changed
+
+subscriber_generation = SharedGeneration('subscribers')
+
+def sync_subscriber_caches():
+    if subscriber_generation.changed():
+        rule_indexes.invalidate()
+        dashboard_state.invalidate()
+
+def subscribers_changed():
+    # After committing a change; other workers drop their caches on their next sync_subscriber_caches()
+    subscriber_generation.bump()
+    sync_subscriber_caches()
+
+def evaluate_rules(series, price, now, rows):
+    index = rule_indexes.get(series)
+    if index.empty:
+        return
+    today = now.date()
+    max_window = index.max_window()
+    previous_close, past_rollups = rule_indexes.past_days(series, today, max_window)
+    key = (series[0], series[1], today)
+    today_rollup = rows.get(key) or db.session.get(DailyRollup, key)
+    latest_close = today_rollup.close if today_rollup else previous_close
+    lows, highs = {}, {}
+    if max_window:
+        windows = set(index.new_lows) | set(index.new_highs)
+        lows, highs = window_extremes([(today_rollup.low, today_rollup.high) if today_rollup else None] + past_rollups, windows)
+    fired = index.crossed(latest_close, price, previous_close, lows, highs)
+    for start in range(0, len(fired), 500):
+        for rule in AlertRule.query.filter(AlertRule.id.in_(fired[start:start + 500])).options(db.joinedload(AlertRule.subscriber)):
+            if rule.last_triggered_at and now - rule.last_triggered_at < timedelta(seconds=rule.cooldown_seconds or 0):
+                continue
+            rule.last_triggered_at = now
+            alerts_enqueued.inc(kind=rule.kind)
+            enqueue_alert(rule.subscriber.email, series, price, now, describe_rule(rule.kind, rule.threshold, rule.window_days, series[1]), rule.id)
+
+def deliver_alerts():
+    # Background outbox worker: one message per recipient per coalescing window, with exponential backoff on failure
+    with app.app_context():
+        now = datetime.utcnow()
+        # A 'sending' row whose claim has expired belongs to a worker that stopped mid-send
+        claimable = (OutboxMessage.status.in_(('pending', 'sending')), OutboxMessage.next_attempt_at <= now)
+        due = OutboxMessage.query.filter(*claimable).order_by(OutboxMessage.created_at).all()
+        batches = {}
+        for message in due:
+            batches.setdefault(message.recipient, []).append((message.id, (message.instrument or 'XAU', message.currency or 'EUR', message.price, message.description or 'a new low', message.created_at), message.attempts))
+        db.session.commit()
+        window = timedelta(seconds=app.config['ALERT_COALESCE_WINDOW'])
+        for recipient, batch in batches.items():
+            ids = [message_id for message_id, _, _ in batch]
+            first_created_at = batch[0][1][4]
+            attempts = max(attempts for _, _, attempts in batch)
+            if attempts == 0 and now - first_created_at < window:
+                continue
+            # Claim each row before sending, so a second worker that also believes it holds the lease skips them
+            claim = {'status': 'sending', 'next_attempt_at': now + timedelta(seconds=app.config['ALERT_CLAIM_TIMEOUT'])}
+            claimed = {message_id for message_id in ids if OutboxMessage.query.filter(OutboxMessage.id == message_id, *claimable).update(claim, synchronize_session=False)}
+            db.session.commit()
+            batch = [message for message in batch if message[0] in claimed]
+            ids = [message_id for message_id, _, _ in batch]
+            if not ids:
+                continue
+            started = perf_counter()
+            try:
+                send_email(recipient, alert_content([alert for _, alert, _ in batch]))
+            except Exception as e:
+                print(f"Error delivering alert to {recipient}: {e}")
+                alert_failures.inc()
+                attempts += 1
+                failed = attempts >= app.config['ALERT_MAX_ATTEMPTS']
+                OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).update({
+                    'attempts': attempts,
+                    'status': 'failed' if failed else 'pending',
+                    'next_attempt_at': now + timedelta(seconds=app.config['ALERT_RETRY_BACKOFF'] * 2 ** (attempts - 1)),
+                    'last_error': str(e)[:1024]
+                }, synchronize_session=False)
+                db.session.commit()
+                continue
+            alert_send_seconds.observe(perf_counter() - started)
+            alerts_sent.inc(len(ids))
+            OutboxMessage.query.filter(OutboxMessage.id.in_(ids)).update({'status': 'sent', 'sent_at': datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+
+def price_event(timestamp, series, price):
+    # Stream events always carry the per-gram price, clients scale to their unit
+    return app.json.dumps({'timestamp': timestamp.isoformat(), 'instrument': series[0], 'currency': series[1], 'price': price})
+
+tick_stats = StageStats(observer=lambda stage, seconds: tick_stage_seconds.observe(seconds, stage=stage))
 
-def fetch_and_store_price():
+def store_prices(samples):
+    started = perf_counter()
+    alert_seconds = 0.0
     with app.app_context():
+        # Rule edits may have been made through another worker
+        sync_subscriber_caches()
         try:
-            price = get_gold_price()
-            today = datetime.utcnow().date()
-            today_lowest = db.session.query(db.func.min(GoldPrice.price)).filter(db.func.date(GoldPrice.timestamp) == today).scalar()
-            yesterday = today - timedelta(days=1)
-            yesterday_lowest = db.session.query(db.func.min(GoldPrice.price)).filter(db.func.date(GoldPrice.timestamp) == yesterday).scalar()
-            new_price = GoldPrice(price=price)
-            db.session.add(new_price)
+            stored = []
+            rows = {}
+            for timestamp, series, price in samples:
+                # Rules are evaluated against the rollups as they were before this tick
+                alert_started = perf_counter()
+                evaluate_rules(series, price, timestamp, rows)
+                alert_seconds += perf_counter() - alert_started
+                new_price = GoldPrice(timestamp=timestamp, instrument=series[0], currency=series[1], price=price)
+                db.session.add(new_price)
+                rollup = update_rollup(series, timestamp, price, rows)
+                stored.append((new_price, timestamp, series, price, rollup.day, rollup.close))
+            db.session.flush()
+            stored = [(new_price.id, timestamp, series, price, day, close) for new_price, timestamp, series, price, day, close in stored]
             db.session.commit()
-            if (today_lowest is None or price < today_lowest): #or (yesterday_lowest is not None and price < yesterday_lowest):
-                setting = Setting.query.first()
-                if setting and setting.email_notifications:
-                    send_email(setting.recipient_email, price)
-                    setting.last_email_time = datetime.utcnow()
-                    db.session.commit()
-        except Exception as e:
-            print(f"Error fetching price: {e}")
+        except Exception:
+            db.session.rollback()
+            ingest_failures.inc()
+            raise
+    tick_stats.record('alert', alert_seconds)
+    tick_stats.record('db', perf_counter() - started - alert_seconds)
+    data_version.stored(stored, apply_ticks)
+    return [price_id for price_id, _, _, _, _, _ in stored]
+
+ingest_writer = IngestWriter(store_prices, batch_size=app.config['INGEST_BATCH_SIZE'], linger=app.config['INGEST_LINGER'])
+
+def fetch_and_store_price(now=None):
+    # now overrides the tick's timestamp, for replaying a recorded tape
+    try:
+        with tick_stats.stage('fetch'):
+            prices = get_spot_prices()
+        if now is None:
+            now = datetime.utcnow()
+        # The writer batches the tick's series into one transaction
+        return [ingest_writer.submit(now, series, price) for series, price in prices.items()]
+    except Exception as e:
+        print(f"Error fetching price: {e}")
+
+tick_profiler = SamplingProfiler(os.path.join(app.instance_path, 'profiles'), interval=app.config['PROFILE_INTERVAL'], enabled=app.config['PROFILE_SLOW_TICKS'])
+
+def sample_tick(scheduled_at, now=None):
+    with tick_profiler.profile('tick', app.config['PROFILE_TICK_THRESHOLD']):
+        futures = fetch_and_store_price(now)
+        if not futures:
+            return False
+        with tick_stats.stage('store'):
+            done, pending = wait(futures, timeout=app.config['SAMPLE_INTERVAL'])
+        return not pending and all(future.exception() is None for future in done)
+
+class DatabaseLease:
+    # Expiring row in the shared database; the owner renews it on every tick and from the sampler's heartbeat,
+    # and another worker takes over once it has not been renewed for ttl seconds
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+
+    @property
+    def owner(self):
+        # Computed per call so forked workers never share an identity
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def acquire(self):
+        with app.app_context():
+            now = datetime.utcnow()
+            values = {'owner': self.owner, 'expires_at': now + timedelta(seconds=self.ttl)}
+            updated = SchedulerLease.query.filter(
+                SchedulerLease.name == self.name,
+                db.or_(SchedulerLease.owner == values['owner'], SchedulerLease.expires_at < now)
+            ).update(values, synchronize_session=False)
+            if not updated:
+                if db.session.get(SchedulerLease, self.name) is not None:
+                    db.session.rollback()
+                    return False
+                db.session.add(SchedulerLease(name=self.name, **values))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another worker inserted the row first
+                db.session.rollback()
+                return False
+            return True
+
+    def release(self):
+        with app.app_context():
+            SchedulerLease.query.filter_by(name=self.name, owner=self.owner).update({'expires_at': datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+
+def record_missed_ticks(start, end, count, reason):
+    missed_ticks.inc(count, reason=reason)
+    print(f"Missed {count} sample tick(s) starting {datetime.utcfromtimestamp(start).isoformat()} ({reason})")
+    with app.app_context():
+        db.session.add(MissedTick(start=datetime.utcfromtimestamp(start), end=datetime.utcfromtimestamp(end), count=count, reason=reason))
+        db.session.commit()
+
+def record_downtime(scheduled_at):
+    # Boundaries between the last stored sample and the first tick this process runs. The providers only
+    # quote spot prices, so these are marked as missed rather than backfilled.
+    with app.app_context():
+        last = db.session.query(db.func.max(GoldPrice.timestamp)).scalar()
+    if last is None:
+        return
+    first_missed = sampler.next_boundary(last.replace(tzinfo=timezone.utc).timestamp())
+    count = round((scheduled_at - first_missed) / sampler.interval)
+    if count > 0:
+        sampler.mark_missed(first_missed, scheduled_at - sampler.interval, count, 'downtime')
+
+sampler = Sampler(
+    sample_tick,
+    app.config['SAMPLE_INTERVAL'],
+    lease=DatabaseLease('sampler', app.config['SAMPLE_LEASE_TTL']),
+    on_missed=record_missed_ticks,
+    on_leader=record_downtime,
+    stats=tick_stats
+)
+
+def run_alert_worker():
+    # Only the worker holding the sampler lease drains the outbox, so an alert is not sent once per worker
+    if sampler.leader:
+        deliver_alerts()
 
 scheduler = BackgroundScheduler()
-scheduler.add_job(fetch_and_store_price, 'interval', seconds=90)
+scheduler.add_job(run_alert_worker, 'interval', seconds=app.config['ALERT_WORKER_INTERVAL'], max_instances=1, coalesce=True)
+
+def run_retention():
+    if sampler.leader:
+        with app.app_context():
+            days = apply_retention()
+        if days:
+            print(f"Compacted {days} days of raw ticks")
+
+scheduler.add_job(run_retention, 'interval', seconds=app.config['RETENTION_INTERVAL'], max_instances=1, coalesce=True)
+
+def run_follower():
+    # The leader's views are updated as it stores ticks; the other workers read them back from the DB
+    if not sampler.leader:
+        with app.app_context():
+            data_version.poll()
+            sync_subscriber_caches()
+
+scheduler.add_job(run_follower, 'interval', seconds=app.config['FOLLOW_INTERVAL'], max_instances=1, coalesce=True)
+
+def start_background_jobs():
+    # Called once per serving process: from __main__ here, from post_worker_init in gunicorn.conf.py under gunicorn
+    sampler.start()
+    if not scheduler.running:
+        scheduler.start()
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
+    # The form manages the first subscriber and its new-daily-low rule, other subscribers go through /subscribers
     if request.method == 'POST':
         email_notifications = 'email_notifications' in request.form
         recipient_email = request.form['recipient_email']
-        setting = Setting.query.first()
-        if setting is None:
-            setting = Setting(email_notifications=email_notifications, recipient_email=recipient_email, last_email_time=None)
-            db.session.add(setting)
-        else:
-            setting.email_notifications = email_notifications
-            setting.recipient_email = recipient_email
-        db.session.commit()
+        subscriber = Subscriber.query.order_by(Subscriber.id).first()
+        if Subscriber.query.filter(Subscriber.email == recipient_email, Subscriber.id != (subscriber.id if subscriber else None)).first() is not None:
+            return "Error: another subscriber already uses this email address", 409
+        if subscriber is None:
+            subscriber = Subscriber()
+            db.session.add(subscriber)
+        subscriber.email = recipient_email
+        subscriber.enabled = email_notifications
+        instrument, currency = app.config['DEFAULT_SERIES']
+        if not any(rule.kind == 'new_low' and (rule.window_days or 1) == 1 and (rule.instrument, rule.currency) == (instrument, currency) for rule in subscriber.rules):
+            subscriber.rules.append(AlertRule(instrument=instrument, currency=currency, kind='new_low', window_days=1, cooldown_seconds=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return "Error: another subscriber already uses this email address", 409
+        subscribers_changed()
         return redirect(url_for('index'))
-    setting = Setting.query.first()
-    refresh_token_exists = RefreshToken.query.first() is not None
-    return render_template('index.html', setting=setting, is_authenticated=refresh_token_exists, is_logged_in=session.get('logged_in', False))
+    is_logged_in = session.get('logged_in', False)
+    etag = dashboard_state.etag(is_logged_in)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        state = dashboard_state.get()
+        response = app.make_response(render_template(
+            'index.html',
+            subscriber=state['subscriber'],
+            instruments=app.config['INSTRUMENTS'],
+            currencies=app.config['CURRENCIES'],
+            units=app.config['UNITS'],
+            default_series=app.config['DEFAULT_SERIES'],
+            is_authenticated=state['is_authenticated'],
+            is_logged_in=is_logged_in
+        ))
+    # Depends on the session, so browsers may keep it but must revalidate each load
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def subscriber_to_dict(subscriber, rules=True):
+    data = {'id': subscriber.id, 'email': subscriber.email, 'enabled': subscriber.enabled}
+    if rules:
+        data['rules'] = [rule_to_dict(rule) for rule in subscriber.rules]
+    return data
+
+def rule_to_dict(rule):
+    return {
+        'id': rule.id,
+        'subscriber_id': rule.subscriber_id,
+        'instrument': rule.instrument,
+        'currency': rule.currency,
+        'kind': rule.kind,
+        'threshold': rule.threshold,
+        'window_days': rule.window_days,
+        'cooldown_seconds': rule.cooldown_seconds,
+        'enabled': rule.enabled,
+        'last_triggered_at': rule.last_triggered_at.isoformat() if rule.last_triggered_at else None
+    }
+
+def is_number(value):
+    # bool is an int subclass, but true/false is never a valid threshold or count
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def apply_rule_fields(rule, data):
+    # Every supplied field is type-checked whatever the kind, so nothing reaches the column binds unchecked
+    for field, valid, message in (
+        ('instrument', lambda value: isinstance(value, str), "instrument must be a string"),
+        ('currency', lambda value: isinstance(value, str), "currency must be a string"),
+        ('kind', lambda value: isinstance(value, str), "kind must be a string"),
+        ('threshold', lambda value: value is None or is_number(value), "threshold must be a number"),
+        ('window_days', lambda value: value is None or is_count(value), "window_days must be an integer"),
+        ('cooldown_seconds', lambda value: value is None or is_count(value), "cooldown_seconds must be a non-negative integer"),
+        ('enabled', lambda value: isinstance(value, bool), "enabled must be true or false"),
+    ):
+        if field in data:
+            if not valid(data[field]):
+                return message
+            setattr(rule, field, data[field])
+    rule.instrument = rule.instrument or app.config['DEFAULT_SERIES'][0]
+    rule.currency = rule.currency or app.config['DEFAULT_SERIES'][1]
+    if rule.instrument not in app.config['INSTRUMENTS']:
+        return f"instrument must be one of {', '.join(app.config['INSTRUMENTS'])}"
+    if rule.currency not in app.config['CURRENCIES']:
+        return f"currency must be one of {', '.join(app.config['CURRENCIES'])}"
+    if rule.kind not in RULE_KINDS:
+        return f"kind must be one of {', '.join(RULE_KINDS)}"
+    if rule.kind in ('below', 'above', 'pct_move') and not is_number(rule.threshold):
+        return "threshold is required for this kind"
+    if rule.kind == 'pct_move' and rule.threshold == 0:
+        return "threshold must be non-zero for pct_move"
+    if rule.kind in ('new_low', 'new_high'):
+        rule.window_days = rule.window_days or 1
+    if rule.window_days is not None and not 1 <= rule.window_days <= app.config['ALERT_MAX_WINDOW_DAYS']:
+        return f"window_days must be between 1 and {app.config['ALERT_MAX_WINDOW_DAYS']}"
+    if rule.cooldown_seconds is None:
+        rule.cooldown_seconds = app.config['ALERT_DEFAULT_COOLDOWN']
+    if rule.cooldown_seconds < 0:
+        return "cooldown_seconds must be a non-negative integer"
+    if rule.enabled is None:
+        rule.enabled = True
+    return None
+
+def request_object():
+    # The JSON body as a dict, {} when there is none, None when it is JSON but not an object
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    return data if isinstance(data, dict) else None
+
+def subscriber_fields_error(data):
+    if not isinstance(data.get('email'), str) or not data['email']:
+        return "email is required"
+    if not isinstance(data.get('enabled'), bool):
+        return "enabled must be true or false"
+    return None
+
+@app.route('/subscribers', methods=['GET', 'POST'])
+def subscribers():
+    if request.method == 'POST':
+        data = request_object()
+        if data is None:
+            return jsonify({'error': "body must be a JSON object"}), 400
+        error = subscriber_fields_error(dict({'enabled': True}, **data))
+        if error:
+            return jsonify({'error': error}), 400
+        if Subscriber.query.filter_by(email=data['email']).first() is not None:
+            return jsonify({'error': "subscriber already exists"}), 409
+        subscriber = Subscriber(email=data['email'], enabled=data.get('enabled', True))
+        db.session.add(subscriber)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Created by a concurrent request after the check above
+            db.session.rollback()
+            return jsonify({'error': "subscriber already exists"}), 409
+        subscribers_changed()
+        return jsonify(subscriber_to_dict(subscriber)), 201
+    limit = request.args.get('limit', 100, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit < 0 or offset < 0:
+        return jsonify({'error': "limit and offset must be non-negative"}), 400
+    page = Subscriber.query.order_by(Subscriber.id).limit(limit).offset(offset)
+    return jsonify([subscriber_to_dict(subscriber, rules=False) for subscriber in page])
+
+@app.route('/subscribers/<int:subscriber_id>', methods=['GET', 'PATCH', 'DELETE'])
+def subscriber_detail(subscriber_id):
+    subscriber = db.get_or_404(Subscriber, subscriber_id)
+    if request.method == 'DELETE':
+        db.session.delete(subscriber)
+        db.session.commit()
+        subscribers_changed()
+        return '', 204
+    if request.method == 'PATCH':
+        data = request_object()
+        if data is None:
+            return jsonify({'error': "body must be a JSON object"}), 400
+        error = subscriber_fields_error(dict({'email': subscriber.email, 'enabled': subscriber.enabled}, **data))
+        if error:
+            return jsonify({'error': error}), 400
+        for field in ('email', 'enabled'):
+            if field in data:
+                setattr(subscriber, field, data[field])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': "another subscriber already uses this email"}), 409
+        subscribers_changed()
+    return jsonify(subscriber_to_dict(subscriber))
+
+@app.route('/subscribers/<int:subscriber_id>/rules', methods=['POST'])
+def subscriber_rules(subscriber_id):
+    subscriber = db.get_or_404(Subscriber, subscriber_id)
+    data = request_object()
+    if data is None:
+        return jsonify({'error': "body must be a JSON object"}), 400
+    rule = AlertRule(subscriber=subscriber)
+    error = apply_rule_fields(rule, data)
+    if error:
+        db.session.rollback()
+        return jsonify({'error': error}), 400
+    db.session.add(rule)
+    db.session.commit()
+    subscribers_changed()
+    return jsonify(rule_to_dict(rule)), 201
+
+@app.route('/rules/<int:rule_id>', methods=['GET', 'PATCH', 'DELETE'])
+def rule_detail(rule_id):
+    rule = db.get_or_404(AlertRule, rule_id)
+    if request.method == 'DELETE':
+        db.session.delete(rule)
+        db.session.commit()
+        subscribers_changed()
+        return '', 204
+    if request.method == 'PATCH':
+        data = request_object()
+        if data is None:
+            return jsonify({'error': "body must be a JSON object"}), 400
+        error = apply_rule_fields(rule, data)
+        if error:
+            db.session.rollback()
+            return jsonify({'error': error}), 400
+        db.session.commit()
+        subscribers_changed()
+    return jsonify(rule_to_dict(rule))
 
 @app.route('/login')
 def login():
@@ -156,26 +1581,289 @@ def get_token():
         redirect_uri=app.config['REDIRECT_URI']
     )
     if "refresh_token" in result:
-        refresh_token = RefreshToken.query.first()
-        if refresh_token is None:
-            refresh_token = RefreshToken(token=result["refresh_token"])
-            db.session.add(refresh_token)
-        else:
-            refresh_token.token = result["refresh_token"]
-        db.session.commit()
+        with token_manager.lock:
+            token_manager.store(result)
         return "Authentication successful. You can close this window."
     return f"Error: {result.get('error_description')}", 400
 
+def parse_timestamp(value):
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def request_series():
+    # (instrument, currency) from the query string, None when either is unknown
+    instrument = request.args.get('instrument', app.config['DEFAULT_SERIES'][0]).upper()
+    currency = request.args.get('currency', app.config['DEFAULT_SERIES'][1]).upper()
+    if instrument not in app.config['INSTRUMENTS'] or currency not in app.config['CURRENCIES']:
+        return None
+    return instrument, currency
+
+def series_error():
+    return f"Error: instrument must be one of {', '.join(app.config['INSTRUMENTS'])} and currency one of {', '.join(app.config['CURRENCIES'])}", 400
+
+def accepted_encoding():
+    return request.accept_encodings.best_match(available_encodings())
+
+def data_response(response, etag):
+    # Fresh until shortly after the next sample boundary, then revalidated against the latest tick id
+    now = datetime.utcnow().timestamp()
+    slack = app.config['CACHE_TICK_SLACK']
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max(1, int(sampler.next_boundary(now - slack) + slack - now))
+    response.vary.add('Accept-Encoding')
+    return response
+
+def not_modified(etag):
+    # A 304 when the client already holds etag, otherwise None
+    if request.if_none_match.contains_weak(etag):
+        return data_response(Response(status=304), etag)
+    return None
+
+def price_history(series, start, end, max_points, method, unit):
+    # Read from the finest tier that returns at most a few times max_points rows, so the work per
+    # request is bounded by max_points rather than by the length of the range
+    span = (end - start).total_seconds()
+    # Raw ticks are one per SAMPLE_INTERVAL, so a faster sampler moves long ranges onto the aggregates sooner
+    tiers = [('raw', app.config['SAMPLE_INTERVAL'])] + sorted(AGGREGATE_RESOLUTIONS.items(), key=lambda tier: tier[1]) + [('1d', 86400)]
+    # A tier whose retention does not reach back to start would return a truncated range
+    retention = app.config['RETENTION_DAYS']
+    now = datetime.utcnow()
+    tiers = [(name, seconds) for name, seconds in tiers if retention.get(name) is None or start >= now - timedelta(days=retention[name])]
+    resolution = next((name for name, seconds in tiers if span / seconds <= TIER_OVERSAMPLING * max_points), '1d')
+    if resolution == 'raw':
+        rows = [(timestamp, price, price, price) for timestamp, price in price_points_between(series, start, end)]
+    elif resolution == '1d':
+        end_day = end.date() if end == datetime.combine(end.date(), time.min) else end.date() + timedelta(days=1)
+        rows = [(datetime.combine(r.day, time.min), r.low, r.high, r.close) for r in rollups_between(series, start.date(), end_day)]
+    else:
+        rows = [(r.bucket, r.low, r.high, r.close) for r in aggregates_between(series, AGGREGATE_RESOLUTIONS[resolution], bucket_start(start, AGGREGATE_RESOLUTIONS[resolution]), end)]
+    xs = [to_micros(timestamp) for timestamp, _, _, _ in rows]
+    if method == 'minmax':
+        xs, ys = min_max(xs, [low for _, low, _, _ in rows], [high for _, _, high, _ in rows], max_points)
+    else:
+        xs, ys = lttb(xs, [close for _, _, _, close in rows], max_points)
+    grams = app.config['UNITS'][unit]
+    return {
+        'timestamps': [from_micros(x).isoformat() for x in xs],
+        'prices': ys if grams == 1 else [y * grams for y in ys],
+        'instrument': series[0],
+        'currency': series[1],
+        'unit': unit,
+        'resolution': resolution,
+        'method': method
+    }
+
 @app.route('/get_data')
 def get_data():
-    today = datetime.utcnow().date()
-    today_prices = GoldPrice.query.filter(db.func.date(GoldPrice.timestamp) == today).all()
-    timestamps = [p.timestamp.isoformat() for p in today_prices]
-    prices = [p.price for p in today_prices]
-    return jsonify({'timestamps': timestamps, 'prices': prices})
+    series = request_series()
+    if series is None:
+        return series_error()
+    unit = request.args.get('unit', 'g')
+    if unit not in app.config['UNITS']:
+        return f"Error: unit must be one of {', '.join(app.config['UNITS'])}", 400
+    if 'from' in request.args:
+        try:
+            start = parse_timestamp(request.args['from'])
+            end = parse_timestamp(request.args['to']) if 'to' in request.args else datetime.utcnow()
+        except ValueError:
+            return "Error: from and to must be ISO 8601 timestamps", 400
+        if end <= start:
+            return "Error: to must be after from", 400
+        max_points = min(request.args.get('max_points', app.config['DEFAULT_MAX_POINTS'], type=int), app.config['MAX_POINTS_LIMIT'])
+        if max_points < 3:
+            return "Error: max_points must be at least 3", 400
+        method = request.args.get('method', 'lttb')
+        if method not in ('lttb', 'minmax'):
+            return "Error: method must be lttb or minmax", 400
+        # The URL carries the range and options, so the latest tick id is enough to validate it
+        etag = str(data_version.current())
+        return not_modified(etag) or data_response(jsonify(price_history(series, start, end, max_points, method, unit)), etag)
+    since = None
+    if 'since' in request.args:
+        try:
+            since = parse_timestamp(request.args['since'])
+        except ValueError:
+            return "Error: since must be an ISO 8601 timestamp", 400
+    # The day is part of the validator because the body empties at midnight before the next tick arrives
+    day = datetime.utcnow().date()
+    etag = f'{data_version.current()}-{day.isoformat()}'
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    today = today_series[series]
+    today.load(day)
+    if since is not None:
+        return data_response(app.response_class(today.delta_response_body(since, unit), mimetype='application/json'), etag)
+    body, encoding = today.response_body(unit, accepted_encoding())
+    response = app.response_class(body, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return data_response(response, etag)
+
+@app.route('/stream')
+def stream():
+    series = request_series()
+    if series is None:
+        return series_error()
+    price_hub = price_hubs[series]
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        return "Error: Last-Event-ID must be an integer", 400
+    backlog = []
+    if last_id is None:
+        last_id = price_hub.last_id
+    else:
+        backlog = price_hub.events_after(last_id)
+        if backlog is None:
+            # Reconnect after a restart or a long gap: replay what the ring buffer no longer holds from the DB
+            rows = db.session.query(GoldPrice.id, GoldPrice.timestamp, GoldPrice.price).filter(*series_filter(GoldPrice, series), GoldPrice.id > last_id).order_by(GoldPrice.id).limit(app.config['STREAM_RESUME_LIMIT']).all()
+            backlog = [(row_id, format_event(row_id, price_event(timestamp, series, price))) for row_id, timestamp, price in rows]
+    return Response(
+        price_hub.stream(last_id, backlog, app.config['STREAM_HEARTBEAT']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/analytics')
+def analytics():
+    series = request_series()
+    if series is None:
+        return series_error()
+    days = request.args.get('days', 365, type=int)
+    if days < 1:
+        return "Error: days must be positive", 400
+    etag = str(data_version.current())
+    return not_modified(etag) or data_response(jsonify(dict(load_analytics(series).report(days), instrument=series[0], currency=series[1], unit='g')), etag)
+
+metrics.gauge('sampler_leader', "1 while this process holds the sampler lease", fn=lambda: int(sampler.leader))
+metrics.gauge('stream_subscribers', "Open /stream connections", fn=lambda: sum(hub.subscribers for hub in list(price_hubs.values())))
+metrics.gauge('ingest_queue_depth', "Samples waiting for the ingest writer", fn=lambda: ingest_writer.queue.qsize())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+@app.after_request
+def observe_request(response):
+    endpoint = request.endpoint or 'unknown'
+    if endpoint != 'get_metrics' and 'request_started' in g:
+        http_request_seconds.observe(perf_counter() - g.request_started, endpoint=endpoint)
+        if not response.is_streamed:
+            http_response_bytes.observe(response.content_length or 0, endpoint=endpoint)
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Registered after observe_request so it runs first and the size histogram sees the compressed body
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = accepted_encoding()
+    if encoding is None or len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def vendor_directory():
+    return os.path.join(app.static_folder, 'vendor')
+
+def vendored_versions():
+    versions = {}
+    for name in app.config['VENDOR_ASSETS']:
+        path = os.path.join(vendor_directory(), name)
+        versions[name] = int(os.path.getmtime(path)) if os.path.exists(path) else None
+    return versions
+
+# Read once per process like the code and templates, so the asset URLs and the dashboard ETag always agree
+asset_versions = vendored_versions()
+
+def asset_url(name):
+    # The vendored copy when vendor-assets has fetched it, versioned by mtime so it can be cached for a year
+    if asset_versions[name] is not None:
+        return url_for('vendor_asset', name=name, v=asset_versions[name])
+    return app.config['VENDOR_ASSETS'][name]
+
+def page_digest():
+    # Everything the rendered dashboard depends on besides its state, so a deploy is never answered with a 304
+    digest = hashlib.sha256(app.config['APP_VERSION'].encode())
+    template_directory = os.path.join(app.root_path, app.template_folder)
+    for path in [__file__] + sorted(os.path.join(template_directory, name) for name in os.listdir(template_directory)):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(repr(sorted(asset_versions.items())).encode())
+    return digest.hexdigest()[:16]
+
+page_version = page_digest()
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+@app.route('/vendor/<name>')
+def vendor_asset(name):
+    if name not in app.config['VENDOR_ASSETS']:
+        return "Error: unknown asset", 404
+    # vendor-assets stores a gzipped copy next to each file, served as is to clients that accept it
+    gzipped = request.accept_encodings['gzip'] and os.path.exists(os.path.join(vendor_directory(), name + '.gz'))
+    response = send_from_directory(vendor_directory(), name + '.gz' if gzipped else name, mimetype=mimetypes.guess_type(name)[0], max_age=app.config['VENDOR_MAX_AGE'])
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.cli.command('vendor-assets')
+def vendor_assets_command():
+    os.makedirs(vendor_directory(), exist_ok=True)
+    for name, url in app.config['VENDOR_ASSETS'].items():
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        path = os.path.join(vendor_directory(), name)
+        with open(path, 'wb') as f:
+            f.write(response.content)
+        with open(path + '.gz', 'wb') as f:
+            f.write(compress(response.content, 'gzip'))
+        print(f"Saved {url} to {path}")
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route('/get_tick_stats')
+def get_tick_stats():
+    missed = MissedTick.query.order_by(MissedTick.start.desc()).limit(20)
+    return jsonify(dict(
+        tick_stats.snapshot(),
+        interval=sampler.interval,
+        leader=sampler.leader,
+        missed=sampler.missed,
+        recent_missed=[{'start': m.start.isoformat(), 'end': m.end.isoformat(), 'count': m.count, 'reason': m.reason} for m in missed]
+    ))
+
+@app.route('/get_fetch_stats')
+def get_fetch_stats():
+    return jsonify({
+        'sources': price_fetcher.stats_snapshot(),
+        'spot_providers': spot_providers.stats_snapshot(),
+        'fx_providers': fx_providers.stats_snapshot()
+    })
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-    scheduler.start()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+        migrate_db()
+    if os.getenv('GOLD_TRACKER_SERVER') == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        start_background_jobs()
+        WSGIServer(('0.0.0.0', 5000), app).serve_forever()
+    else:
+        # The debug reloader imports this module in a watcher process and a serving child; only the child samples
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_jobs()
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
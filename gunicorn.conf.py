@@ -0,0 +1,19 @@
+# gunicorn -c gunicorn.conf.py gold_tracker:app
+# Each worker runs the background jobs; the sampler lease picks the one that samples and sends alerts,
+# the others follow its ticks from the DB.
+import subprocess
+import sys
+
+bind = '0.0.0.0:5000'
+workers = 4
+worker_class = 'gevent'
+
+
+def on_starting(server):
+    # In a child process, so the master never imports the app before the workers are forked and patched
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'gold_tracker', 'migrate'], check=True)
+
+
+def post_worker_init(worker):
+    from gold_tracker import start_background_jobs
+    start_background_jobs()
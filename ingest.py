@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class IngestWriter:
+    # Single background writer. Samples are queued by the sampling job and written by write_batch
+    # in one transaction per batch: whatever is queued (up to batch_size), plus anything arriving
+    # within linger seconds, shares one commit and so one fsync.
+    def __init__(self, write_batch, batch_size=500, linger=0.05):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.samples = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='ingest-writer', daemon=True)
+                self.thread.start()
+
+    def submit(self, *sample):
+        self.start()
+        future = Future()
+        self.queue.put((sample, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.write_batch([sample for sample, _ in batch])
+            except Exception as e:
+                print(f"Error writing prices: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.samples += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class FetchError(Exception):
+    pass
+
+
+class SourceStats:
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'retries': self.retries,
+            'last_ms': round(self.latencies[-1] * 1000, 1) if latencies else None,
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+
+
+class PriceFetcher:
+    # One keep-alive session shared by a small thread pool, so every source is requested concurrently
+    # over pooled connections instead of paying a new TLS handshake per call
+    def __init__(self, timeout=5.0, deadline=10.0, retries=2, backoff=0.25, pool_size=4, on_request=None):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='price-fetcher')
+        self.stats = defaultdict(SourceStats)
+        self.stats_lock = threading.Lock()
+        # on_request(url, seconds, ok) is called after every attempt, for metrics
+        self.on_request = on_request
+
+    def get_json(self, source, url, deadline_at=None):
+        if deadline_at is None:
+            deadline_at = time.monotonic() + self.deadline
+        for attempt in range(self.retries + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise FetchError(f"{source}: deadline exceeded")
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=min(self.timeout, remaining))
+                response.raise_for_status()
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                if self.on_request is not None:
+                    self.on_request(url, time.monotonic() - started, False)
+                with self.stats_lock:
+                    self.stats[source].failures += 1
+                if attempt == self.retries:
+                    raise FetchError(f"{source}: {e}") from e
+                with self.stats_lock:
+                    self.stats[source].retries += 1
+                # Exponential backoff with full jitter, never sleeping past the deadline
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                time.sleep(max(0, min(delay, deadline_at - time.monotonic())))
+                continue
+            if self.on_request is not None:
+                self.on_request(url, time.monotonic() - started, True)
+            with self.stats_lock:
+                self.stats[source].latencies.append(time.monotonic() - started)
+                self.stats[source].successes += 1
+            return data
+
+    def stats_snapshot(self):
+        with self.stats_lock:
+            return {source: stats.snapshot() for source, stats in self.stats.items()}
@@ -0,0 +1,200 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from price_fetcher import FetchError
+
+
+class Provider:
+    name = None
+    # Overridable per instance, e.g. to point at a local stand-in
+    base_url = None
+    # Keys the provider can quote, None for any
+    symbols = None
+
+    def supports(self, key):
+        return self.symbols is None or key in self.symbols
+
+    def fetch(self, fetcher, key):
+        raise NotImplementedError
+
+
+class GoldApiProvider(Provider):
+    name = 'gold-api'
+    base_url = 'https://api.gold-api.com'
+
+    def fetch(self, fetcher, symbol):
+        return float(fetcher.get_json(self.name, f'{self.base_url}/price/{symbol}')['price'])
+
+
+class GoldPriceOrgProvider(Provider):
+    name = 'goldprice.org'
+    symbols = ('XAU', 'XAG')
+    base_url = 'https://data-asg.goldprice.org'
+
+    def fetch(self, fetcher, symbol):
+        response = fetcher.get_json(self.name, f'{self.base_url}/dbXRates/USD')
+        return float(response['items'][0][f'{symbol.lower()}Price'])
+
+
+class FrankfurterProvider(Provider):
+    name = 'frankfurter'
+    base_url = 'https://api.frankfurter.app'
+
+    def fetch(self, fetcher, pair):
+        base, quote = pair.split('/')
+        response = fetcher.get_json(self.name, f'{self.base_url}/latest?from={base}&to={quote}')
+        return float(response['rates'][quote])
+
+
+class OpenErApiProvider(Provider):
+    name = 'open.er-api'
+    base_url = 'https://open.er-api.com'
+
+    def fetch(self, fetcher, pair):
+        base, quote = pair.split('/')
+        response = fetcher.get_json(self.name, f'{self.base_url}/v6/latest/{base}')
+        return float(response['rates'][quote])
+
+
+class FakeProvider(Provider):
+    # Offline stand-in: returns values[key] after an optional delay, or raises when fail is set
+    def __init__(self, name='fake', values=None, delay=0.0, fail=False):
+        self.name = name
+        self.values = values or {'XAU': 3300.0, 'XAG': 38.0, 'XPT': 1400.0, 'USD/EUR': 0.9, 'USD/GBP': 0.78, 'USD/CHF': 0.85}
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def fetch(self, fetcher, key):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise FetchError("simulated failure")
+        return float(self.values[key])
+
+
+PROVIDERS = {
+    'gold-api': GoldApiProvider,
+    'goldprice.org': GoldPriceOrgProvider,
+    'frankfurter': FrankfurterProvider,
+    'open.er-api': OpenErApiProvider,
+    'fake': FakeProvider,
+}
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and lets a single trial call through
+    # once reset_timeout has passed (half-open); a success closes it again
+    def __init__(self, failure_threshold=3, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release(self):
+        # The call allow() let through was cancelled before it started and will report neither outcome
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class ProviderChain:
+    # Asks providers in priority order. If the current one has not answered after hedge_after
+    # seconds (or has failed) the next healthy provider is started as well, and the first
+    # successful answer wins.
+    def __init__(self, providers, fetcher, hedge_after=1.0, deadline=10.0, failure_threshold=3, reset_timeout=60.0):
+        self.providers = providers
+        self.fetcher = fetcher
+        self.hedge_after = hedge_after
+        self.deadline = deadline
+        self.breakers = {provider.name: CircuitBreaker(failure_threshold, reset_timeout) for provider in providers}
+
+    def call(self, provider, key):
+        breaker = self.breakers[provider.name]
+        try:
+            value = provider.fetch(self.fetcher, key)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return value
+
+    def get(self, key):
+        candidates = [provider for provider in self.providers if provider.supports(key)]
+        deadline_at = time.monotonic() + self.deadline
+        pending = {}
+        errors = []
+
+        def launch():
+            # Breakers are only consulted when a provider is actually needed, so an unused
+            # backup does not burn its half-open trial
+            while candidates:
+                provider = candidates.pop(0)
+                if self.breakers[provider.name].allow():
+                    pending[self.fetcher.executor.submit(self.call, provider, key)] = provider
+                    return True
+                errors.append(f"{provider.name}: circuit open")
+            return False
+
+        launch()
+        while pending:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=min(self.hedge_after, remaining) if candidates else remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    launch()
+        for future, provider in pending.items():
+            if future.cancel():
+                self.breakers[provider.name].release()
+        errors.extend(f"{provider.name}: deadline exceeded" for provider in pending.values())
+        raise FetchError(f"{key}: all providers failed ({'; '.join(errors)})")
+
+    def stats_snapshot(self):
+        return {name: {'state': breaker.state, 'failures': breaker.failures} for name, breaker in self.breakers.items()}
+
+
+def build_chain(names, fetcher, **kwargs):
+    return ProviderChain([PROVIDERS[name]() for name in names], fetcher, **kwargs)
@@ -0,0 +1,55 @@
+import threading
+from collections import deque
+
+
+def format_event(event_id, data, event='price'):
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+class PriceHub:
+    # Fan-out point for new ticks. Each event is formatted once and the same string is handed to every
+    # subscriber; subscribers block on one shared Condition, which under gevent is a greenlet wait
+    # rather than a thread per connection.
+    def __init__(self, history=256):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        self.subscribers = 0
+
+    def publish(self, event_id, data):
+        with self.condition:
+            self.events.append((event_id, format_event(event_id, data)))
+            self.last_id = event_id
+            self.condition.notify_all()
+
+    def events_after(self, event_id):
+        # None when the ring buffer does not reach back to event_id and the caller must resume from the DB
+        with self.condition:
+            if not self.events or self.events[0][0] > event_id:
+                return None
+            return [event for event in self.events if event[0] > event_id]
+
+    def wait(self, event_id, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > event_id, timeout)
+            return [event for event in self.events if event[0] > event_id]
+
+    def stream(self, last_id, backlog, heartbeat):
+        with self.condition:
+            self.subscribers += 1
+        try:
+            yield "retry: 5000\n\n"
+            for event_id, payload in backlog:
+                last_id = event_id
+                yield payload
+            while True:
+                events = self.wait(last_id, heartbeat)
+                if not events:
+                    yield ": heartbeat\n\n"
+                    continue
+                for event_id, payload in events:
+                    last_id = event_id
+                    yield payload
+        finally:
+            with self.condition:
+                self.subscribers -= 1
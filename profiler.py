@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+def folded_stack(thread_name, frame):
+    # Outermost frame first, the format flamegraph.pl and speedscope read
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    # While a profiled block runs, a helper thread snapshots every thread's stack each interval seconds.
+    # Blocks that take at least threshold seconds are written as collapsed stacks to directory;
+    # faster ones are discarded, so leaving it enabled only costs the sampling itself.
+    def __init__(self, directory, interval=0.005, enabled=False):
+        self.directory = directory
+        self.interval = interval
+        self.enabled = enabled
+        self.dumps = 0
+
+    def sample(self, stacks, stop):
+        own = threading.get_ident()
+        while not stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[folded_stack(names.get(ident, str(ident)), frame)] += 1
+
+    @contextmanager
+    def profile(self, label, threshold):
+        if not self.enabled:
+            yield
+            return
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self.sample, args=(stacks, stop), name='profiler', daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            elapsed = time.perf_counter() - started
+            if elapsed >= threshold and stacks:
+                self.dump(label, elapsed, stacks)
+
+    def dump(self, label, elapsed, stacks):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{label}-{time.strftime("%Y%m%dT%H%M%S")}-{int(elapsed * 1000)}ms.folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        self.dumps += 1
+        print(f"Wrote profile of slow {label} ({elapsed:.2f}s) to {path}")
@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class MemoryRateStore:
+    def __init__(self):
+        self.entries = {}
+
+    def load(self, key):
+        return self.entries.get(key)
+
+    def save(self, key, value, fetched_at):
+        self.entries[key] = (value, fetched_at)
+
+
+class RateCache:
+    # TTL cache for slow-moving rates. Entries carry wall-clock fetch times so a persistent store
+    # keeps them valid across restarts. With stale_while_revalidate an expired entry is returned
+    # immediately while a single background refresh runs on the executor.
+    def __init__(self, fetch, ttl=3600, store=None, stale_while_revalidate=True, max_stale=None, executor=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.store = store or MemoryRateStore()
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_stale = max_stale
+        self.executor = executor
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            entry = self.store.load(key)
+            if entry is not None:
+                with self.lock:
+                    self.entries[key] = entry
+        if entry is None:
+            return self.refresh(key)
+        value, fetched_at = entry
+        age = time.time() - fetched_at
+        if age < self.ttl:
+            return value
+        if not self.stale_while_revalidate or (self.max_stale is not None and age >= self.max_stale):
+            return self.refresh(key)
+        self.refresh_in_background(key)
+        return value
+
+    def refresh(self, key):
+        value = self.fetch(key)
+        fetched_at = time.time()
+        with self.lock:
+            self.entries[key] = (value, fetched_at)
+        self.store.save(key, value, fetched_at)
+        return value
+
+    def refresh_in_background(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(key)
+            except Exception as e:
+                print(f"Error refreshing rate {key}: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        if self.executor is not None:
+            self.executor.submit(run)
+        else:
+            threading.Thread(target=run, daemon=True).start()
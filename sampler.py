@@ -0,0 +1,160 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+MIN_INTERVAL = 5.0
+
+
+class StageStats:
+    # Duration of each tick stage (fetch, db, alert, ...) plus how late each tick started.
+    # observer(stage, seconds), when given, also receives every recording, e.g. for a histogram.
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.ticks = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+
+    def record(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': None}
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['last'] = seconds
+        if self.observer is not None:
+            self.observer(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record_tick(self, lag):
+        with self.lock:
+            self.ticks += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'ticks': self.ticks,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag,
+                'stages': {
+                    name: dict(stats, mean=stats['total'] / stats['count']) for name, stats in self.stages.items()
+                }
+            }
+
+
+class Sampler:
+    # Runs tick(scheduled_at) on wall-clock boundaries (multiples of interval since the epoch), so the
+    # schedule does not drift with tick duration. Ticks run one at a time on a single thread; boundaries
+    # that pass while a tick is still running are reported through on_missed rather than queued.
+    # With a lease only the process holding it samples, the others keep trying each boundary. The holder also
+    # renews it every third of lease.ttl from a heartbeat thread, so a tick longer than ttl keeps the lease.
+    def __init__(self, tick, interval, lease=None, on_missed=None, on_leader=None, stats=None, clock=time.time):
+        if interval < MIN_INTERVAL:
+            raise ValueError(f"interval must be at least {MIN_INTERVAL} seconds")
+        self.tick = tick
+        self.interval = interval
+        self.lease = lease
+        self.on_missed = on_missed
+        self.on_leader = on_leader
+        self.stats = stats or StageStats()
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.thread = None
+        self.heartbeat = None
+        self.leader = lease is None
+        self.missed = 0
+
+    def next_boundary(self, after):
+        return (math.floor(after / self.interval) + 1) * self.interval
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+            self.thread.start()
+        if self.lease is not None and (self.heartbeat is None or not self.heartbeat.is_alive()):
+            self.heartbeat = threading.Thread(target=self.beat, name='sampler-heartbeat', daemon=True)
+            self.heartbeat.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.lease is not None and self.leader:
+            self.lease.release()
+            self.leader = False
+
+    def mark_missed(self, start, end, count, reason):
+        self.missed += count
+        if self.on_missed is not None:
+            try:
+                self.on_missed(start, end, count, reason)
+            except Exception as e:
+                print(f"Error recording missed ticks: {e}")
+
+    def acquire(self, scheduled):
+        try:
+            acquired = self.lease.acquire()
+        except Exception as e:
+            print(f"Error renewing sampler lease: {e}")
+            acquired = False
+        if acquired and not self.leader and self.on_leader is not None:
+            # Taking over from a stopped process or another worker
+            try:
+                self.on_leader(scheduled)
+            except Exception as e:
+                print(f"Error checking for missed ticks: {e}")
+        self.leader = acquired
+        return acquired
+
+    def renew(self):
+        # Only the holder renews; losing the lease here stops it acting as leader until a boundary wins it back
+        if not self.leader:
+            return
+        try:
+            renewed = self.lease.acquire()
+        except Exception as e:
+            print(f"Error renewing sampler lease: {e}")
+            renewed = False
+        if not renewed:
+            self.leader = False
+
+    def beat(self):
+        while not self.stopped.wait(self.lease.ttl / 3):
+            self.renew()
+
+    def run_once(self, scheduled):
+        started = self.clock()
+        self.stats.record_tick(max(0.0, started - scheduled))
+        try:
+            ok = self.tick(scheduled)
+        except Exception as e:
+            print(f"Error running sample tick: {e}")
+            ok = False
+        self.stats.record('tick', self.clock() - started)
+        if ok is False:
+            self.mark_missed(scheduled, scheduled, 1, 'failed')
+
+    def run(self):
+        scheduled = self.next_boundary(self.clock())
+        while not self.stopped.wait(max(0.0, scheduled - self.clock())):
+            if self.lease is not None and not self.acquire(scheduled):
+                scheduled = self.next_boundary(self.clock())
+                continue
+            self.run_once(scheduled)
+            following = self.next_boundary(self.clock())
+            skipped = round((following - scheduled) / self.interval) - 1
+            if skipped > 0:
+                self.mark_missed(scheduled + self.interval, following - self.interval, skipped, 'overrun')
+            scheduled = following
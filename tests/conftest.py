@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import msal
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LocalMsalApp:
+    # gold_tracker builds its MSAL client at import time; this one never touches the network
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_accounts(self):
+        return []
+
+
+@pytest.fixture(scope='session')
+def gt():
+    directory = tempfile.mkdtemp(prefix='gold-tracker-tests-')
+    os.environ['GOLD_TRACKER_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'test.db')}"
+    msal.ConfidentialClientApplication = LocalMsalApp
+    import gold_tracker
+    with gold_tracker.app.app_context():
+        gold_tracker.migrate_db()
+    return gold_tracker
+
+
+@pytest.fixture
+def app_context(gt):
+    # Every test starts from empty tables and cold in-memory caches
+    with gt.app.app_context():
+        for table in reversed(gt.db.metadata.sorted_tables):
+            gt.db.session.execute(table.delete())
+        gt.db.session.commit()
+        gt.today_series.clear()
+        gt.price_analytics.clear()
+        gt.data_version.value = None
+        gt.subscribers_changed()
+        yield
+        gt.db.session.remove()
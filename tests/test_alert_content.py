@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import pytest
+
+from alert_rules import describe_rule
+
+AT = datetime(2026, 1, 5, 12, 30)
+
+
+@pytest.mark.parametrize('kind, threshold, window_days, expected', [
+    ('below', 100.0, None, 'The gold price is now 95.00 EUR per gram, which is below 100.00 EUR.'),
+    ('above', 90.0, None, 'The gold price is now 95.00 EUR per gram, which is above 90.00 EUR.'),
+    ('pct_move', 1.0, None, 'The gold price is now 95.00 EUR per gram, which is a move of +1.00% versus the previous close.'),
+    ('new_low', None, 1, 'The gold price is now 95.00 EUR per gram, which is a new low.'),
+    ('new_high', None, 30, 'The gold price is now 95.00 EUR per gram, which is a new 30-day high.'),
+])
+def test_single_alert_reads_as_a_sentence(gt, kind, threshold, window_days, expected):
+    assert gt.alert_content([('XAU', 'EUR', 95.0, describe_rule(kind, threshold, window_days, 'EUR'), AT)]) == expected
+
+
+def test_digest_lists_each_alert(gt):
+    batch = [
+        ('XAU', 'EUR', 95.0, describe_rule('below', 100.0, None, 'EUR'), AT),
+        ('XAG', 'USD', 1.05, describe_rule('new_low', None, 7, 'USD'), datetime(2026, 1, 5, 12, 45)),
+    ]
+    assert gt.alert_content(batch) == (
+        'Triggered alerts:\n'
+        '- gold below 100.00 EUR: 95.00 EUR at 12:30 UTC\n'
+        '- silver a new 7-day low: 1.05 USD at 12:45 UTC'
+    )
@@ -0,0 +1,53 @@
+import math
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from analytics import PriceAnalytics
+
+START = date(2021, 1, 4)
+
+
+def closes(days, seed=1):
+    rng = random.Random(seed)
+    price = 60.0
+    series = []
+    for _ in range(days):
+        price *= math.exp(rng.gauss(0, 0.01))
+        series.append(price)
+    return series
+
+
+def approx(value):
+    return pytest.approx(value, rel=1e-9, abs=1e-12)
+
+
+def assert_reports_match(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            assert_reports_match(actual[key], value)
+        elif key == 'days':
+            assert actual[key] == value
+        elif isinstance(value, list):
+            # NaN is serialized as None, which approx does not compare
+            assert [v is None for v in actual[key]] == [v is None for v in value], key
+            assert [v for v in actual[key] if v is not None] == approx([v for v in value if v is not None]), key
+        else:
+            assert actual[key] == approx(value), key
+
+
+def test_incremental_updates_match_a_full_load():
+    values = closes(5 * 365)
+    days = [START + timedelta(days=i) for i in range(len(values))]
+    full = PriceAnalytics()
+    full.load(days, values)
+    incremental = PriceAnalytics()
+    incremental.load(days[:1000], values[:1000])
+    for day, close in zip(days[1000:], values[1000:]):
+        # Intra-day ticks rewrite the same row before the day's final close
+        incremental.update(day, close * 1.01)
+        incremental.update(day, close)
+    for window in (30, 365, len(values)):
+        assert_reports_match(incremental.report(window), full.report(window))
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from benchmark import OUNCE_GRAMS, percentile, recorded_tape, regressions, summarize, synthetic_tape
+from bulk_io import PRICE_COLUMNS, write_rows
+
+START = datetime(2025, 1, 2, 12, 0)
+
+
+def report(ticks_per_sec=100.0, p99_ms=20.0, compact_seconds=None):
+    found = {'replay': {'ticks_per_sec': ticks_per_sec, 'stages': {'tick': {'p99_ms': p99_ms}}}}
+    if compact_seconds is not None:
+        found['compact'] = {'seconds': compact_seconds}
+    return found
+
+
+def test_synthetic_tape_is_reproducible():
+    first = list(synthetic_tape(5, START, 60, 7, ['XAU', 'XAG'], ['EUR', 'USD']))
+    assert first == list(synthetic_tape(5, START, 60, 7, ['XAU', 'XAG'], ['EUR', 'USD']))
+    assert first != list(synthetic_tape(5, START, 60, 8, ['XAU', 'XAG'], ['EUR', 'USD']))
+    assert [timestamp for timestamp, _, _ in first] == [datetime(2025, 1, 2, 12, minute) for minute in range(5)]
+    # Quotes are USD based, so USD itself has no rate
+    assert all(set(spot) == {'XAU', 'XAG'} and set(fx) == {'EUR'} for _, spot, fx in first)
+
+
+def test_recorded_tape_turns_an_export_back_into_upstream_quotes(tmp_path):
+    path = str(tmp_path / 'tape.csv')
+    write_rows(path, PRICE_COLUMNS, [[
+        ('2025-01-02T12:00:00', 'XAU', 'USD', 100.0),
+        ('2025-01-02T12:00:00', 'XAU', 'EUR', 90.0),
+        # No USD price, so this tick cannot be replayed
+        ('2025-01-02T12:01:00', 'XAU', 'EUR', 91.0),
+        ('2025-01-02T12:02:00', 'XAU', 'USD', 110.0),
+    ]])
+    tape = list(recorded_tape(path))
+    assert [timestamp for timestamp, _, _ in tape] == [datetime(2025, 1, 2, 12, 0), datetime(2025, 1, 2, 12, 2)]
+    assert tape[0][1] == {'XAU': pytest.approx(100.0 * OUNCE_GRAMS)}
+    assert tape[0][2]['EUR'] == pytest.approx(0.9)
+    # EUR is missing from the last tick and keeps its previous rate
+    assert tape[1][2]['EUR'] == pytest.approx(0.9)
+
+
+def test_summarize_reports_percentiles_in_milliseconds():
+    assert percentile([3, 1, 2, 4], 0.5) == 2
+    assert summarize([]) == {'count': 0}
+    stats = summarize([i / 1000 for i in range(1, 101)])
+    assert (stats['count'], stats['p50_ms'], stats['p99_ms'], stats['max_ms']) == (100, 50.0, 99.0, 100.0)
+
+
+def test_regressions_within_tolerance_pass():
+    assert regressions(report(80.0, 24.0), report(100.0, 20.0), 0.25) == []
+
+
+def test_regressions_flag_slower_numbers_in_either_direction():
+    found = regressions(report(70.0, 30.0), report(100.0, 20.0), 0.25)
+    assert found == ['replay.ticks_per_sec: 100.0 -> 70.0 (-30%)', 'replay.stages.tick.p99_ms: 20.0 -> 30.0 (+50%)']
+
+
+def test_regressions_skip_sections_missing_from_either_report():
+    assert regressions(report(compact_seconds=9.0), report(), 0.25) == []
+    assert regressions(report(), report(compact_seconds=1.0), 0.25) == []
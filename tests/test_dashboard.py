@@ -0,0 +1,61 @@
+from sqlalchemy import event
+
+
+def test_creating_a_subscriber_refreshes_the_dashboard(gt, app_context):
+    client = gt.app.test_client()
+    first = client.get('/')
+    assert b'xxx@domain.com' in first.data
+    assert client.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert client.post('/subscribers', json={'email': 'first@example.com'}).status_code == 201
+    second = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert b'first@example.com' in second.data
+
+
+def test_dashboard_etag_follows_edits_from_another_worker(gt, app_context):
+    client = gt.app.test_client()
+    etag = client.get('/').headers['ETag']
+    gt.db.session.execute(gt.db.text("UPDATE cache_generation SET value = value + 1 WHERE name = 'subscribers'"))
+    gt.db.session.commit()
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    # The follower job (or the leader's next tick) picks the edit up
+    gt.sync_subscriber_caches()
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_dashboard_revalidation_does_not_query_the_database(gt, app_context):
+    client = gt.app.test_client()
+    etag = client.get('/').headers['ETag']
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(gt.db.engine, 'before_cursor_execute', listener)
+    try:
+        response = client.get('/', headers={'If-None-Match': etag})
+    finally:
+        event.remove(gt.db.engine, 'before_cursor_execute', listener)
+    assert response.status_code == 304
+    assert statements == []
+
+
+def test_dashboard_etag_changes_with_the_page_version(gt, app_context, monkeypatch):
+    client = gt.app.test_client()
+    etag = client.get('/').headers['ETag']
+    assert gt.page_version in etag
+    monkeypatch.setattr(gt, 'page_version', 'next-deploy')
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'next-deploy' in response.headers['ETag']
+
+
+def test_page_digest_covers_the_vendored_assets(gt, monkeypatch):
+    before = gt.page_digest()
+    monkeypatch.setitem(gt.asset_versions, 'plotly.min.js', 1700000000)
+    assert gt.page_digest() != before
+    with gt.app.test_request_context():
+        assert gt.asset_url('plotly.min.js') == '/vendor/plotly.min.js?v=1700000000'
+
+
+def test_page_digest_follows_the_app_version(gt, monkeypatch):
+    before = gt.page_digest()
+    monkeypatch.setitem(gt.app.config, 'APP_VERSION', 'v2')
+    assert gt.page_digest() != before
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+SERIES = ('XAU', 'EUR')
+
+
+def store_elsewhere(gt, timestamp, price):
+    # A tick committed by another worker, bypassing this process' store_prices
+    row = gt.GoldPrice(timestamp=timestamp, instrument=SERIES[0], currency=SERIES[1], price=price)
+    gt.db.session.add(row)
+    gt.update_rollup(SERIES, timestamp, price)
+    gt.db.session.commit()
+    return row.id
+
+
+def test_follower_replays_the_leaders_ticks(gt, app_context):
+    now = datetime.utcnow().replace(microsecond=0)
+    first = store_elsewhere(gt, now - timedelta(seconds=90), 100.0)
+    today = gt.today_series[SERIES]
+    today.load(now.date())
+    analytics = gt.load_analytics(SERIES)
+    assert gt.data_version.current() == first
+    latest = store_elsewhere(gt, now, 101.5)
+    gt.data_version.poll()
+    assert gt.data_version.current() == latest
+    assert list(today.prices) == [100.0, 101.5]
+    assert gt.price_hubs[SERIES].last_id == latest
+    assert analytics.report(1)['close'][-1] == 101.5
+
+
+def test_follower_reloads_after_a_historical_import(gt, app_context):
+    now = datetime.utcnow()
+    store_elsewhere(gt, now, 100.0)
+    gt.today_series[SERIES].load(now.date())
+    gt.data_version.current()
+    store_elsewhere(gt, now - timedelta(days=3), 90.0)
+    gt.data_version.poll()
+    assert SERIES not in gt.today_series
+
+
+def test_rule_edits_from_another_worker_reach_the_rule_cache(gt, app_context):
+    gt.rule_indexes.get(SERIES)
+    gt.sync_subscriber_caches()
+    gt.db.session.execute(gt.db.text("UPDATE cache_generation SET value = value + 1 WHERE name = 'subscribers'"))
+    gt.db.session.commit()
+    gt.sync_subscriber_caches()
+    assert gt.rule_indexes.indexes == {}
@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta
+
+SERIES = ('XAU', 'EUR')
+
+
+def resolution(gt, span, max_points):
+    end = datetime.utcnow()
+    return gt.price_history(SERIES, end - span, end, max_points, 'lttb', 'g')['resolution']
+
+
+def test_raw_tier_follows_the_sample_interval(gt, app_context, monkeypatch):
+    assert resolution(gt, timedelta(days=2), 500) == 'raw'
+    # Eighteen times as many raw ticks over the same range: the 15 minute tier bounds the work instead
+    monkeypatch.setitem(gt.app.config, 'SAMPLE_INTERVAL', 5)
+    assert resolution(gt, timedelta(days=2), 500) == '15m'
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from ingest import IngestWriter
+
+
+class Store:
+    # write_batch stand-in: records each batch and answers with one result per sample
+    def __init__(self, hold=False):
+        self.batches = []
+        self.released = threading.Event()
+        if not hold:
+            self.released.set()
+        self.fail = set()
+
+    def __call__(self, samples):
+        self.released.wait(5)
+        self.batches.append(samples)
+        if len(self.batches) in self.fail:
+            raise RuntimeError("database is locked")
+        return [f'row-{value}' for value, in samples]
+
+
+def test_samples_queued_behind_a_write_share_one_batch():
+    store = Store(hold=True)
+    writer = IngestWriter(store, batch_size=3, linger=0)
+    futures = [writer.submit(0)]
+    # The first sample is taken alone while the rest queue up behind the held write
+    time.sleep(0.05)
+    futures += [writer.submit(value) for value in range(1, 7)]
+    store.released.set()
+    assert [future.result(5) for future in futures] == [f'row-{value}' for value in range(7)]
+    assert [len(batch) for batch in store.batches] == [1, 3, 3]
+    assert (writer.batches, writer.samples) == (3, 7)
+
+
+def test_samples_arriving_within_the_linger_join_the_batch():
+    store = Store()
+    writer = IngestWriter(store, batch_size=10, linger=0.5)
+    first = writer.submit(1)
+    time.sleep(0.05)
+    second = writer.submit(2)
+    assert (first.result(5), second.result(5)) == ('row-1', 'row-2')
+    assert store.batches == [[(1,), (2,)]]
+
+
+def test_failed_write_fails_every_future_in_the_batch_and_the_writer_carries_on():
+    store = Store(hold=True)
+    store.fail = {2}
+    writer = IngestWriter(store, batch_size=10, linger=0)
+    first = writer.submit(1)
+    time.sleep(0.05)
+    failed = [writer.submit(value) for value in (2, 3)]
+    time.sleep(0.05)
+    store.released.set()
+    assert first.result(5) == 'row-1'
+    for future in failed:
+        with pytest.raises(RuntimeError, match='database is locked'):
+            future.result(5)
+    assert writer.submit(4).result(5) == 'row-4'
+    assert (writer.batches, writer.samples) == (2, 2)
+    assert writer.thread.is_alive()
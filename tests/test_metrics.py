@@ -0,0 +1,74 @@
+import copy
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from metrics import Registry
+
+
+def observed(histogram, *labels):
+    series = histogram.values.get(labels)
+    return series[2] if series else 0
+
+
+def test_statements_are_timed_per_query_label(gt, app_context):
+    before = observed(gt.db_query_seconds, 'select gold_price')
+    gt.GoldPrice.query.count()
+    assert observed(gt.db_query_seconds, 'select gold_price') == before + 1
+
+
+def test_failed_statements_leave_nothing_on_the_connection(gt, app_context):
+    with gt.db.engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+        info = copy.deepcopy(connection.info)
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("SELECT * FROM no_such_table")
+            connection.rollback()
+        connection.exec_driver_sql("SELECT 1")
+        assert connection.info == info
+    assert observed(gt.db_query_seconds, 'select no_such_table') == 0
+
+
+def test_registry_renders_the_text_exposition_format():
+    registry = Registry(prefix='app_')
+    requests = registry.counter('requests_total', "Requests served", ('endpoint',))
+    requests.inc(endpoint='/')
+    requests.inc(2, endpoint='/history')
+    registry.gauge('queue_depth', "Queued samples", fn=lambda: 3)
+    latency = registry.histogram('latency_seconds', "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    assert registry.render() == '\n'.join([
+        '# HELP app_requests_total Requests served',
+        '# TYPE app_requests_total counter',
+        'app_requests_total{endpoint="/"} 1',
+        'app_requests_total{endpoint="/history"} 2',
+        '# HELP app_queue_depth Queued samples',
+        '# TYPE app_queue_depth gauge',
+        'app_queue_depth 3',
+        '# HELP app_latency_seconds Latency',
+        '# TYPE app_latency_seconds histogram',
+        'app_latency_seconds_bucket{le="0.1"} 1',
+        'app_latency_seconds_bucket{le="1.0"} 2',
+        'app_latency_seconds_bucket{le="+Inf"} 3',
+        'app_latency_seconds_sum 5.55',
+        'app_latency_seconds_count 3',
+    ]) + '\n'
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('errors_total', "Errors", ('message',)).inc(message='say "hi"\\n\nbye')
+    assert 'errors_total{message="say \\"hi\\"\\\\n\\nbye"} 1' in registry.render()
+
+
+def test_metrics_endpoint(gt, app_context):
+    gt.GoldPrice.query.count()
+    response = gt.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == Registry.content_type
+    body = response.get_data(as_text=True)
+    assert '# TYPE gold_tracker_db_query_seconds histogram' in body
+    assert 'gold_tracker_db_query_seconds_bucket{query="select gold_price",le="+Inf"}' in body
+    assert '\ngold_tracker_sampler_leader ' in body
@@ -0,0 +1,131 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+SERIES = ('XAU', 'EUR')
+
+
+def enqueue(gt, recipient='buyer@example.com', price=95.0, created_at=None):
+    created_at = created_at or datetime.utcnow() - timedelta(minutes=5)
+    gt.enqueue_alert(recipient, SERIES, price, created_at, 'below 100.00 EUR')
+    gt.db.session.commit()
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    # POST /me/sendMail answers with the next queued status, 202 once the queue is empty
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests.append((self.path, self.headers['Authorization'], body))
+            status = self.server.statuses.pop(0) if self.server.statuses else 202
+        payload = b'{"error": {"code": "ServiceUnavailable"}}' if status >= 400 else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def graph(gt, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GraphHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(gt.app.config, 'GRAPH_URL', f'http://127.0.0.1:{server.server_port}/v1.0')
+    monkeypatch.setattr(gt, 'get_access_token', lambda: 'graph-token')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def recipients(request):
+    return [entry['EmailAddress']['Address'] for entry in request[2]['Message']['ToRecipients']]
+
+
+def test_delivered_alert_is_marked_sent(gt, app_context, graph):
+    enqueue(gt)
+    gt.deliver_alerts()
+    assert len(graph.requests) == 1
+    path, authorization, body = graph.requests[0]
+    assert (path, authorization) == ('/v1.0/me/sendMail', 'Bearer graph-token')
+    assert recipients(graph.requests[0]) == ['buyer@example.com']
+    assert 'below 100.00 EUR' in body['Message']['Body']['Content']
+    message = gt.OutboxMessage.query.one()
+    assert (message.status, message.attempts) == ('sent', 0)
+    assert message.sent_at is not None
+    gt.deliver_alerts()
+    assert len(graph.requests) == 1
+
+
+def test_server_error_keeps_the_row_and_backs_off(gt, app_context, graph):
+    graph.statuses = [503, 503]
+    enqueue(gt)
+    before = datetime.utcnow()
+    gt.deliver_alerts()
+    message = gt.OutboxMessage.query.one()
+    assert (message.status, message.attempts) == ('pending', 1)
+    assert 'ServiceUnavailable' in message.last_error
+    backoff = timedelta(seconds=gt.app.config['ALERT_RETRY_BACKOFF'])
+    assert before + backoff <= message.next_attempt_at <= datetime.utcnow() + backoff
+    # Not due yet, so the next run leaves it alone
+    gt.deliver_alerts()
+    assert len(graph.requests) == 1
+    # Once due it is retried, and a second failure doubles the backoff
+    message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    gt.db.session.commit()
+    before = datetime.utcnow()
+    gt.deliver_alerts()
+    gt.db.session.refresh(message)
+    assert (message.status, message.attempts) == ('pending', 2)
+    assert message.next_attempt_at >= before + 2 * backoff
+    assert len(graph.requests) == 2
+
+
+def test_pending_alerts_for_a_recipient_are_coalesced(gt, app_context, graph):
+    enqueue(gt, price=95.0, created_at=datetime.utcnow() - timedelta(minutes=5))
+    enqueue(gt, price=94.0, created_at=datetime.utcnow() - timedelta(minutes=4))
+    enqueue(gt, recipient='seller@example.com', price=93.0)
+    gt.deliver_alerts()
+    assert sorted(address for request in graph.requests for address in recipients(request)) == ['buyer@example.com', 'seller@example.com']
+    digest = next(body['Message']['Body']['Content'] for _, _, body in graph.requests if 'Triggered alerts' in body['Message']['Body']['Content'])
+    assert '95.00 EUR' in digest and '94.00 EUR' in digest
+    assert {message.status for message in gt.OutboxMessage.query} == {'sent'}
+
+
+def test_alerts_inside_the_coalescing_window_wait(gt, app_context, graph):
+    enqueue(gt, created_at=datetime.utcnow())
+    gt.deliver_alerts()
+    assert graph.requests == []
+    assert gt.OutboxMessage.query.one().status == 'pending'
+
+
+def test_rows_claimed_by_another_worker_are_skipped(gt, app_context, monkeypatch):
+    sent = []
+    monkeypatch.setattr(gt, 'send_email', lambda recipient, content: sent.append(recipient))
+    enqueue(gt)
+    # A second worker that also believes it holds the lease claimed the row a moment ago
+    gt.OutboxMessage.query.update({'status': 'sending', 'next_attempt_at': datetime.utcnow() + timedelta(minutes=5)})
+    gt.db.session.commit()
+    gt.deliver_alerts()
+    assert sent == []
+    assert gt.OutboxMessage.query.one().status == 'sending'
+
+
+def test_expired_claims_are_taken_over(gt, app_context, monkeypatch):
+    sent = []
+    monkeypatch.setattr(gt, 'send_email', lambda recipient, content: sent.append(recipient))
+    enqueue(gt)
+    # The claiming worker stopped mid-send
+    gt.OutboxMessage.query.update({'status': 'sending', 'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+    gt.db.session.commit()
+    gt.deliver_alerts()
+    assert sent == ['buyer@example.com']
+    assert gt.OutboxMessage.query.one().status == 'sent'
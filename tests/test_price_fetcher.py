@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from price_fetcher import FetchError, PriceFetcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # /ok answers at once, /slow?delay=s after s seconds, /flaky?failures=n with a 503 for its first n
+    # requests, /broken always with a 500 and /garbage with a body that is not JSON
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self.server.lock:
+            self.server.hits[url.path] += 1
+            hits = self.server.hits[url.path]
+        if url.path == '/slow':
+            time.sleep(float(query['delay']))
+        if url.path == '/broken' or (url.path == '/flaky' and hits <= int(query['failures'])):
+            self.respond(503 if url.path == '/flaky' else 500, b'{"error": "unavailable"}')
+        elif url.path == '/garbage':
+            self.respond(200, b'<html>maintenance</html>')
+        else:
+            self.respond(200, json.dumps({'price': 3300.0, 'path': url.path}).encode())
+
+    def respond(self, status, body):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.hits = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_success_records_latency(stub):
+    calls = []
+    fetcher = PriceFetcher(on_request=lambda url, seconds, ok: calls.append((url, ok)))
+    assert fetcher.get_json('stub', f'{stub.url}/ok') == {'price': 3300.0, 'path': '/ok'}
+    stats = fetcher.stats_snapshot()['stub']
+    assert (stats['successes'], stats['failures'], stats['retries']) == (1, 0, 0)
+    assert stats['last_ms'] is not None
+    assert calls == [(f'{stub.url}/ok', True)]
+
+
+def test_failures_are_retried(stub):
+    fetcher = PriceFetcher(retries=2, backoff=0.01)
+    assert fetcher.get_json('stub', f'{stub.url}/flaky?failures=2')['price'] == 3300.0
+    stats = fetcher.stats_snapshot()['stub']
+    assert (stats['successes'], stats['failures'], stats['retries']) == (1, 2, 2)
+
+
+@pytest.mark.parametrize('path', ['/broken', '/garbage'])
+def test_retries_are_bounded(stub, path):
+    fetcher = PriceFetcher(retries=2, backoff=0.01)
+    with pytest.raises(FetchError):
+        fetcher.get_json('stub', stub.url + path)
+    assert stub.hits[path] == 3
+
+
+def test_slow_source_times_out(stub):
+    fetcher = PriceFetcher(timeout=0.2, retries=0)
+    started = time.monotonic()
+    with pytest.raises(FetchError):
+        fetcher.get_json('stub', f'{stub.url}/slow?delay=1.0')
+    assert time.monotonic() - started < 0.8
+
+
+def test_deadline_bounds_the_retries(stub):
+    fetcher = PriceFetcher(timeout=0.3, deadline=0.5, retries=5, backoff=0.01)
+    started = time.monotonic()
+    with pytest.raises(FetchError):
+        fetcher.get_json('stub', f'{stub.url}/slow?delay=1.0')
+    assert time.monotonic() - started < 0.9
+    assert stub.hits['/slow'] <= 2
+
+
+def test_sources_are_fetched_concurrently(stub):
+    fetcher = PriceFetcher(pool_size=4)
+    started = time.monotonic()
+    futures = [fetcher.executor.submit(fetcher.get_json, f'stub{i}', f'{stub.url}/slow?delay=0.4') for i in range(4)]
+    assert all(future.result()['price'] == 3300.0 for future in futures)
+    assert time.monotonic() - started < 1.2
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from price_fetcher import FetchError, PriceFetcher
+from price_providers import FakeProvider, ProviderChain
+
+
+def test_cancelled_trial_does_not_keep_the_breaker_open():
+    fetcher = PriceFetcher(pool_size=1)
+    provider = FakeProvider('fake')
+    chain = ProviderChain([provider], fetcher, deadline=0.1, failure_threshold=1, reset_timeout=0)
+    breaker = chain.breakers['fake']
+    breaker.record_failure()
+    assert breaker.state == 'half-open'
+    # With the only fetcher thread busy the trial call is still queued at the deadline and gets cancelled
+    busy = threading.Event()
+    fetcher.executor.submit(busy.wait, 5)
+    with pytest.raises(FetchError, match='deadline exceeded'):
+        chain.get('XAU')
+    busy.set()
+    assert provider.calls == 0
+    assert not breaker.trial_running
+    assert chain.get('XAU') == 3300.0
+    assert breaker.state == 'closed'
+
+
+def chain_of(primary, backup, **kwargs):
+    return ProviderChain([primary, backup], PriceFetcher(pool_size=4), **kwargs)
+
+
+def test_fast_primary_is_not_hedged():
+    primary, backup = FakeProvider('primary', {'XAU': 3300.0}, delay=0.05), FakeProvider('backup', {'XAU': 3301.0})
+    chain = chain_of(primary, backup, hedge_after=1.0)
+    assert chain.get('XAU') == 3300.0
+    assert (primary.calls, backup.calls) == (1, 0)
+
+
+def test_slow_primary_is_hedged_after_hedge_after():
+    primary, backup = FakeProvider('primary', {'XAU': 3300.0}, delay=1.0), FakeProvider('backup', {'XAU': 3301.0})
+    chain = chain_of(primary, backup, hedge_after=0.1)
+    started = time.monotonic()
+    assert chain.get('XAU') == 3301.0
+    elapsed = time.monotonic() - started
+    assert 0.1 <= elapsed < 0.5
+    assert (primary.calls, backup.calls) == (1, 1)
+
+
+def test_failing_primary_fails_over_without_waiting_for_the_hedge():
+    primary, backup = FakeProvider('primary', fail=True), FakeProvider('backup', {'XAU': 3301.0})
+    chain = chain_of(primary, backup, hedge_after=5.0)
+    started = time.monotonic()
+    assert chain.get('XAU') == 3301.0
+    assert time.monotonic() - started < 1.0
+    assert chain.stats_snapshot()['primary'] == {'state': 'closed', 'failures': 1}
+
+
+def test_breaker_opens_after_repeated_failures():
+    primary, backup = FakeProvider('primary', fail=True), FakeProvider('backup', {'XAU': 3301.0})
+    chain = chain_of(primary, backup, hedge_after=5.0, failure_threshold=2, reset_timeout=60.0)
+    assert chain.get('XAU') == 3301.0
+    assert chain.breakers['primary'].state == 'closed'
+    assert chain.get('XAU') == 3301.0
+    assert chain.stats_snapshot()['primary'] == {'state': 'open', 'failures': 2}
+    # While open the primary is skipped entirely
+    assert chain.get('XAU') == 3301.0
+    assert (primary.calls, backup.calls) == (2, 3)
+
+
+def test_open_breaker_lets_one_trial_through_after_reset_timeout():
+    primary, backup = FakeProvider('primary', {'XAU': 3300.0}, fail=True), FakeProvider('backup', {'XAU': 3301.0})
+    chain = chain_of(primary, backup, hedge_after=5.0, failure_threshold=1, reset_timeout=0.1)
+    assert chain.get('XAU') == 3301.0
+    assert chain.breakers['primary'].state == 'open'
+    time.sleep(0.15)
+    assert chain.breakers['primary'].state == 'half-open'
+    primary.fail = False
+    assert chain.get('XAU') == 3300.0
+    assert chain.breakers['primary'].state == 'closed'
+
+
+def test_all_providers_failing_raises_with_every_error():
+    primary, backup = FakeProvider('primary', fail=True), FakeProvider('backup', fail=True)
+    chain = chain_of(primary, backup, hedge_after=5.0, failure_threshold=1)
+    with pytest.raises(FetchError, match='primary: simulated failure; backup: simulated failure'):
+        chain.get('XAU')
+    with pytest.raises(FetchError, match='primary: circuit open; backup: circuit open'):
+        chain.get('XAU')
@@ -0,0 +1,76 @@
+import time
+
+from rate_cache import MemoryRateStore, RateCache
+
+
+class InlineExecutor:
+    # Runs background refreshes before submit returns, so tests see their effect immediately
+    def submit(self, fn):
+        fn()
+
+
+class Upstream:
+    def __init__(self, value=0.9):
+        self.value = value
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self, key):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return self.value
+
+
+def cache_with(entry_age, upstream, **kwargs):
+    store = MemoryRateStore()
+    store.save('USD/EUR', 0.8, time.time() - entry_age)
+    return RateCache(upstream, ttl=3600, store=store, executor=InlineExecutor(), **kwargs), store
+
+
+def test_fresh_entry_is_served_without_fetching():
+    upstream = Upstream()
+    cache, _ = cache_with(60, upstream)
+    assert cache.get('USD/EUR') == 0.8
+    assert upstream.calls == 0
+
+
+def test_cold_cache_fetches_and_persists():
+    upstream = Upstream()
+    cache = RateCache(upstream, ttl=3600, executor=InlineExecutor())
+    assert cache.get('USD/EUR') == 0.9
+    assert cache.get('USD/EUR') == 0.9
+    assert upstream.calls == 1
+    assert cache.store.load('USD/EUR')[0] == 0.9
+
+
+def test_stale_entry_is_served_while_revalidating():
+    upstream = Upstream()
+    cache, store = cache_with(4000, upstream, stale_while_revalidate=True, max_stale=86400)
+    assert cache.get('USD/EUR') == 0.8
+    assert upstream.calls == 1
+    assert store.load('USD/EUR')[0] == 0.9
+    assert cache.get('USD/EUR') == 0.9
+
+
+def test_expired_entry_is_refreshed_before_answering():
+    upstream = Upstream()
+    cache, _ = cache_with(100000, upstream, stale_while_revalidate=True, max_stale=86400)
+    assert cache.get('USD/EUR') == 0.9
+    upstream.calls = 0
+    cache, _ = cache_with(4000, upstream, stale_while_revalidate=False)
+    assert cache.get('USD/EUR') == 0.9
+    assert upstream.calls == 1
+
+
+def test_failed_background_refresh_keeps_the_stale_value_and_retries():
+    upstream = Upstream()
+    upstream.fail = True
+    cache, store = cache_with(4000, upstream, stale_while_revalidate=True, max_stale=86400)
+    assert cache.get('USD/EUR') == 0.8
+    assert store.load('USD/EUR')[0] == 0.8
+    assert cache.refreshing == set()
+    upstream.fail = False
+    assert cache.get('USD/EUR') == 0.8
+    assert upstream.calls == 2
+    assert cache.get('USD/EUR') == 0.9
@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+SERIES = ('XAU', 'EUR')
+DAY = date(2026, 1, 5)
+
+
+def store_day(gt):
+    start = datetime.combine(DAY, datetime.min.time())
+    rows = [(start + timedelta(seconds=90 * i), *SERIES, 100.0 + i % 50) for i in range(960)]
+    gt.import_prices([rows])
+
+
+def tiers(gt):
+    rollup = gt.DailyRollup.query.filter_by(instrument='XAU', currency='EUR', day=DAY).one()
+    start, end = gt.day_range(DAY)
+    buckets = {
+        resolution: gt.PriceAggregate.query.filter_by(instrument='XAU', currency='EUR', resolution=resolution).filter(gt.PriceAggregate.bucket >= start, gt.PriceAggregate.bucket < end).count()
+        for resolution in gt.AGGREGATE_RESOLUTIONS.values()
+    }
+    return (rollup.count, rollup.low, rollup.high, rollup.open, rollup.close), buckets
+
+
+def test_compaction_keeps_the_tiers(gt, app_context):
+    store_day(gt)
+    before = tiers(gt)
+    assert before == ((960, 100.0, 149.0, 100.0, 109.0), {900: 96, 14400: 6})
+    assert gt.apply_retention(datetime(2026, 3, 1)) == 1
+    assert gt.GoldPrice.query.count() == 0
+    assert tiers(gt) == before
+
+
+def test_import_into_a_compacted_day_folds_instead_of_rebuilding(gt, app_context):
+    store_day(gt)
+    gt.apply_retention(datetime(2026, 3, 1))
+    before = tiers(gt)
+    # Inside the span the compacted day covers: already accounted for
+    assert gt.import_prices([[(datetime(2026, 1, 5, 12, 0, 30), *SERIES, 120.0)]]) == (0, 1)
+    assert tiers(gt) == before
+    # After the last compacted tick: folded into the existing tiers
+    assert gt.import_prices([[(datetime(2026, 1, 5, 23, 59, 30), *SERIES, 160.0)]]) == (1, 1)
+    (count, low, high, _, close), buckets = tiers(gt)
+    assert (count, low, high, close) == (961, 100.0, 160.0, 160.0)
+    assert buckets == {900: 96, 14400: 6}
+
+
+def test_rebuild_leaves_compacted_days_alone(gt, app_context):
+    store_day(gt)
+    gt.apply_retention(datetime(2026, 3, 1))
+    gt.import_prices([[(datetime(2026, 1, 5, 23, 59, 30), *SERIES, 160.0)]])
+    before = tiers(gt)
+    # An older raw row makes a full rebuild start before the compacted day
+    gt.import_prices([[(datetime(2026, 1, 2, 8, 0), *SERIES, 90.0)]])
+    gt.rebuild_rollups()
+    assert tiers(gt) == before
+    assert gt.DailyRollup.query.filter_by(instrument='XAU', currency='EUR', day=date(2026, 1, 2)).one().count == 1
@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+
+from sampler import Sampler
+
+
+class FakeLease:
+    def __init__(self, ttl=0.3, available=True):
+        self.ttl = ttl
+        self.available = available
+        self.acquired = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.acquired += 1
+            return self.available
+
+    def release(self):
+        pass
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStop:
+    # Stands in for Sampler.stopped: waiting moves the fake clock instead of sleeping
+    def __init__(self, clock):
+        self.clock = clock
+        self.flag = False
+
+    def wait(self, timeout):
+        self.clock.now += timeout
+        return self.flag
+
+    def set(self):
+        self.flag = True
+
+    def clear(self):
+        self.flag = False
+
+    def is_set(self):
+        return self.flag
+
+
+class ScriptedLease:
+    # Answers acquire() from a list and stops the sampler once it runs out
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.ttl = 30
+        self.sampler = None
+
+    def acquire(self):
+        if not self.answers:
+            self.sampler.stopped.set()
+            return False
+        return self.answers.pop(0)
+
+    def release(self):
+        pass
+
+
+def fake_sampler(tick, start, ticks, lease=None, **kwargs):
+    # Runs the sampler loop in the calling thread until ticks ticks have run
+    clock = FakeClock(start)
+    scheduled = []
+
+    def record(at):
+        scheduled.append((at, clock.now))
+        if len(scheduled) == ticks:
+            sampler.stopped.set()
+        return tick(clock, at)
+
+    sampler = Sampler(record, 5.0, lease=lease, clock=clock, **kwargs)
+    sampler.stopped = FakeStop(clock)
+    if lease is not None:
+        lease.sampler = sampler
+    return sampler, clock, scheduled
+
+
+def advance(seconds, ok=True):
+    def tick(clock, scheduled):
+        clock.now += seconds
+        return ok
+    return tick
+
+
+def test_interval_below_the_minimum_is_rejected():
+    with pytest.raises(ValueError):
+        Sampler(lambda scheduled: True, 1.0)
+
+
+def test_ticks_run_on_interval_boundaries():
+    sampler, clock, scheduled = fake_sampler(advance(1.2), 12.3, 3)
+    sampler.run()
+    # Aligned to multiples of the interval, and not pushed back by the tick duration
+    assert scheduled == [(15.0, 15.0), (20.0, 20.0), (25.0, 25.0)]
+    assert sampler.missed == 0
+    assert sampler.stats.snapshot()['ticks'] == 3
+
+
+def test_overrunning_tick_reports_the_boundaries_it_skipped():
+    missed = []
+    durations = iter([11.0, 1.0])
+
+    def tick(clock, at):
+        clock.now += next(durations)
+        return True
+
+    sampler, clock, scheduled = fake_sampler(tick, 12.0, 2, on_missed=lambda *args: missed.append(args))
+    sampler.run()
+    assert [at for at, _ in scheduled] == [15.0, 30.0]
+    assert missed == [(20.0, 25.0, 2, 'overrun')]
+    assert sampler.missed == 2
+
+
+def test_failed_tick_is_reported_as_missed():
+    missed = []
+    sampler, clock, scheduled = fake_sampler(advance(0.5, ok=False), 0.0, 1, on_missed=lambda *args: missed.append(args))
+    sampler.run()
+    assert missed == [(5.0, 5.0, 1, 'failed')]
+
+
+def test_only_the_lease_holder_ticks():
+    leaders = []
+    lease = ScriptedLease([False, False, True, True, False])
+    sampler, clock, scheduled = fake_sampler(advance(1.0), 0.0, 10, lease=lease, on_leader=leaders.append)
+    sampler.leader = False
+    sampler.run()
+    # Boundaries 5 and 10 went to another worker; this one took over at 15 and lost the lease again at 25
+    assert [at for at, _ in scheduled] == [15.0, 20.0]
+    assert leaders == [15.0]
+    assert not sampler.leader
+
+
+def test_heartbeat_renews_the_lease_during_a_long_tick():
+    lease = FakeLease()
+    sampler = Sampler(lambda scheduled: True, 5.0, lease=lease)
+    sampler.leader = True
+    sampler.start()
+    try:
+        threading.Event().wait(1.0)
+        assert lease.acquired >= 2
+        assert sampler.leader
+        # Another worker took over: the heartbeat notices and this process stops acting as leader
+        lease.available = False
+        threading.Event().wait(0.3)
+        assert not sampler.leader
+    finally:
+        sampler.stop()
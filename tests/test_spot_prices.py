@@ -0,0 +1,16 @@
+import time
+
+from price_providers import FakeProvider, ProviderChain
+
+
+def test_every_instruments_hedge_runs_while_primaries_stall(gt, monkeypatch):
+    # Each instrument's primary stalls, so every chain needs its hedge at the same time on the shared pool
+    chain = ProviderChain([FakeProvider('stalled', delay=2.0), FakeProvider('backup', delay=0.3)], gt.price_fetcher, hedge_after=0.3, deadline=5.0)
+    monkeypatch.setattr(gt, 'spot_providers', chain)
+    monkeypatch.setattr(gt, 'get_fx_rates', lambda: {'USD': 1.0})
+    started = time.monotonic()
+    prices = gt.get_spot_prices()
+    elapsed = time.monotonic() - started
+    assert set(prices) == {(instrument, 'USD') for instrument in gt.app.config['INSTRUMENTS']}
+    # Hedges queued behind each other would finish at 0.6, 0.9 and 1.2 s
+    assert elapsed < 0.85
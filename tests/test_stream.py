@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from price_stream import PriceHub
+
+SERIES = ('XAU', 'EUR')
+
+
+@pytest.fixture
+def hubs(gt, monkeypatch):
+    hubs = gt.SeriesRegistry(lambda series: PriceHub(history=4))
+    monkeypatch.setattr(gt, 'price_hubs', hubs)
+    monkeypatch.setitem(gt.app.config, 'STREAM_HEARTBEAT', 0.05)
+    return hubs
+
+
+def read(response, count):
+    # The stream never ends by itself; take the first count chunks and hang up
+    chunks = response.iter_encoded()
+    try:
+        return [next(chunks).decode() for _ in range(count)]
+    finally:
+        response.close()
+
+
+def event_ids(chunks):
+    return [int(chunk.split('\n')[0][len('id: '):]) for chunk in chunks if chunk.startswith('id: ')]
+
+
+def publish(gt, hubs, event_id, price):
+    hubs[SERIES].publish(event_id, gt.price_event(datetime(2025, 1, 2, 12, 0), SERIES, price))
+
+
+def test_new_client_starts_at_the_live_edge(gt, app_context, hubs):
+    publish(gt, hubs, 1, 95.0)
+    chunks = read(gt.app.test_client().get('/stream', buffered=False), 2)
+    assert chunks == ['retry: 5000\n\n', ': heartbeat\n\n']
+
+
+def test_resume_replays_the_ring_buffer(gt, app_context, hubs):
+    for event_id in range(1, 5):
+        publish(gt, hubs, event_id, 95.0 + event_id)
+    response = gt.app.test_client().get('/stream', headers={'Last-Event-ID': '2'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = read(response, 4)
+    assert event_ids(chunks) == [3, 4]
+    assert '"price": 99.0' in chunks[2]
+    assert chunks[3] == ': heartbeat\n\n'
+
+
+def test_resume_past_the_ring_buffer_replays_from_the_database(gt, app_context, hubs):
+    start = datetime(2025, 1, 2, 12, 0)
+    rows = [gt.GoldPrice(timestamp=start + timedelta(minutes=minute), instrument=SERIES[0], currency=SERIES[1], price=90.0 + minute) for minute in range(8)]
+    gt.db.session.add_all(rows)
+    gt.db.session.add(gt.GoldPrice(timestamp=start, instrument='XAG', currency='EUR', price=1.0))
+    gt.db.session.commit()
+    ids = [row.id for row in rows]
+    # The hub only remembers the last four ticks
+    for row in rows[4:]:
+        publish(gt, hubs, row.id, row.price)
+    response = gt.app.test_client().get('/stream', query_string={'last_event_id': ids[1]}, buffered=False)
+    assert event_ids(read(response, 7)) == ids[2:]
+
+
+def test_resume_then_follows_live_ticks(gt, app_context, hubs):
+    publish(gt, hubs, 1, 95.0)
+    response = gt.app.test_client().get('/stream', headers={'Last-Event-ID': '1'}, buffered=False)
+    chunks = response.iter_encoded()
+    try:
+        assert next(chunks) == b'retry: 5000\n\n'
+        publish(gt, hubs, 2, 96.0)
+        assert next(chunks).startswith(b'id: 2\n')
+    finally:
+        response.close()
+    assert hubs[SERIES].subscribers == 0
+
+
+def test_invalid_last_event_id_is_rejected(gt, app_context, hubs):
+    response = gt.app.test_client().get('/stream', headers={'Last-Event-ID': 'abc'})
+    assert response.status_code == 400
@@ -0,0 +1,57 @@
+def test_duplicate_emails_are_a_conflict(gt, app_context):
+    client = gt.app.test_client()
+    client.post('/subscribers', json={'email': 'first@example.com'})
+    second = client.post('/subscribers', json={'email': 'second@example.com'}).get_json()
+    assert client.post('/subscribers', json={'email': 'first@example.com'}).status_code == 409
+    response = client.patch(f"/subscribers/{second['id']}", json={'email': 'first@example.com'})
+    assert response.status_code == 409
+    assert client.get(f"/subscribers/{second['id']}").get_json()['email'] == 'second@example.com'
+    # The dashboard form edits the first subscriber
+    assert client.post('/', data={'recipient_email': 'second@example.com'}).status_code == 409
+
+
+def test_enabled_must_be_a_boolean(gt, app_context):
+    client = gt.app.test_client()
+    assert client.post('/subscribers', json={'email': 'first@example.com', 'enabled': 'no'}).status_code == 400
+    subscriber = client.post('/subscribers', json={'email': 'first@example.com'}).get_json()
+    assert client.patch(f"/subscribers/{subscriber['id']}", json={'enabled': 0}).status_code == 400
+    assert client.patch(f"/subscribers/{subscriber['id']}", json={'enabled': False}).get_json()['enabled'] is False
+    rules = f"/subscribers/{subscriber['id']}/rules"
+    assert client.post(rules, json={'kind': 'below', 'threshold': 80.0, 'enabled': 'yes'}).status_code == 400
+    assert client.post(rules, json={'kind': 'below', 'threshold': 80.0}).get_json()['enabled'] is True
+
+
+def test_rule_fields_are_type_checked_for_every_kind(gt, app_context):
+    client = gt.app.test_client()
+    subscriber = client.post('/subscribers', json={'email': 'first@example.com'}).get_json()
+    rules = f"/subscribers/{subscriber['id']}/rules"
+    for body in (
+        {'kind': 'new_low', 'threshold': 'abc'},
+        {'kind': 'below', 'threshold': True},
+        {'kind': 'below', 'threshold': 80.0, 'window_days': 'seven'},
+        {'kind': 'below', 'threshold': 80.0, 'window_days': 0},
+        {'kind': 'new_high', 'window_days': True},
+        {'kind': 'above', 'threshold': 80.0, 'cooldown_seconds': 1.5},
+        {'kind': 7},
+        {'kind': 'below', 'threshold': 80.0, 'instrument': ['XAU']},
+    ):
+        assert client.post(rules, json=body).status_code == 400, body
+    rule = client.post(rules, json={'kind': 'new_low', 'window_days': 7}).get_json()
+    assert client.patch(f"/rules/{rule['id']}", json={'threshold': 'abc'}).status_code == 400
+    assert client.get(f"/rules/{rule['id']}").get_json()['threshold'] is None
+
+
+def test_bodies_must_be_json_objects(gt, app_context):
+    client = gt.app.test_client()
+    subscriber = client.post('/subscribers', json={'email': 'first@example.com'}).get_json()
+    rule = client.post(f"/subscribers/{subscriber['id']}/rules", json={'kind': 'new_low'}).get_json()
+    for method, path in (('post', '/subscribers'), ('patch', f"/subscribers/{subscriber['id']}"),
+                         ('post', f"/subscribers/{subscriber['id']}/rules"), ('patch', f"/rules/{rule['id']}")):
+        assert getattr(client, method)(path, json=[1]).status_code == 400, path
+
+
+def test_negative_paging_is_rejected(gt, app_context):
+    client = gt.app.test_client()
+    assert client.get('/subscribers?limit=-1').status_code == 400
+    assert client.get('/subscribers?offset=-5').status_code == 400
+    assert client.get('/subscribers?limit=0').get_json() == []
@@ -0,0 +1,81 @@
+import pytest
+
+
+class FakeMsalApp:
+    # Hands out access-1, access-2, ... and rotates the refresh token on each grant
+    def __init__(self, accounts=(), expires_in=3600):
+        self.accounts = list(accounts)
+        self.expires_in = expires_in
+        self.calls = []
+
+    def grant(self):
+        number = len(self.calls)
+        return {'access_token': f'access-{number}', 'refresh_token': f'refresh-{number}', 'expires_in': self.expires_in}
+
+    def get_accounts(self):
+        return self.accounts
+
+    def acquire_token_silent(self, scopes, account, force_refresh=False):
+        self.calls.append(('silent', force_refresh))
+        return self.grant()
+
+    def acquire_token_by_refresh_token(self, refresh_token, scopes):
+        self.calls.append(('refresh_token', refresh_token))
+        return self.grant()
+
+
+@pytest.fixture
+def tokens(gt, app_context, monkeypatch):
+    msal_app = FakeMsalApp()
+    monkeypatch.setattr(gt, 'msal_app', msal_app)
+    return gt.TokenManager(refresh_margin=300), msal_app
+
+
+def test_no_token_without_a_login(gt, tokens):
+    manager, msal_app = tokens
+    assert manager.get() is None
+    assert msal_app.calls == []
+
+
+def test_access_token_is_reused_until_close_to_expiry(gt, tokens):
+    manager, msal_app = tokens
+    gt.db.session.add(gt.RefreshToken(token='refresh-0'))
+    gt.db.session.commit()
+    assert manager.get() == 'access-1'
+    assert manager.get() == 'access-1'
+    assert msal_app.calls == [('refresh_token', 'refresh-0')]
+    # Entra ID rotated the refresh token, the stored row follows
+    assert gt.RefreshToken.query.one().token == 'refresh-1'
+
+
+def test_token_inside_the_refresh_margin_is_renewed(gt, tokens):
+    manager, msal_app = tokens
+    msal_app.expires_in = 200
+    gt.db.session.add(gt.RefreshToken(token='refresh-0'))
+    gt.db.session.commit()
+    assert manager.get() == 'access-1'
+    assert manager.get() == 'access-2'
+    assert msal_app.calls == [('refresh_token', 'refresh-0'), ('refresh_token', 'refresh-1')]
+
+
+def test_invalidated_token_is_force_refreshed_from_the_cache(gt, tokens):
+    manager, msal_app = tokens
+    msal_app.accounts = [{'username': 'alerts@example.com'}]
+    assert manager.get() == 'access-1'
+    manager.invalidate()
+    assert manager.get() == 'access-2'
+    assert msal_app.calls == [('silent', False), ('silent', False)]
+    # An expired in-memory token asks MSAL to skip its own cached copy
+    manager.expires_at = 0
+    assert manager.get() == 'access-3'
+    assert msal_app.calls[-1] == ('silent', True)
+
+
+def test_first_refresh_token_refreshes_the_dashboard(gt, tokens):
+    manager, msal_app = tokens
+    msal_app.accounts = [{'username': 'alerts@example.com'}]
+    client = gt.app.test_client()
+    etag = client.get('/').headers['ETag']
+    assert manager.get() == 'access-1'
+    assert gt.RefreshToken.query.one().token == 'refresh-1'
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200